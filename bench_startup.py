@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Замер времени запуска с большим файлом ответов: ранняя загрузка против ленивой
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from survey_storage import JsonStorage
+
+RESPONSES_COUNT = 500000
+
+
+def generate_data(data_dir, count):
+    """Создаем анкету и count ответов на нее"""
+    survey = {
+        'id': str(uuid.uuid4()),
+        'title': "Тестовая анкета",
+        'questions': [
+            {'id': 'q0', 'text': "Пол", 'type': 'radio', 'required': True,
+             'options': ["Мужской", "Женский"], 'conditions': []},
+            {'id': 'q1', 'text': "Возраст", 'type': 'number', 'required': True,
+             'options': [], 'conditions': []},
+            {'id': 'q2', 'text': "Комментарий", 'type': 'text', 'required': False,
+             'options': [], 'conditions': []},
+        ],
+        'createdAt': datetime.now().isoformat(),
+        'isActive': True
+    }
+    completed_at = datetime.now().isoformat()
+    responses = [
+        {
+            'id': str(uuid.uuid4()),
+            'surveyId': survey['id'],
+            'answers': {'q0': "Женский" if i % 2 else "Мужской", 'q1': 18 + i % 60, 'q2': "Все хорошо"},
+            'completedAt': completed_at
+        }
+        for i in range(count)
+    ]
+    storage = JsonStorage(data_dir)
+    storage.save_surveys([survey])
+    storage.save_responses(responses)
+    return survey
+
+
+def measure(data_dir, survey, eager):
+    """Запуск + один ответ респондента; возвращаем время запуска и сохранения"""
+    start = time.perf_counter()
+    storage = JsonStorage(data_dir)
+    storage.load_surveys()
+    if eager:
+        storage.load_responses()
+    startup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    storage.append_response({
+        'id': str(uuid.uuid4()),
+        'surveyId': survey['id'],
+        'answers': {'q0': "Мужской", 'q1': 30, 'q2': ""},
+        'completedAt': datetime.now().isoformat()
+    })
+    submit = time.perf_counter() - start
+    return startup, submit
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else RESPONSES_COUNT
+    data_dir = tempfile.mkdtemp(prefix="surveyapp_bench_")
+    try:
+        print(f"Генерирую {count} ответов...")
+        survey = generate_data(data_dir, count)
+        shard_file = JsonStorage(data_dir).shard_path(survey['id'])
+        size_mb = os.path.getsize(shard_file) / 1024 / 1024
+        print(f"{os.path.basename(shard_file)}: {size_mb:.1f} МБ")
+
+        eager_startup, eager_submit = measure(data_dir, survey, eager=True)
+        lazy_startup, lazy_submit = measure(data_dir, survey, eager=False)
+
+        print(f"Ранняя загрузка: запуск {eager_startup * 1000:.1f} мс, сохранение ответа {eager_submit * 1000:.2f} мс")
+        print(f"Ленивая загрузка: запуск {lazy_startup * 1000:.1f} мс, сохранение ответа {lazy_submit * 1000:.2f} мс")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сводки ответов по вопросам - счетчики, обновляемые при каждом новом ответе
+"""
+
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+from survey_columnar import questions_hash
+from survey_storage import shard_name, write_json_atomic
+
+# Каталог файлов сводок (по файлу на анкету) в директории данных
+AGGREGATES_DIRNAME = "aggregates"
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value == value
+
+
+def value_label(value) -> str:
+    """Ключ счетчика значения (ключи JSON - только строки)"""
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+class SurveyAggregates:
+    """Счетчики по вопросам одной анкеты
+
+    Для каждого вопроса - число ответивших и сводка по типу вопроса:
+    радио - сколько раз выбран каждый вариант, чекбоксы - сколько раз
+    отмечен каждый вариант, числа - количество, сумма, минимум и
+    максимум, текст - число непустых ответов. Новый ответ добавляется
+    за O(числа его ответов).
+    """
+
+    def __init__(self, survey: Dict):
+        self.survey_id = survey['id']
+        self.layout = questions_hash(survey)
+        self.rows = 0
+        self.questions: Dict[str, Dict[str, Any]] = {}
+        for question in survey['questions']:
+            kind = question.get('type')
+            if kind == 'number':
+                stats = {'kind': 'number', 'answered': 0, 'count': 0, 'sum': 0, 'min': None, 'max': None}
+            elif kind == 'text':
+                stats = {'kind': 'text', 'answered': 0, 'nonEmpty': 0}
+            else:
+                # Варианты анкеты идут первыми, даже если их еще никто не выбрал
+                stats = {'kind': 'checkbox' if kind == 'checkbox' else 'options', 'answered': 0,
+                         'counts': {value_label(option): 0 for option in question.get('options', [])}}
+            self.questions.setdefault(question['id'], stats)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SurveyAggregates":
+        aggregates = cls({'id': data['surveyId'], 'questions': []})
+        aggregates.layout = data['layout']
+        aggregates.rows = data['rows']
+        aggregates.questions = data['questions']
+        return aggregates
+
+    def add(self, answers: Dict):
+        """Учитываем ответы одного респондента"""
+        self.rows += 1
+        for question_id, answer in answers.items():
+            stats = self.questions.get(question_id)
+            if stats is None or answer is None:
+                continue
+            stats['answered'] += 1
+            kind = stats['kind']
+            if kind == 'number':
+                if _is_number(answer):
+                    stats['count'] += 1
+                    stats['sum'] += answer
+                    stats['min'] = answer if stats['min'] is None else min(stats['min'], answer)
+                    stats['max'] = answer if stats['max'] is None else max(stats['max'], answer)
+            elif kind == 'text':
+                if str(answer).strip():
+                    stats['nonEmpty'] += 1
+            elif kind == 'checkbox' and isinstance(answer, list):
+                counts = stats['counts']
+                for option in answer:
+                    label = value_label(option)
+                    counts[label] = counts.get(label, 0) + 1
+            else:
+                label = value_label(answer)
+                stats['counts'][label] = stats['counts'].get(label, 0) + 1
+
+    def to_dict(self) -> Dict:
+        return {'surveyId': self.survey_id, 'layout': self.layout, 'rows': self.rows, 'questions': self.questions}
+
+
+def aggregate_responses(survey: Dict, responses: Iterable[Dict]) -> SurveyAggregates:
+    """Сводка по всем ответам анкеты за один проход"""
+    aggregates = SurveyAggregates(survey)
+    for response in responses:
+        answers = response.get('answers')
+        aggregates.add(answers if isinstance(answers, dict) else {})
+    return aggregates
+
+
+class AggregateStore:
+    """Сводки анкет в файлах aggregates/<id анкеты>.json
+
+    Файл сводки обновляется после записи каждого ответа (в потоке
+    сохранения) и хранит число учтенных ответов и отпечаток вопросов.
+    Если они не совпадают с хранилищем (сбой между записью ответа и
+    сводки, импорт, смена вариантов), сводка пересчитывается за один
+    проход по ответам анкеты.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._cache: Dict[str, SurveyAggregates] = {}
+        # Сводки обновляет поток сохранения, а читает GUI-поток
+        self._lock = threading.Lock()
+
+    def path(self, survey_id: str) -> str:
+        return os.path.join(self.directory, shard_name(survey_id) + ".json")
+
+    def _load(self, survey_id: str) -> Optional[SurveyAggregates]:
+        aggregates = self._cache.get(survey_id)
+        if aggregates is None and os.path.exists(self.path(survey_id)):
+            try:
+                with open(self.path(survey_id), 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                aggregates = self._cache[survey_id] = SurveyAggregates.from_dict(data)
+            except Exception as e:
+                print(f"Ошибка загрузки сводки ответов: {e}")
+        return aggregates
+
+    def _save(self, aggregates: SurveyAggregates):
+        # Сводка восстанавливается пересчетом, резервная копия не нужна
+        write_json_atomic(self.path(aggregates.survey_id), aggregates.to_dict())
+        self._cache[aggregates.survey_id] = aggregates
+
+    def rebuild(self, storage, survey: Dict) -> SurveyAggregates:
+        """Пересчитываем сводку анкеты по всем ее ответам"""
+        with self._lock:
+            return self._rebuild(storage, survey)
+
+    def _rebuild(self, storage, survey: Dict) -> SurveyAggregates:
+        aggregates = aggregate_responses(survey, storage.iter_responses(survey['id']))
+        self._save(aggregates)
+        return aggregates
+
+    def get(self, storage, survey: Dict) -> SurveyAggregates:
+        """Сводка анкеты; пересчитывается, только если устарела"""
+        with self._lock:
+            aggregates = self._load(survey['id'])
+            if aggregates is not None and aggregates.layout == questions_hash(survey) and \
+                    aggregates.rows == storage.count_responses(survey['id']):
+                return aggregates
+        return self.rebuild(storage, survey)
+
+    def add(self, storage, survey: Dict, response: Dict):
+        """Учитываем новый ответ, уже записанный в хранилище
+
+        Если сводки еще нет (первый ответ, сброс после импорта) или она
+        устарела, она пересчитывается здесь же, в потоке сохранения, -
+        один раз, дальше ответы снова добавляются по одному.
+        """
+        with self._lock:
+            aggregates = self._load(survey['id'])
+            if aggregates is not None and aggregates.layout == questions_hash(survey) and \
+                    aggregates.rows == storage.count_responses(survey['id']) - 1:
+                aggregates.add(response.get('answers', {}))
+                try:
+                    self._save(aggregates)
+                except Exception:
+                    # Сводка в памяти уже учла ответ, а файл - нет: отбрасываем
+                    # ее, и следующее чтение возьмет файл (или пересчитает)
+                    self._cache.pop(survey['id'], None)
+                    raise
+            else:
+                self._rebuild(storage, survey)
+
+    def delete(self, survey_id: str):
+        """Удаляем сводку анкеты"""
+        with self._lock:
+            self._delete(survey_id)
+
+    def _delete(self, survey_id: str):
+        self._cache.pop(survey_id, None)
+        if os.path.exists(self.path(survey_id)):
+            os.remove(self.path(survey_id))
+
+    def reset(self):
+        """Отбрасываем все сводки (после импорта) - они будут пересчитаны при обращении"""
+        with self._lock:
+            self._cache = {}
+            for filename in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, filename))
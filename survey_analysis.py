@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Анализ ответов - пересчет условной логики и кросс-таблицы по всей истории ответов массивами NumPy
+"""
+
+from typing import Any, Dict, List, Tuple
+
+from survey_columnar import MISSING, NUMBER_FLOAT, NUMBER_INT, ColumnarResponses, numpy, open_columnar
+from survey_conditions import OPERATORS, CompiledSurvey
+from survey_export import format_answer
+from survey_responses import value_key
+
+# Категория кросс-таблицы для респондентов без ответа на вопрос (и без отметок в чекбоксах)
+NO_ANSWER = "(нет ответа)"
+
+
+def answer_codes(columnar: ColumnarResponses, question_id: str) -> Tuple[Any, List]:
+    """Ответы на вопрос: коды int32 (MISSING - нет ответа) и таблица различных значений
+
+    Радио-вопросы уже хранятся кодами; чекбоксы, числа и текст кодируются
+    по различным значениям. Ответы из блока исключений дописываются в
+    таблицу, так что значения в ней - в точности сохраненные ответы.
+    """
+    rows = len(columnar)
+    meta = columnar.columns.get(question_id)
+    codes = numpy.full(rows, MISSING, dtype=numpy.int32)
+    values: List[Any] = []
+    kind = meta['kind'] if meta else None
+
+    if kind == 'codes':
+        codes[:] = columnar.section(meta['codes'])
+        values = list(meta['values'])
+    elif kind == 'checkbox':
+        present = columnar.section(meta['present']).astype(bool)
+        unique, inverse = numpy.unique(columnar.section(meta['mask'])[present], return_inverse=True)
+        codes[present] = inverse
+        options = meta['options']
+        values = [[option for i, option in enumerate(options) if int(mask) >> i & 1] for mask in unique]
+    elif kind == 'number':
+        flags = columnar.section(meta['present'])
+        numbers = columnar.section(meta['values'])
+        for flag, convert in ((NUMBER_INT, int), (NUMBER_FLOAT, float)):
+            selected = flags == flag
+            unique, inverse = numpy.unique(numbers[selected], return_inverse=True)
+            codes[selected] = inverse + len(values)
+            values.extend(convert(number) for number in unique)
+    elif kind == 'text':
+        present = columnar.section(meta['present'])
+        offsets = columnar.section(meta['offsets']).tolist()
+        blob = columnar.section_bytes(meta['blob'])
+        index = {}
+        for row in numpy.flatnonzero(present).tolist():
+            text = blob[offsets[row]:offsets[row + 1]]
+            code = index.get(text)
+            if code is None:
+                code = index[text] = len(values)
+                values.append(text.decode('utf-8'))
+            codes[row] = code
+
+    # В исключения попадают только ответы, не подходящие столбцу, поэтому
+    # со значениями из столбца они не совпадают - индекс нужен только по ним
+    index = {}
+    for row, extra in columnar.extras.items():
+        answers = extra.get('answers')
+        if not answers or question_id not in answers:
+            continue
+        key = value_key(answers[question_id])
+        code = index.get(key)
+        if code is None:
+            code = index[key] = len(values)
+            values.append(answers[question_id])
+        codes[row] = code
+    return codes, values
+
+
+def condition_table(condition: Dict, values: List) -> Any:
+    """Результат условия для каждого значения из таблицы (последний элемент - для MISSING)
+
+    Проверка та же, что у compile_condition: нет ответа - условие не выполнено.
+    """
+    table = numpy.zeros(len(values) + 1, dtype=bool)
+    factory = OPERATORS.get(condition['operator'])
+    if factory is None:
+        return table
+    predicate = factory(condition['value'])
+    for i, value in enumerate(values):
+        table[i] = value is not None and predicate(value)
+    return table
+
+
+class ConditionEvaluator:
+    """Условия показа по всем ответам сразу: булев массив на условие
+
+    Условие вычисляется один раз на каждое различное значение ответа,
+    а затем раскладывается по строкам выборкой table[codes], поэтому
+    миллион ответов обрабатывается за доли секунды. Коды вопросов и
+    результаты одинаковых условий кэшируются.
+    """
+
+    def __init__(self, columnar: ColumnarResponses):
+        self.columnar = columnar
+        self.rows = len(columnar)
+        self._codes: Dict[str, Tuple[Any, List]] = {}
+        self._masks: Dict[Any, Any] = {}
+
+    def codes(self, question_id: str) -> Tuple[Any, List]:
+        encoded = self._codes.get(question_id)
+        if encoded is None:
+            encoded = self._codes[question_id] = answer_codes(self.columnar, question_id)
+        return encoded
+
+    def condition_mask(self, condition: Dict) -> Any:
+        """Для каких ответов условие выполняется"""
+        key = (condition['targetId'], condition['operator'], value_key(condition['value']))
+        mask = self._masks.get(key)
+        if mask is None:
+            codes, values = self.codes(condition['targetId'])
+            mask = self._masks[key] = condition_table(condition, values)[codes]
+        return mask
+
+    def visibility(self, compiled: CompiledSurvey, index: int) -> Any:
+        """Видел бы вопрос каждый из респондентов (все условия - логическое И)"""
+        visible = numpy.ones(self.rows, dtype=bool)
+        if index == 0 or compiled.always_visible[index]:
+            return visible
+        for condition in compiled.questions[index].get('conditions', []):
+            visible &= self.condition_mask(condition)
+        return visible
+
+
+def reach_counts(columnar: ColumnarResponses, survey: Dict) -> List[Dict]:
+    """Сколько респондентов из файла увидели бы каждый вопрос при условиях анкеты
+
+    Видимость, как и при прохождении, зависит только от сохраненных
+    ответов: вопрос, скрытый раньше, не имеет ответа, и ссылающееся на
+    него условие не выполняется.
+    """
+    compiled = CompiledSurvey(survey)
+    evaluator = ConditionEvaluator(columnar)
+    counts = []
+    for i, question in enumerate(compiled.questions):
+        reached = int(numpy.count_nonzero(evaluator.visibility(compiled, i)))
+        counts.append({'questionId': question['id'], 'reached': reached, 'skipped': evaluator.rows - reached})
+    return counts
+
+
+def reach_counts_scalar(responses, survey: Dict) -> List[Dict]:
+    """То же без NumPy: условия проверяются по каждому ответу"""
+    compiled = CompiledSurvey(survey)
+    reached = [0] * len(compiled)
+    total = 0
+    for response in responses:
+        answers = response.get('answers', {})
+        for i in compiled.visible_indices(answers):
+            reached[i] += 1
+        total += 1
+    return [{'questionId': question['id'], 'reached': count, 'skipped': total - count}
+            for question, count in zip(compiled.questions, reached)]
+
+
+def condition_reach(storage, survey: Dict, cache_dir: str) -> List[Dict]:
+    """Охват вопросов анкеты по всем сохраненным ответам (колоночный кэш в cache_dir)
+
+    Для каждого вопроса - {'questionId', 'reached', 'skipped'}.
+    """
+    if numpy is None:
+        return reach_counts_scalar(storage.iter_responses(survey['id']), survey)
+    with open_columnar(storage, survey, cache_dir) as columnar:
+        return reach_counts(columnar, survey)
+
+
+def is_multiple(question: Dict) -> bool:
+    """Может ли ответ на вопрос попадать в несколько категорий (чекбоксы)"""
+    return question.get('type') == 'checkbox'
+
+
+def _category_labels(question: Dict, values: List) -> Tuple[List[str], List]:
+    """Названия категорий вопроса и категории каждого значения из таблицы
+
+    У чекбоксов категория - вариант (сначала варианты анкеты), у
+    остальных вопросов - само значение ответа. Значение None - это
+    отсутствие ответа (категории None); пустой список чекбоксов - тоже,
+    иначе респондент не попал бы ни в одну строку таблицы.
+    """
+    multiple = is_multiple(question)
+    index = {}
+    labels = []
+    if multiple:
+        for option in question.get('options', []):
+            if value_key(option) not in index:
+                index[value_key(option)] = len(labels)
+                labels.append(format_answer(option))
+    members = []
+    for value in values:
+        if value is None or multiple and value == []:
+            members.append(None)
+            continue
+        categories = []
+        for item in (value if multiple and isinstance(value, list) else [value]):
+            key = value_key(item)
+            if key not in index:
+                index[key] = len(labels)
+                labels.append(format_answer(item))
+            categories.append(index[key])
+        members.append(categories)
+    return labels, members
+
+
+def _encode_categories(codes, values: List, question: Dict) -> Tuple[List[str], Any]:
+    """Коды категорий по строкам: вектор (один ответ) или матрица multi-hot (чекбоксы)
+
+    Последняя категория - NO_ANSWER.
+    """
+    labels, members = _category_labels(question, values)
+    missing = len(labels)
+    labels.append(NO_ANSWER)
+    members.append(None)  # код MISSING (-1) попадает в последний элемент таблицы
+    if not is_multiple(question):
+        table = numpy.array([missing if categories is None else categories[0] for categories in members],
+                            dtype=numpy.int64)
+        return labels, table[codes]
+    table = numpy.zeros((len(members), len(labels)), dtype=bool)
+    for code, categories in enumerate(members):
+        table[code, missing if categories is None else categories] = True
+    return labels, table[codes]
+
+
+def crosstab_counts(columnar: ColumnarResponses, question_a: Dict, question_b: Dict) -> Dict:
+    """Таблица сопряженности ответов на два вопроса
+
+    Ответы кодируются целыми числами (answer_codes), а таблица
+    считается одним numpy.bincount по кодам пар. Чекбоксы разворачиваются
+    в multi-hot: респондент попадает в строку (столбец) каждого отмеченного
+    варианта. Возвращаем {'rows': категории A, 'columns': категории B,
+    'counts': матрица int64}.
+    """
+    rows_labels, a = _encode_categories(*answer_codes(columnar, question_a['id']), question_a)
+    columns_labels, b = _encode_categories(*answer_codes(columnar, question_b['id']), question_b)
+    p, q = len(rows_labels), len(columns_labels)
+    if a.ndim == 1 and b.ndim == 1:
+        counts = numpy.bincount(a * q + b, minlength=p * q).reshape(p, q)
+    elif a.ndim == 1:
+        counts = numpy.stack([numpy.bincount(a[b[:, j]], minlength=p) for j in range(q)], axis=1)
+    elif b.ndim == 1:
+        counts = numpy.stack([numpy.bincount(b[a[:, i]], minlength=q) for i in range(p)])
+    else:
+        # Чекбоксы с обеих сторон: число общих отметок - произведение матриц multi-hot
+        counts = numpy.rint(a.T.astype(numpy.float64) @ b.astype(numpy.float64))
+    return {'rows': rows_labels, 'columns': columns_labels, 'counts': counts.astype(numpy.int64)}
+
+
+def crosstab_counts_scalar(responses, question_a: Dict, question_b: Dict) -> Dict:
+    """То же без NumPy: категории ответов считаются по каждому ответу"""
+    labels = []
+    for question in (question_a, question_b):
+        # Варианты идут первыми, как в колоночном файле
+        options = question.get('options', []) if question.get('type') not in ('number', 'text') else []
+        labels.append({value_key(option): format_answer(option) for option in options})
+
+    def categories(question, answer, known):
+        items = answer if is_multiple(question) and isinstance(answer, list) else [answer]
+        if answer is None or not items:
+            return [NO_ANSWER]
+        keys = [value_key(item) for item in items]
+        for key, item in zip(keys, items):
+            known.setdefault(key, format_answer(item))
+        return keys
+
+    pairs = {}
+    for response in responses:
+        answers = response.get('answers', {})
+        for key_a in categories(question_a, answers.get(question_a['id']), labels[0]):
+            for key_b in categories(question_b, answers.get(question_b['id']), labels[1]):
+                pairs[key_a, key_b] = pairs.get((key_a, key_b), 0) + 1
+
+    orders = []
+    for known in labels:
+        known[NO_ANSWER] = NO_ANSWER
+        orders.append({key: i for i, key in enumerate(known)})
+    counts = [[0] * len(orders[1]) for _ in orders[0]]
+    for (key_a, key_b), count in pairs.items():
+        counts[orders[0][key_a]][orders[1][key_b]] += count
+    return {'rows': list(labels[0].values()), 'columns': list(labels[1].values()), 'counts': counts}
+
+
+def crosstab(storage, survey: Dict, question_a: Dict, question_b: Dict, cache_dir: str) -> Dict:
+    """Кросс-таблица двух вопросов анкеты по всем сохраненным ответам (см. crosstab_counts)"""
+    if numpy is None:
+        return crosstab_counts_scalar(storage.iter_responses(survey['id']), question_a, question_b)
+    with open_columnar(storage, survey, cache_dir) as columnar:
+        result = crosstab_counts(columnar, question_a, question_b)
+    result['counts'] = result['counts'].tolist()
+    return result
@@ -9,9 +9,12 @@ import sys
 import json
 import os
 import csv
+import copy
+import queue
+import threading
 import uuid
 import platform
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
 
 from PyQt6.QtWidgets import (
@@ -21,11 +24,436 @@ from PyQt6.QtWidgets import (
     QTableWidgetItem, QTabWidget, QGroupBox, QMessageBox, 
     QFileDialog, QDialog, QDialogButtonBox, QFormLayout,
     QListWidget, QListWidgetItem, QSplitter, QFrame, QInputDialog,
-    QComboBox
+    QComboBox, QStackedWidget, QTableView, QAbstractItemView, QProgressDialog
 )
-from PyQt6.QtCore import Qt, QTimer, pyqtSignal
+from PyQt6.QtCore import Qt, QTimer, pyqtSignal, QAbstractTableModel, QModelIndex, QThread
 from PyQt6.QtGui import QFont, QIcon, QPixmap, QPalette, QColor
 
+from survey_aggregates import AGGREGATES_DIRNAME, AggregateStore
+from survey_analysis import condition_reach, crosstab
+from survey_columnar import COLUMNAR_CACHE_DIRNAME, COLUMNAR_SUFFIX, ColumnarWriter
+from survey_conditions import CompiledSurvey, VisibilityTracker
+from survey_export import (PROGRESS_STEP, BackupReader, format_answer, survey_changed_at, write_backup,
+                           write_crosstab_csv, write_responses_csv)
+from survey_filters import ResponseFilter
+from survey_search import SEARCH_DIRNAME, TextIndexStore
+from survey_storage import SessionJournal, SqliteStorage, migrate_json_to_sqlite, open_storage, read_json_file, write_json_atomic
+
+class QuestionPage(QWidget):
+    """Страница одного вопроса; создается один раз и переиспользуется"""
+    
+    def __init__(self, question):
+        super().__init__()
+        self.question = question
+        self.answer_text = None
+        self.answer_radio_group = []
+        self.answer_checkboxes = {}
+        self.answer_spinbox = None
+        
+        layout = QVBoxLayout(self)
+        
+        # Заголовок вопроса
+        question_label = QLabel(question['text'])
+        question_label.setFont(QFont("Arial", 14, QFont.Weight.Bold))
+        question_label.setWordWrap(True)
+        layout.addWidget(question_label)
+        
+        if question.get('required', False):
+            required_label = QLabel("* Обязательный вопрос")
+            required_label.setStyleSheet("color: red; font-weight: bold;")
+            layout.addWidget(required_label)
+        
+        # Поле для ответа
+        if question['type'] == 'text':
+            self.answer_text = QTextEdit()
+            self.answer_text.setMaximumHeight(100)
+            layout.addWidget(self.answer_text)
+        
+        elif question['type'] == 'radio':
+            for option in question.get('options', []):
+                radio = QRadioButton(option)
+                self.answer_radio_group.append(radio)
+                layout.addWidget(radio)
+        
+        elif question['type'] == 'checkbox':
+            for option in question.get('options', []):
+                checkbox = QCheckBox(option)
+                self.answer_checkboxes[option] = checkbox
+                layout.addWidget(checkbox)
+        
+        elif question['type'] == 'number':
+            self.answer_spinbox = QSpinBox()
+            self.answer_spinbox.setRange(-999999, 999999)
+            layout.addWidget(self.answer_spinbox)
+        
+        layout.addStretch()
+    
+    def set_answer(self, value):
+        """Выставляем виджеты по сохраненному ответу (None - сброс)"""
+        question_type = self.question['type']
+        
+        if question_type == 'text':
+            self.answer_text.setPlainText(value if value is not None else '')
+        
+        elif question_type == 'radio':
+            for radio in self.answer_radio_group:
+                # Снять отметку с переключателя можно только без автоисключения
+                radio.setAutoExclusive(False)
+                radio.setChecked(radio.text() == value)
+                radio.setAutoExclusive(True)
+        
+        elif question_type == 'checkbox':
+            current_values = value if value is not None else []
+            for option, checkbox in self.answer_checkboxes.items():
+                checkbox.setChecked(option in current_values)
+        
+        elif question_type == 'number':
+            self.answer_spinbox.setValue(int(value if value is not None else 0))
+    
+    def answer(self):
+        """Читаем ответ из виджетов"""
+        question_type = self.question['type']
+        
+        if question_type == 'text':
+            return self.answer_text.toPlainText().strip()
+        elif question_type == 'radio':
+            for radio in self.answer_radio_group:
+                if radio.isChecked():
+                    return radio.text()
+            return ""
+        elif question_type == 'checkbox':
+            return [option for option, checkbox in self.answer_checkboxes.items() if checkbox.isChecked()]
+        elif question_type == 'number':
+            return self.answer_spinbox.value()
+        return ''
+
+
+class SurveyWindow(QDialog):
+    """Окно прохождения анкеты со стеком страниц вопросов
+    
+    Окно и построенные страницы сохраняются между респондентами одной
+    анкеты: при навигации переключается страница стека, а ответы
+    сбрасываются, а не пересоздаются виджеты.
+    """
+    
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setModal(True)
+        self.resize(800, 600)
+        self.pages = {}
+        
+        layout = QVBoxLayout(self)
+        
+        # Прогресс
+        progress_layout = QHBoxLayout()
+        progress_layout.addWidget(QLabel("Прогресс:"))
+        
+        self.progress_bar = QProgressBar()
+        progress_layout.addWidget(self.progress_bar)
+        
+        self.progress_label = QLabel()
+        progress_layout.addWidget(self.progress_label)
+        progress_layout.addStretch()
+        
+        layout.addLayout(progress_layout)
+        
+        # Область для вопросов
+        self.question_stack = QStackedWidget()
+        layout.addWidget(self.question_stack)
+        
+        # Кнопки навигации
+        nav_layout = QHBoxLayout()
+        
+        self.prev_button = QPushButton("Назад")
+        self.next_button = QPushButton("Далее")
+        
+        nav_layout.addWidget(self.prev_button)
+        nav_layout.addStretch()
+        nav_layout.addWidget(self.next_button)
+        
+        layout.addLayout(nav_layout)
+    
+    def page(self, index, question):
+        """Страница вопроса: из кэша или построенная при первом показе"""
+        page = self.pages.get(index)
+        if page is not None and page.question is question:
+            return page
+        
+        # Вопрос изменили в редакторе - старую страницу убираем
+        if page is not None:
+            self.question_stack.removeWidget(page)
+            page.deleteLater()
+        
+        page = QuestionPage(question)
+        self.pages[index] = page
+        self.question_stack.addWidget(page)
+        return page
+
+
+class SurveyTableModel(QAbstractTableModel):
+    """Модель таблицы анкет в админ-панели
+    
+    Ячейки вычисляются только для видимых строк, а количество ответов
+    берется из счетчиков хранилища, без просмотра самих ответов.
+    """
+    
+    HEADERS = ["Название", "Вопросов", "Ответов", "Статус", "Создана"]
+    
+    def __init__(self, surveys, counts, parent=None):
+        super().__init__(parent)
+        self.surveys = surveys
+        self.counts = counts
+    
+    def refresh(self, surveys, counts):
+        """Перечитываем список анкет и счетчики ответов"""
+        self.beginResetModel()
+        self.surveys = surveys
+        self.counts = counts
+        self.endResetModel()
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.surveys)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        
+        survey = self.surveys[index.row()]
+        column = index.column()
+        if column == 0:
+            return survey['title']
+        elif column == 1:
+            return str(len(survey['questions']))
+        elif column == 2:
+            return str(self.counts.get(survey['id'], 0))
+        elif column == 3:
+            return "Активна" if survey.get('isActive', True) else "Неактивна"
+        elif column == 4:
+            return datetime.fromisoformat(survey['createdAt']).strftime("%d.%m.%Y")
+        return None
+
+
+class ResponsesTableModel(QAbstractTableModel):
+    """Ответы одной анкеты, подгружаемые из хранилища страницами
+    
+    Столбцы - дата заполнения и вопросы анкеты (по id); строки
+    запрашиваются через fetchMore по мере прокрутки таблицы. Если
+    передан список порядковых номеров (результат поиска), показываются
+    только эти ответы, а в заголовке строки - номер ответа в анкете.
+    persistence - поток сохранения: его очередь дописывается перед
+    чтением каждой страницы, чтобы не читать хранилище одновременно с ним.
+    """
+    
+    PAGE_SIZE = 500
+    
+    def __init__(self, storage, survey, ordinals=None, persistence=None, parent=None):
+        super().__init__(parent)
+        self.storage = storage
+        self.persistence = persistence
+        self.survey_id = survey['id']
+        self.question_ids = [q['id'] for q in survey['questions']]
+        self.headers = ["Заполнена"] + [f"{q['id']}: {q['text']}" for q in survey['questions']]
+        self.ordinals = ordinals
+        self.total = storage.count_responses(self.survey_id) if ordinals is None else len(ordinals)
+        self.rows = []
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+    
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and len(self.rows) < self.total
+    
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        if self.persistence is not None:
+            self.persistence.flush()
+        if self.ordinals is None:
+            page = self.storage.responses_page(self.survey_id, len(self.rows), self.PAGE_SIZE)
+        else:
+            page = self.storage.responses_at(self.survey_id,
+                                             self.ordinals[len(self.rows):len(self.rows) + self.PAGE_SIZE])
+        if not page:
+            # Ответов меньше, чем показывал счетчик
+            self.total = len(self.rows)
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole:
+            if orientation == Qt.Orientation.Horizontal:
+                return self.headers[section]
+            return str((section if self.ordinals is None else self.ordinals[section]) + 1)
+        return super().headerData(section, orientation, role)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        
+        response = self.rows[index.row()]
+        if index.column() == 0:
+            completed_at = response.get('completedAt')
+            if not completed_at:
+                return ""
+            try:
+                return datetime.fromisoformat(completed_at).strftime("%d.%m.%Y %H:%M")
+            except (ValueError, TypeError):
+                # Импорт сохраняет время ответа как есть - показываем его без разбора
+                return str(completed_at)
+        
+        return format_answer(response.get('answers', {}).get(self.question_ids[index.column() - 1]))
+
+
+class BackupImportWorker(QThread):
+    """Импорт резервных копий в фоновом потоке
+    
+    Файлы разбираются потоково, ответы пишутся в хранилище пачками.
+    В режиме замены прежние ответы заменяются только после успешного
+    чтения всего файла; в режиме слияния ответы объединяются по id.
+    """
+    
+    BATCH_SIZE = 1000
+    
+    progress = pyqtSignal(int)          # прочитано, в тысячных долях объема файлов
+    completed = pyqtSignal(list, dict)  # анкеты из файлов, итоги по ответам
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    
+    def __init__(self, storage, filenames, merge=False, parent=None):
+        super().__init__(parent)
+        self.storage = storage
+        self.filenames = filenames
+        self.merge = merge
+        self._cancel_requested = False
+    
+    def cancel(self):
+        """Просим поток остановиться после текущей записи"""
+        self._cancel_requested = True
+    
+    def run(self):
+        writer = None
+        try:
+            total_size = max(sum(os.path.getsize(name) for name in self.filenames), 1)
+            done_size = 0
+            writer = self.storage.begin_response_merge() if self.merge else self.storage.begin_response_import()
+            surveys = []
+            batch = []
+            # Анкеты, удаленные до выгрузки изменений (см. export_changes)
+            deleted = set()
+            
+            for filename in self.filenames:
+                with open(filename, 'rb') as f:
+                    reader = BackupReader(f)
+                    for key, record in reader:
+                        if self._cancel_requested:
+                            break
+                        if key == 'surveys':
+                            surveys.append(record)
+                        elif key == 'responses':
+                            batch.append(record)
+                            if len(batch) >= self.BATCH_SIZE:
+                                writer.add(batch)
+                                batch = []
+                                self.progress.emit((done_size + reader.bytes_read) * 1000 // total_size)
+                        elif key == 'deletedSurveys' and isinstance(record, list):
+                            deleted.update(survey_id for survey_id in record if isinstance(survey_id, str))
+                
+                if self._cancel_requested:
+                    break
+                if 'surveys' not in reader.keys or 'responses' not in reader.keys:
+                    raise ValueError(f"Неверный формат файла {os.path.basename(filename)}")
+                done_size += os.path.getsize(filename)
+            
+            if self._cancel_requested:
+                writer.abort()
+                self.cancelled.emit()
+                return
+            
+            writer.add(batch)
+            writer.commit()
+            stats = writer.stats()
+            writer = None
+            # Ответы удаленных анкет удаляет GUI через поток сохранения - после
+            # всех файлов, ведь они могли прийти из более ранней полной копии
+            stats['deletedSurveys'] = sorted(deleted)
+            self.completed.emit(surveys, stats)
+        except Exception as e:
+            if writer is not None:
+                try:
+                    writer.abort()
+                except Exception as abort_error:
+                    print(f"Ошибка отмены импорта: {abort_error}")
+            self.failed.emit(str(e))
+
+
+# Задержка записи анкет после правки в редакторе: серия правок пишется одним разом
+SURVEY_SAVE_DELAY_MS = 1000
+
+
+class PersistenceWriter(QThread):
+    """Поток сохранения: записывает данные на диск в порядке поступления
+    
+    GUI-поток ставит задачи в ограниченную очередь и сразу продолжает
+    работу; при переполнении очереди постановка ждет, пока диск догонит.
+    Перед чтением из хранилища GUI-поток вызывает flush(), поэтому поток
+    сохранения и GUI никогда не обращаются к хранилищу одновременно.
+    """
+    
+    QUEUE_SIZE = 100
+    
+    saved = pyqtSignal(str)    # описание выполненной задачи
+    failed = pyqtSignal(str)   # текст ошибки для пользователя
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.tasks = queue.Queue(self.QUEUE_SIZE)
+    
+    def submit(self, description, error_message, func, *args):
+        """Ставим запись в очередь; error_message - начало текста ошибки"""
+        self.tasks.put((description, error_message, func, args))
+    
+    def flush(self):
+        """Ждем, пока все поставленные записи будут выполнены"""
+        if self.isRunning():
+            self.tasks.join()
+    
+    def stop(self):
+        """Дописываем очередь и останавливаем поток (при выходе из приложения)"""
+        if self.isRunning():
+            self.tasks.put(None)
+            self.wait()
+    
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    return
+                description, error_message, func, args = task
+                try:
+                    func(*args)
+                except Exception as e:
+                    print(f"Ошибка сохранения ({description}): {e}")
+                    self.failed.emit(f"{error_message}: {e}")
+                else:
+                    self.saved.emit(description)
+            finally:
+                self.tasks.task_done()
+
+
 class SurveyApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -36,27 +464,61 @@ class SurveyApp(QMainWindow):
         
         # Определяем путь к данным
         self.data_dir = self.get_data_directory()
-        self.surveys_file = os.path.join(self.data_dir, "surveys.json")
-        self.responses_file = os.path.join(self.data_dir, "responses.json")
         self.settings_file = os.path.join(self.data_dir, "settings.json")
+        # Несохраненные правки редактора - на случай аварийного завершения
+        self.edits_file = os.path.join(self.data_dir, "survey_edits.json")
         
         # Создаем директорию если не существует
         os.makedirs(self.data_dir, exist_ok=True)
         
         # Загружаем данные
-        self.surveys = self.load_surveys()
-        self.responses = self.load_responses()
         self.settings = self.load_settings()
+        self.storage = self.open_storage()
+        self.surveys = self.load_surveys()
+        # Сводки по вопросам, обновляемые с каждым ответом
+        self.aggregates = AggregateStore(os.path.join(self.data_dir, AGGREGATES_DIRNAME))
+        # Индексы поиска по текстовым ответам
+        self.search_index = TextIndexStore(os.path.join(self.data_dir, SEARCH_DIRNAME))
+        # Фильтры ответов (индекс последней анкеты - в памяти)
+        self.response_filter = ResponseFilter(os.path.join(self.data_dir, COLUMNAR_CACHE_DIRNAME))
+        
+        # Все записи на диск идут через поток сохранения
+        self.persistence = PersistenceWriter(self)
+        self.persistence.saved.connect(self.on_persistence_saved)
+        self.persistence.failed.connect(self.on_persistence_failed)
+        self.persistence.start()
+        
+        # Правки редактора копятся и записываются одним разом по таймеру
+        self.dirty_surveys = {}
+        # Номер последней записи файла правок; файл пишет GUI-поток, а удаляет поток сохранения
+        self.edits_version = 0
+        self.edits_lock = threading.Lock()
+        self.survey_save_timer = QTimer(self)
+        self.survey_save_timer.setSingleShot(True)
+        self.survey_save_timer.setInterval(SURVEY_SAVE_DELAY_MS)
+        self.survey_save_timer.timeout.connect(self.flush_survey_edits)
+        self.recover_survey_edits()
+        # Ответы не загружаются при запуске - только для админ-панели и экспорта
         
         # Текущий пользователь
         self.current_survey = None
         self.current_answers = {}
         self.current_question = 0
         
+        # Журнал прохождения: ответы переживают сбой до завершения анкеты
+        self.session_journal = SessionJournal(os.path.join(self.data_dir, "session.jsonl"))
+        self.current_session_id = None
+        
+        # Окна прохождения анкет с построенными страницами (по id анкеты)
+        self.survey_windows = {}
+        
         self.setup_ui()
         self.setup_styles()
         self.setup_icon()
         
+        # Предлагаем продолжить прохождение, прерванное сбоем
+        QTimer.singleShot(0, self.offer_session_resume)
+        
     def center_window(self):
         """Центрируем окно на экране"""
         screen = QApplication.primaryScreen().geometry()
@@ -77,43 +539,42 @@ class SurveyApp(QMainWindow):
             home = os.path.expanduser("~")
             return os.path.join(home, ".local", "share", "SurveyApp", "Data")
     
-    def load_surveys(self) -> List[Dict]:
-        """Загружаем анкеты из файла"""
-        if os.path.exists(self.surveys_file):
-            try:
-                with open(self.surveys_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Ошибка загрузки анкет: {e}")
-        return []
+    def open_storage(self):
+        """Открываем хранилище, выбранное в настройках (json или sqlite)"""
+        backend = self.settings.get("storage_backend", "json")
+        try:
+            return open_storage(self.data_dir, backend)
+        except Exception as e:
+            print(f"Ошибка открытия хранилища {backend}: {e}")
+        return open_storage(self.data_dir)
     
-    def load_responses(self) -> List[Dict]:
-        """Загружаем ответы из файла"""
-        if os.path.exists(self.responses_file):
-            try:
-                with open(self.responses_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Ошибка загрузки ответов: {e}")
+    def load_surveys(self) -> List[Dict]:
+        """Загружаем анкеты из хранилища"""
+        try:
+            return self.storage.load_surveys()
+        except Exception as e:
+            print(f"Ошибка загрузки анкет: {e}")
         return []
     
     def load_settings(self) -> Dict:
         """Загружаем настройки из файла"""
-        if os.path.exists(self.settings_file):
-            try:
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Ошибка загрузки настроек: {e}")
-        return {"default_survey_id": None, "admin_password": "admin123"}
-    
-    def save_settings(self):
-        """Сохраняем настройки в файл"""
         try:
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(self.settings, f, ensure_ascii=False, indent=2)
+            settings = read_json_file(self.settings_file)
+            if settings is not None:
+                return settings
         except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить настройки: {e}")
+            print(f"Ошибка загрузки настроек: {e}")
+        return {"default_survey_id": None, "admin_password": "admin123", "storage_backend": "json",
+                "sync_watermarks": {}}
+    
+    def save_settings(self):
+        """Сохраняем настройки в файл (в потоке сохранения)"""
+        self.persistence.submit("настройки", "Не удалось сохранить настройки",
+                                self.write_settings, copy.deepcopy(self.settings))
+    
+    def write_settings(self, settings: Dict):
+        """Записываем настройки в файл"""
+        write_json_atomic(self.settings_file, settings, keep_backup=True, indent=2)
     
     def setup_icon(self):
         """Устанавливаем иконку приложения"""
@@ -131,25 +592,103 @@ class SurveyApp(QMainWindow):
             print(f"Ошибка загрузки иконки: {e}")
     
     def save_surveys(self):
-        """Сохраняем анкеты в файл"""
+        """Сохраняем анкеты в хранилище (в потоке сохранения)
+        
+        В очередь уходит копия: редактор может менять анкеты дальше,
+        не дожидаясь записи.
+        """
+        self.persistence.submit("анкеты", "Не удалось сохранить анкеты",
+                                self.storage.save_surveys, copy.deepcopy(self.surveys))
+    
+    def mark_survey_changed(self, survey: Dict):
+        """Отмечаем время изменения анкеты (для экспорта изменений)"""
+        survey['updatedAt'] = datetime.now().isoformat()
+    
+    def mark_survey_dirty(self, survey: Dict):
+        """Правка в редакторе: откладываем запись анкет, но не теряем правку
+        
+        Сразу (не через очередь, чтобы правка пережила аварийное
+        завершение) записывается только измененная анкета в файл правок;
+        все анкеты перезаписываются, когда правки затихнут, или при
+        сохранении и закрытии редактора.
+        """
+        self.mark_survey_changed(survey)
+        self.dirty_surveys[survey['id']] = survey
         try:
-            with open(self.surveys_file, 'w', encoding='utf-8') as f:
-                json.dump(self.surveys, f, ensure_ascii=False, indent=2)
+            self.write_survey_edits(list(self.dirty_surveys.values()))
         except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить анкеты: {e}")
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить правки анкеты: {e}")
+        self.survey_save_timer.start()
     
-    def save_responses(self):
-        """Сохраняем ответы в файл"""
+    def flush_survey_edits(self):
+        """Записываем накопленные правки редактора"""
+        self.survey_save_timer.stop()
+        if not self.dirty_surveys:
+            return
+        self.dirty_surveys = {}
+        self.save_surveys()
+        # Файл правок удаляется только после записи анкет (очередь сохраняет порядок)
+        self.persistence.submit("правки анкет", "Не удалось удалить файл правок",
+                                self.remove_survey_edits, self.edits_version)
+    
+    def write_survey_edits(self, surveys: List[Dict]):
+        """Записываем несохраненные анкеты в файл правок"""
+        with self.edits_lock:
+            write_json_atomic(self.edits_file, surveys)
+            self.edits_version += 1
+    
+    def remove_survey_edits(self, version):
+        """Удаляем файл правок, если после записи анкет в него ничего не добавилось"""
+        with self.edits_lock:
+            if version == self.edits_version and os.path.exists(self.edits_file):
+                os.remove(self.edits_file)
+    
+    def recover_survey_edits(self):
+        """Восстанавливаем правки редактора, не записанные до аварийного завершения"""
+        if not os.path.exists(self.edits_file):
+            return
         try:
-            with open(self.responses_file, 'w', encoding='utf-8') as f:
-                json.dump(self.responses, f, ensure_ascii=False, indent=2)
+            with open(self.edits_file, 'r', encoding='utf-8') as f:
+                edited = json.load(f)
         except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить ответы: {e}")
+            print(f"Ошибка загрузки файла правок: {e}")
+            return
+        
+        positions = {survey['id']: i for i, survey in enumerate(self.surveys)}
+        for survey in edited:
+            if survey['id'] in positions:
+                self.surveys[positions[survey['id']]] = survey
+            else:
+                self.surveys.append(survey)
+        print(f"Восстановлено несохраненных анкет: {len(edited)}")
+        self.save_surveys()
+        self.persistence.submit("правки анкет", "Не удалось удалить файл правок",
+                                self.remove_survey_edits, self.edits_version)
+    
+    def append_response(self, response: Dict, survey: Dict):
+        """Сохраняем один новый ответ, не загружая историю (в потоке сохранения)"""
+        self.persistence.submit("ответ", "Не удалось сохранить ответ",
+                                self.storage.append_response, response)
+        # Сводка обновляется после записи ответа (очередь сохраняет порядок)
+        self.persistence.submit("сводка ответов", "Не удалось обновить сводку ответов",
+                                self.aggregates.add, self.storage, survey, response)
+        self.persistence.submit("индекс поиска", "Не удалось обновить индекс поиска",
+                                self.search_index.add, self.storage, survey, response)
+    
+    def on_persistence_saved(self, description):
+        """Запись в потоке сохранения выполнена - коротко сообщаем в строке состояния"""
+        self.statusBar().showMessage(f"Сохранено: {description}", 3000)
+    
+    def on_persistence_failed(self, message):
+        """Ошибка записи в потоке сохранения"""
+        QMessageBox.critical(self, "Ошибка", message)
     
     def setup_ui(self):
         """Настраиваем интерфейс"""
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
+        # Строка состояния создается сразу, чтобы сообщения о сохранении не сдвигали окно
+        self.statusBar()
         
         # Главный layout
         main_layout = QVBoxLayout(central_widget)
@@ -385,7 +924,9 @@ class SurveyApp(QMainWindow):
         
         for survey in active_surveys:
             item = QListWidgetItem(survey['title'])
-            item.setData(Qt.ItemDataRole.UserRole, survey)
+            # В элементе храним id: словарь PyQt вернул бы копией, и кэш
+            # страниц окна анкеты не узнал бы свои вопросы
+            item.setData(Qt.ItemDataRole.UserRole, survey['id'])
             list_widget.addItem(item)
         
         layout.addWidget(list_widget)
@@ -407,142 +948,115 @@ class SurveyApp(QMainWindow):
         """Выбираем анкету из диалога"""
         current_item = list_widget.currentItem()
         if current_item:
-            survey = current_item.data(Qt.ItemDataRole.UserRole)
+            survey = self.survey_from_item(current_item)
             dialog.accept()
-            self.take_survey(survey)
+            if survey:
+                self.take_survey(survey)
     
     def take_survey_from_list(self, item):
         """Проходим анкету из списка"""
-        survey = item.data(Qt.ItemDataRole.UserRole)
+        survey = self.survey_from_item(item)
         if survey:
             self.take_survey(survey)
     
-    def take_survey(self, survey):
-        """Проходим анкету"""
+    def survey_from_item(self, item):
+        """Анкета элемента списка (по id, сохраненному в элементе)"""
+        survey_id = item.data(Qt.ItemDataRole.UserRole)
+        return next((s for s in self.surveys if s.get('id') == survey_id), None)
+    
+    def take_survey(self, survey, session=None):
+        """Проходим анкету (session - восстановленное из журнала прохождение)"""
         self.current_survey = survey
-        self.current_answers = {}
+        self.current_answers = dict(session['answers']) if session else {}
         self.current_question = 0
         
-        # Фильтруем вопросы по условиям
-        self.filtered_questions = self.get_visible_questions(survey['questions'], self.current_answers)
+        # Компилируем условия показа один раз на прохождение
+        self.compiled_survey = CompiledSurvey(survey)
+        
+        # Фильтруем вопросы по условиям; дальше видимость обновляется инкрементально
+        self.visibility = VisibilityTracker(self.compiled_survey, self.current_answers)
+        
+        # Продолжаем с вопроса, следующего за последним отвеченным
+        last_index = self.compiled_survey.index_by_id.get(session['lastQuestionId']) if session else None
+        if last_index is not None:
+            next_index = self.visibility.next_visible(last_index)
+            self.current_question = last_index if next_index is None else next_index
         
         # Проверяем, есть ли вопросы
-        if not self.filtered_questions:
-            print(f"DEBUG: Анкета '{survey['title']}' имеет {len(survey['questions'])} вопросов")
-            print(f"DEBUG: Отфильтрованных вопросов: {len(self.filtered_questions)}")
-            for i, q in enumerate(survey['questions']):
-                conditions = q.get('conditions', [])
-                print(f"DEBUG: Вопрос {i}: {q['text']} (тип: {q['type']}, условий: {len(conditions)})")
-                if conditions:
-                    for j, cond in enumerate(conditions):
-                        print(f"  Условие {j}: {cond}")
+        if not self.visibility.visible_count:
             QMessageBox.information(self, "Информация", f"В этой анкете нет доступных вопросов. Всего вопросов: {len(survey['questions'])}")
             return
         
-        # Создаем окно прохождения анкеты
-        self.survey_window = QDialog(self)
+        # Окно прохождения анкеты переиспользуется для следующих респондентов
+        self.survey_window = self.survey_windows.get(survey['id'])
+        if self.survey_window is None:
+            self.survey_window = SurveyWindow(self)
+            self.survey_window.prev_button.clicked.connect(self.prev_question)
+            self.survey_window.next_button.clicked.connect(self.next_question)
+            self.survey_windows[survey['id']] = self.survey_window
         self.survey_window.setWindowTitle(f"Анкета: {survey['title']}")
-        self.survey_window.setModal(True)
-        self.survey_window.resize(800, 600)
         
-        layout = QVBoxLayout(self.survey_window)
-        
-        # Прогресс
-        progress_layout = QHBoxLayout()
-        progress_layout.addWidget(QLabel("Прогресс:"))
-        
-        self.progress_bar = QProgressBar()
-        self.progress_bar.setMaximum(len(self.filtered_questions))
+        self.progress_bar = self.survey_window.progress_bar
+        self.progress_bar.setMaximum(self.visibility.visible_count)
         self.progress_bar.setValue(0)
-        progress_layout.addWidget(self.progress_bar)
-        
-        self.progress_label = QLabel(f"Вопрос 1 из {len(self.filtered_questions)}")
-        progress_layout.addWidget(self.progress_label)
-        progress_layout.addStretch()
-        
-        layout.addLayout(progress_layout)
-        
-        # Область для вопросов
-        self.question_widget = QWidget()
-        self.question_layout = QVBoxLayout(self.question_widget)
-        layout.addWidget(self.question_widget)
+        self.progress_label = self.survey_window.progress_label
+        self.prev_button = self.survey_window.prev_button
+        self.next_button = self.survey_window.next_button
         
-        # Кнопки навигации
-        nav_layout = QHBoxLayout()
-        
-        self.prev_button = QPushButton("Назад")
-        self.prev_button.clicked.connect(self.prev_question)
+        if session:
+            self.current_session_id = session['sessionId']
+            self.session_journal.resume(self.current_session_id)
+        else:
+            self.current_session_id = str(uuid.uuid4())
+            self.session_journal.start(self.current_session_id, survey['id'])
         
-        self.next_button = QPushButton("Далее")
-        self.next_button.clicked.connect(self.next_question)
+        self.show_question()
+        self.survey_window.exec()
         
-        nav_layout.addWidget(self.prev_button)
-        nav_layout.addStretch()
-        nav_layout.addWidget(self.next_button)
+        # Окно закрыто без завершения - прохождение брошено
+        if self.current_session_id is not None:
+            self.session_journal.finish(self.current_session_id)
+            self.current_session_id = None
+    
+    def offer_session_resume(self):
+        """Предлагаем продолжить незавершенное прохождение из журнала"""
+        try:
+            session = self.session_journal.load()
+        except Exception as e:
+            print(f"Ошибка загрузки журнала прохождения: {e}")
+            return
+        if session is None:
+            return
         
-        layout.addLayout(nav_layout)
+        survey = next((s for s in self.surveys if s.get('id') == session['surveyId']), None)
+        if survey is None or not session['answers']:
+            self.session_journal.discard()
+            return
         
-        self.show_question()
-        self.survey_window.exec()
+        reply = QMessageBox.question(self, "Незавершенная анкета",
+                                   f"Найдено незавершенное прохождение анкеты \"{survey['title']}\" "
+                                   f"(ответов: {len(session['answers'])}).\nПродолжить?",
+                                   QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if reply == QMessageBox.StandardButton.Yes:
+            self.take_survey(survey, session)
+        else:
+            self.session_journal.discard()
     
     def show_question(self):
         """Показываем текущий вопрос"""
-        # Очищаем область вопроса
-        for i in reversed(range(self.question_layout.count())):
-            self.question_layout.itemAt(i).widget().setParent(None)
-
         if not self.current_survey or self.current_question >= len(self.current_survey['questions']):
             return
 
         question = self.current_survey['questions'][self.current_question]
         
-        # Заголовок вопроса
-        question_label = QLabel(question['text'])
-        question_label.setFont(QFont("Arial", 14, QFont.Weight.Bold))
-        question_label.setWordWrap(True)
-        self.question_layout.addWidget(question_label)
-        
-        if question.get('required', False):
-            required_label = QLabel("* Обязательный вопрос")
-            required_label.setStyleSheet("color: red; font-weight: bold;")
-            self.question_layout.addWidget(required_label)
-        
-        # Поле для ответа
-        if question['type'] == 'text':
-            self.answer_text = QTextEdit()
-            self.answer_text.setMaximumHeight(100)
-            self.answer_text.setPlainText(self.current_answers.get(question['id'], ''))
-            self.question_layout.addWidget(self.answer_text)
-        
-        elif question['type'] == 'radio':
-            self.answer_radio_group = []
-            current_value = self.current_answers.get(question['id'], '')
-            
-            for option in question.get('options', []):
-                radio = QRadioButton(option)
-                radio.setChecked(option == current_value)
-                self.answer_radio_group.append(radio)
-                self.question_layout.addWidget(radio)
-        
-        elif question['type'] == 'checkbox':
-            self.answer_checkboxes = {}
-            current_values = self.current_answers.get(question['id'], [])
-            
-            for option in question.get('options', []):
-                checkbox = QCheckBox(option)
-                checkbox.setChecked(option in current_values)
-                self.answer_checkboxes[option] = checkbox
-                self.question_layout.addWidget(checkbox)
-        
-        elif question['type'] == 'number':
-            self.answer_spinbox = QSpinBox()
-            self.answer_spinbox.setRange(-999999, 999999)
-            self.answer_spinbox.setValue(int(self.current_answers.get(question['id'], 0)))
-            self.question_layout.addWidget(self.answer_spinbox)
+        # Переключаемся на страницу вопроса и выставляем сохраненный ответ
+        self.current_page = self.survey_window.page(self.current_question, question)
+        self.current_page.set_answer(self.current_answers.get(question['id']))
+        self.survey_window.question_stack.setCurrentWidget(self.current_page)
         
         # Обновляем прогресс
         self.progress_bar.setValue(self.current_question + 1)
-        self.progress_label.setText(f"Вопрос {self.current_question + 1} из {len(self.filtered_questions)}")
+        self.progress_label.setText(f"Вопрос {self.current_question + 1} из {self.visibility.visible_count}")
         
         # Обновляем кнопки навигации
         self.update_navigation_buttons()
@@ -556,23 +1070,17 @@ class SurveyApp(QMainWindow):
             return
         
         question = self.current_survey['questions'][self.current_question]
+        answer = self.current_page.answer()
+        changed = question['id'] not in self.current_answers or self.current_answers[question['id']] != answer
         
-        if question['type'] == 'text':
-            answer = self.answer_text.toPlainText().strip()
-        elif question['type'] == 'radio':
-            answer = ""
-            for radio in self.answer_radio_group:
-                if radio.isChecked():
-                    answer = radio.text()
-                    break
-        elif question['type'] == 'checkbox':
-            answer = [option for option, checkbox in self.answer_checkboxes.items() if checkbox.isChecked()]
-        elif question['type'] == 'number':
-            answer = self.answer_spinbox.value()
-        else:
-            answer = ''
+        # Пересчитывается видимость только зависящих от этого ответа вопросов
+        self.visibility.set_answer(question['id'], answer)
         
-        self.current_answers[question['id']] = answer
+        if changed:
+            try:
+                self.session_journal.record(question['id'], answer)
+            except Exception as e:
+                print(f"Ошибка записи журнала прохождения: {e}")
     
     def prev_question(self):
         """Предыдущий вопрос с учетом условной логики"""
@@ -580,12 +1088,7 @@ class SurveyApp(QMainWindow):
             self.save_current_answer()
             
             # Находим предыдущий видимый вопрос
-            prev_visible_index = None
-            for i in range(self.current_question - 1, -1, -1):
-                question = self.current_survey['questions'][i]
-                if self.should_show_question(question, self.current_answers):
-                    prev_visible_index = i
-                    break
+            prev_visible_index = self.visibility.prev_visible(self.current_question)
             
             if prev_visible_index is not None:
                 self.current_question = prev_visible_index
@@ -595,25 +1098,16 @@ class SurveyApp(QMainWindow):
         """Следующий вопрос"""
         self.save_current_answer()
 
-        # Пересчитываем видимые вопросы после сохранения ответа
-        new_filtered = self.get_visible_questions(self.current_survey['questions'], self.current_answers)
-
-        # Находим следующий видимый вопрос
-        next_visible_index = None
-        for i, question in enumerate(self.current_survey['questions']):
-            if i > self.current_question and question in new_filtered:
-                next_visible_index = i
-                break
+        # Находим следующий видимый вопрос (видимость уже обновлена при сохранении ответа)
+        next_visible_index = self.visibility.next_visible(self.current_question)
 
         if next_visible_index is None:
             # Завершаем анкету
             self.finish_survey()
         else:
             self.current_question = next_visible_index
-            self.filtered_questions = new_filtered
+            # show_question сам обновляет кнопки навигации
             self.show_question()
-            # Обновляем кнопки ПОСЛЕ показа вопроса
-            self.update_navigation_buttons()
     
     def finish_survey(self):
         """Завершаем анкету"""
@@ -625,8 +1119,11 @@ class SurveyApp(QMainWindow):
             'completedAt': datetime.now().isoformat()
         }
         
-        self.responses.append(response)
-        self.save_responses()
+        self.append_response(response, self.current_survey)
+        # Журнал прохождения удаляется только после записи ответа (очередь сохраняет порядок)
+        self.persistence.submit("журнал прохождения", "Не удалось удалить журнал прохождения",
+                                self.session_journal.finish, self.current_session_id)
+        self.current_session_id = None
         
         QMessageBox.information(self, "Успех", "Анкета успешно завершена!")
         self.survey_window.accept()
@@ -679,6 +1176,16 @@ class SurveyApp(QMainWindow):
         settings_layout.addWidget(save_default_button)
         
         settings_layout.addStretch()
+        
+        # Тип хранилища
+        storage_label = QLabel(f"Хранилище: {self.storage.name}")
+        settings_layout.addWidget(storage_label)
+        
+        if self.storage.name != SqliteStorage.name:
+            migrate_button = QPushButton("Перенести в SQLite")
+            migrate_button.clicked.connect(lambda: self.migrate_to_sqlite(admin_window, storage_label, migrate_button))
+            settings_layout.addWidget(migrate_button)
+        
         layout.addWidget(settings_group)
         
         # Кнопки управления
@@ -690,9 +1197,15 @@ class SurveyApp(QMainWindow):
         export_button = QPushButton("Экспорт данных")
         export_button.clicked.connect(self.export_data)
         
+        export_changes_button = QPushButton("Экспорт изменений")
+        export_changes_button.clicked.connect(self.export_changes)
+        
         import_button = QPushButton("Импорт данных")
         import_button.clicked.connect(self.import_data)
         
+        merge_button = QPushButton("Объединить данные")
+        merge_button.clicked.connect(self.merge_data)
+        
         change_password_button = QPushButton("Сменить пароль")
         change_password_button.clicked.connect(self.change_password)
         
@@ -704,7 +1217,9 @@ class SurveyApp(QMainWindow):
         
         button_layout.addWidget(create_button)
         button_layout.addWidget(export_button)
+        button_layout.addWidget(export_changes_button)
         button_layout.addWidget(import_button)
+        button_layout.addWidget(merge_button)
         button_layout.addWidget(export_single_button)
         button_layout.addWidget(import_single_button)
         button_layout.addWidget(change_password_button)
@@ -713,12 +1228,12 @@ class SurveyApp(QMainWindow):
         layout.addLayout(button_layout)
         
         # Таблица анкет
-        self.admin_table = QTableWidget()
-        self.admin_table.setColumnCount(5)
-        self.admin_table.setHorizontalHeaderLabels(["Название", "Вопросов", "Ответов", "Статус", "Создана"])
-        
-        # Заполняем таблицу
-        self.update_admin_table()
+        self.persistence.flush()
+        self.admin_model = SurveyTableModel(self.surveys, self.storage.response_counts(), admin_window)
+        self.admin_table = QTableView()
+        self.admin_table.setModel(self.admin_model)
+        self.admin_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.admin_table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
         
         layout.addWidget(self.admin_table)
         
@@ -734,11 +1249,27 @@ class SurveyApp(QMainWindow):
         responses_button = QPushButton("Просмотр ответов")
         responses_button.clicked.connect(lambda: self.view_responses(admin_window))
         
+        summary_button = QPushButton("Сводка")
+        summary_button.clicked.connect(lambda: self.show_response_summary(admin_window))
+        
+        crosstab_button = QPushButton("Кросс-таблица")
+        crosstab_button.clicked.connect(lambda: self.show_crosstab(admin_window))
+        
+        csv_button = QPushButton("Экспорт в CSV")
+        csv_button.clicked.connect(lambda: self.export_responses_csv(admin_window))
+        
+        columnar_button = QPushButton("Экспорт для анализа")
+        columnar_button.clicked.connect(lambda: self.export_responses_columnar(admin_window))
+        
         delete_button = QPushButton("Удалить")
         delete_button.clicked.connect(lambda: self.delete_survey(admin_window))
         
         action_layout.addWidget(edit_button)
         action_layout.addWidget(responses_button)
+        action_layout.addWidget(summary_button)
+        action_layout.addWidget(crosstab_button)
+        action_layout.addWidget(csv_button)
+        action_layout.addWidget(columnar_button)
         action_layout.addWidget(delete_button)
         action_layout.addStretch()
         
@@ -746,20 +1277,40 @@ class SurveyApp(QMainWindow):
         
         admin_window.exec()
     
+    def migrate_to_sqlite(self, parent, storage_label, migrate_button):
+        """Переносим анкеты и ответы из JSON-файлов в базу SQLite"""
+        reply = QMessageBox.question(parent, "Подтверждение",
+                                   "Перенести все анкеты и ответы в базу SQLite?\n"
+                                   "JSON-файлы останутся как резервная копия.",
+                                   QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        
+        try:
+            # Дописываем очередь и сохраняем несохраненное перед переносом
+            self.persistence.flush()
+            self.storage.save_surveys(self.surveys)
+            stats = migrate_json_to_sqlite(self.data_dir)
+        except Exception as e:
+            QMessageBox.critical(parent, "Ошибка", f"Не удалось перенести данные: {e}")
+            return
+        
+        self.storage.close()
+        self.settings["storage_backend"] = SqliteStorage.name
+        self.save_settings()
+        self.storage = self.open_storage()
+        self.surveys = self.load_surveys()
+        
+        storage_label.setText(f"Хранилище: {self.storage.name}")
+        migrate_button.setVisible(False)
+        self.update_admin_table()
+        QMessageBox.information(parent, "Успех",
+                              f"Перенесено анкет: {stats['surveys']}, ответов: {stats['responses']}")
+    
     def update_admin_table(self):
         """Обновляем таблицу администратора"""
-        self.admin_table.setRowCount(len(self.surveys))
-        
-        for row, survey in enumerate(self.surveys):
-            responses_count = len([r for r in self.responses if r['surveyId'] == survey['id']])
-            status = "Активна" if survey.get('isActive', True) else "Неактивна"
-            created = datetime.fromisoformat(survey['createdAt']).strftime("%d.%m.%Y")
-            
-            self.admin_table.setItem(row, 0, QTableWidgetItem(survey['title']))
-            self.admin_table.setItem(row, 1, QTableWidgetItem(str(len(survey['questions']))))
-            self.admin_table.setItem(row, 2, QTableWidgetItem(str(responses_count)))
-            self.admin_table.setItem(row, 3, QTableWidgetItem(status))
-            self.admin_table.setItem(row, 4, QTableWidgetItem(created))
+        self.persistence.flush()
+        self.admin_model.refresh(self.surveys, self.storage.response_counts())
     
     def create_survey(self):
         """Создаем новую анкету"""
@@ -774,6 +1325,7 @@ class SurveyApp(QMainWindow):
             'createdAt': datetime.now().isoformat(),
             'isActive': True
         }
+        survey['updatedAt'] = survey['createdAt']
         
         self.surveys.append(survey)
         self.save_surveys()
@@ -790,7 +1342,7 @@ class SurveyApp(QMainWindow):
     
     def edit_survey(self, parent):
         """Редактируем анкету"""
-        current_row = self.admin_table.currentRow()
+        current_row = self.admin_table.currentIndex().row()
         if current_row < 0:
             QMessageBox.warning(parent, "Предупреждение", "Выберите анкету для редактирования")
             return
@@ -800,12 +1352,484 @@ class SurveyApp(QMainWindow):
     
     def view_responses(self, parent):
         """Просматриваем ответы"""
-        current_row = self.admin_table.currentRow()
+        current_row = self.admin_table.currentIndex().row()
         if current_row < 0:
             QMessageBox.warning(parent, "Предупреждение", "Выберите анкету для просмотра ответов")
             return
         
-        QMessageBox.information(parent, "Информация", "Функция просмотра ответов будет добавлена в следующей версии")
+        survey = self.surveys[current_row]
+        self.persistence.flush()
+        model = ResponsesTableModel(self.storage, survey, persistence=self.persistence)
+        total = model.total
+        
+        dialog = QDialog(parent)
+        dialog.setWindowTitle(f"Ответы: {survey['title']}")
+        dialog.setModal(True)
+        dialog.resize(1000, 600)
+        
+        layout = QVBoxLayout(dialog)
+        
+        count_label = QLabel(f"Всего ответов: {total}")
+        count_label.setFont(QFont("Arial", 12, QFont.Weight.Bold))
+        layout.addWidget(count_label)
+        
+        # Таблица запрашивает строки у модели страницами по мере прокрутки
+        table = QTableView()
+        table.setModel(model)
+        table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        
+        # Номера ответов, найденных поиском и фильтром (None - без ограничения)
+        shown = {'search': None, 'filter': None, 'filter_state': None, 'ordinals': None}
+        
+        def show_rows():
+            ordinals = shown['search']
+            if shown['filter'] is not None:
+                ordinals = shown['filter'] if ordinals is None else \
+                    sorted(set(ordinals).intersection(shown['filter']))
+            table.setModel(ResponsesTableModel(self.storage, survey, ordinals, self.persistence, parent=table))
+            count_label.setText(f"Всего ответов: {total}" if ordinals is None else
+                                f"Найдено: {len(ordinals)} из {total}")
+            shown['ordinals'] = ordinals
+        
+        filter_layout = QHBoxLayout()
+        filter_button = QPushButton("Фильтр...")
+        reset_filter_button = QPushButton("Сбросить фильтр")
+        reset_filter_button.setEnabled(False)
+        
+        def edit_filter():
+            result = self.edit_response_filter(dialog, survey, shown['filter_state'])
+            if result is None:
+                return
+            spec, shown['filter_state'] = result
+            self.persistence.flush()
+            QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+            try:
+                shown['filter'] = self.response_filter.ordinals(self.storage, survey, spec)
+            except Exception as e:
+                QApplication.restoreOverrideCursor()
+                QMessageBox.critical(dialog, "Ошибка", f"Не удалось применить фильтр: {e}")
+                return
+            QApplication.restoreOverrideCursor()
+            reset_filter_button.setEnabled(True)
+            show_rows()
+        
+        def reset_filter():
+            shown['filter'] = shown['filter_state'] = None
+            reset_filter_button.setEnabled(False)
+            show_rows()
+        
+        filter_button.clicked.connect(edit_filter)
+        reset_filter_button.clicked.connect(reset_filter)
+        filter_layout.addWidget(filter_button)
+        filter_layout.addWidget(reset_filter_button)
+        filter_layout.addStretch()
+        layout.addLayout(filter_layout)
+        
+        text_questions = [q for q in survey['questions'] if q.get('type') == 'text']
+        if text_questions:
+            # Поиск по текстовым ответам через инвертированный индекс анкеты
+            search_layout = QHBoxLayout()
+            search_edit = QLineEdit()
+            search_edit.setPlaceholderText("Поиск по текстовым ответам")
+            question_combo = QComboBox()
+            question_combo.addItem("Все текстовые вопросы", None)
+            for question in text_questions:
+                question_combo.addItem(question['text'], question['id'])
+            search_layout.addWidget(search_edit, 1)
+            search_layout.addWidget(question_combo)
+            layout.addLayout(search_layout)
+            
+            def run_search():
+                query = search_edit.text()
+                if not query.strip():
+                    shown['search'] = None
+                    show_rows()
+                    return
+                QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+                try:
+                    index = self.search_index.get(self.storage, survey)
+                    shown['search'] = index.search(query, question_combo.currentData())
+                except Exception as e:
+                    QApplication.restoreOverrideCursor()
+                    QMessageBox.critical(dialog, "Ошибка", f"Не удалось выполнить поиск: {e}")
+                    return
+                QApplication.restoreOverrideCursor()
+                show_rows()
+            
+            # Ищем, когда пользователь перестал печатать
+            search_timer = QTimer(dialog)
+            search_timer.setSingleShot(True)
+            search_timer.setInterval(300)
+            search_timer.timeout.connect(run_search)
+            search_edit.textChanged.connect(lambda: search_timer.start())
+            question_combo.currentIndexChanged.connect(lambda: search_timer.start())
+        
+        layout.addWidget(table)
+        
+        button_layout = QHBoxLayout()
+        # Выгружаются ответы, показанные в таблице (с учетом поиска и фильтра)
+        export_button = QPushButton("Экспорт в CSV")
+        export_button.clicked.connect(lambda: self.save_responses_csv(dialog, survey, shown['ordinals']))
+        button_layout.addWidget(export_button)
+        button_layout.addStretch()
+        close_button = QPushButton("Закрыть")
+        close_button.clicked.connect(dialog.accept)
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+        
+        dialog.exec()
+    
+    def edit_response_filter(self, parent, survey, state=None):
+        """Диалог фильтра ответов; возвращаем (фильтр, состояние полей) или None
+        
+        Состояние полей передается при следующем открытии, чтобы
+        показать фильтр, заданный в прошлый раз.
+        """
+        operators = [("равно", "equals"), ("не равно", "not_equals"), ("содержит", "contains"),
+                     ("больше", "greater_than"), ("больше или равно", "greater_or_equal"),
+                     ("меньше", "less_than"), ("меньше или равно", "less_or_equal")]
+        state = state or {'mode': 'all', 'from': "", 'to': "", 'conditions': []}
+        
+        dialog = QDialog(parent)
+        dialog.setWindowTitle("Фильтр ответов")
+        dialog.setModal(True)
+        dialog.resize(700, 400)
+        layout = QVBoxLayout(dialog)
+        
+        form = QFormLayout()
+        mode_combo = QComboBox()
+        mode_combo.addItem("Все условия (И)", 'all')
+        mode_combo.addItem("Любое из условий (ИЛИ)", 'any')
+        mode_combo.setCurrentIndex(max(0, mode_combo.findData(state['mode'])))
+        form.addRow("Совпадение:", mode_combo)
+        from_edit = QLineEdit(state['from'])
+        from_edit.setPlaceholderText("ГГГГ-ММ-ДД")
+        to_edit = QLineEdit(state['to'])
+        to_edit.setPlaceholderText("ГГГГ-ММ-ДД (включительно)")
+        form.addRow("Заполнена с:", from_edit)
+        form.addRow("Заполнена по:", to_edit)
+        layout.addLayout(form)
+        
+        conditions_layout = QVBoxLayout()
+        rows = []
+        
+        def add_condition(question_index=0, operator='equals', value=""):
+            row_layout = QHBoxLayout()
+            question_combo = QComboBox()
+            for i, question in enumerate(survey['questions']):
+                question_combo.addItem(f"{i + 1}. {question['text']}", i)
+            question_combo.setCurrentIndex(max(0, question_combo.findData(question_index)))
+            operator_combo = QComboBox()
+            for label, key in operators:
+                operator_combo.addItem(label, key)
+            operator_combo.setCurrentIndex(max(0, operator_combo.findData(operator)))
+            value_edit = QLineEdit(value)
+            value_edit.setPlaceholderText("Значение")
+            remove_button = QPushButton("Удалить")
+            row = (question_combo, operator_combo, value_edit)
+            
+            def remove():
+                rows.remove(row)
+                for widget in (question_combo, operator_combo, value_edit, remove_button):
+                    widget.setParent(None)
+                conditions_layout.removeItem(row_layout)
+            
+            remove_button.clicked.connect(remove)
+            row_layout.addWidget(question_combo, 1)
+            row_layout.addWidget(operator_combo)
+            row_layout.addWidget(value_edit)
+            row_layout.addWidget(remove_button)
+            conditions_layout.addLayout(row_layout)
+            rows.append(row)
+        
+        for condition in state['conditions']:
+            add_condition(*condition)
+        layout.addWidget(QLabel("Условия на ответы:"))
+        layout.addLayout(conditions_layout)
+        add_button = QPushButton("Добавить условие")
+        add_button.setEnabled(bool(survey['questions']))
+        add_button.clicked.connect(lambda: add_condition())
+        layout.addWidget(add_button)
+        layout.addStretch()
+        
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout.addWidget(buttons)
+        
+        while dialog.exec() == QDialog.DialogCode.Accepted:
+            period = {}
+            try:
+                if from_edit.text().strip():
+                    period['from'] = datetime.fromisoformat(from_edit.text().strip()).isoformat()
+                if to_edit.text().strip():
+                    end = datetime.fromisoformat(to_edit.text().strip())
+                    # Дата без времени - включая весь этот день
+                    if len(to_edit.text().strip()) == 10:
+                        end += timedelta(days=1)
+                    period['to'] = end.isoformat()
+            except ValueError:
+                QMessageBox.warning(dialog, "Ошибка", "Введите дату в виде ГГГГ-ММ-ДД")
+                continue
+            
+            conditions = []
+            for question_combo, operator_combo, value_edit in rows:
+                question = survey['questions'][question_combo.currentData()]
+                value = value_edit.text()
+                if question.get('type') == 'number' and operator_combo.currentData() in ('equals', 'not_equals'):
+                    # Числовые ответы хранятся числами - сравниваем с числом
+                    try:
+                        number = float(value)
+                        value = int(number) if number.is_integer() else number
+                    except ValueError:
+                        pass
+                conditions.append({'targetId': question['id'], 'operator': operator_combo.currentData(),
+                                   'value': value})
+            
+            spec = {'all': []}
+            if period:
+                spec['all'].append({'completedAt': period})
+            if conditions:
+                spec['all'].append({mode_combo.currentData(): conditions})
+            new_state = {'mode': mode_combo.currentData(), 'from': from_edit.text().strip(),
+                         'to': to_edit.text().strip(),
+                         'conditions': [(question_combo.currentData(), operator_combo.currentData(),
+                                         value_edit.text()) for question_combo, operator_combo, value_edit in rows]}
+            return spec, new_state
+        return None
+    
+    def show_response_summary(self, parent):
+        """Показываем сводку ответов выбранной анкеты по вопросам"""
+        current_row = self.admin_table.currentIndex().row()
+        if current_row < 0:
+            QMessageBox.warning(parent, "Предупреждение", "Выберите анкету для просмотра сводки")
+            return
+        
+        survey = self.surveys[current_row]
+        self.persistence.flush()
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            aggregates = self.aggregates.get(self.storage, survey)
+        except Exception as e:
+            QApplication.restoreOverrideCursor()
+            QMessageBox.critical(parent, "Ошибка", f"Не удалось получить сводку ответов: {e}")
+            return
+        QApplication.restoreOverrideCursor()
+        
+        dialog = QDialog(parent)
+        dialog.setWindowTitle(f"Сводка: {survey['title']}")
+        dialog.setModal(True)
+        dialog.resize(900, 600)
+        
+        layout = QVBoxLayout(dialog)
+        count_label = QLabel(f"Всего ответов: {aggregates.rows}")
+        count_label.setFont(QFont("Arial", 12, QFont.Weight.Bold))
+        layout.addWidget(count_label)
+        
+        table = QTableWidget(len(survey['questions']), 3)
+        table.setHorizontalHeaderLabels(["Вопрос", "Ответили", "Итоги"])
+        table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        for row, question in enumerate(survey['questions']):
+            stats = aggregates.questions.get(question['id'], {})
+            if stats.get('kind') == 'number':
+                summary = (f"среднее {stats['sum'] / stats['count']:.2f}, минимум {stats['min']}, "
+                           f"максимум {stats['max']}" if stats['count'] else "")
+            elif stats.get('kind') == 'text':
+                summary = f"непустых: {stats['nonEmpty']}"
+            else:
+                summary = "; ".join(f"{label}: {count}" for label, count in stats.get('counts', {}).items())
+            for column, text in enumerate((f"{row + 1}. {question['text']}", str(stats.get('answered', 0)), summary)):
+                table.setItem(row, column, QTableWidgetItem(text))
+        table.resizeColumnsToContents()
+        layout.addWidget(table)
+        
+        close_button = QPushButton("Закрыть")
+        close_button.clicked.connect(dialog.accept)
+        layout.addWidget(close_button)
+        
+        dialog.exec()
+    
+    def show_crosstab(self, parent):
+        """Кросс-таблица ответов на два вопроса выбранной анкеты"""
+        current_row = self.admin_table.currentIndex().row()
+        if current_row < 0:
+            QMessageBox.warning(parent, "Предупреждение", "Выберите анкету для кросс-таблицы")
+            return
+        
+        survey = self.surveys[current_row]
+        if not survey['questions']:
+            QMessageBox.information(parent, "Информация", "В анкете нет вопросов")
+            return
+        
+        dialog = QDialog(parent)
+        dialog.setWindowTitle(f"Кросс-таблица: {survey['title']}")
+        dialog.setModal(True)
+        dialog.resize(1000, 600)
+        
+        layout = QVBoxLayout(dialog)
+        form = QFormLayout()
+        row_combo = QComboBox()
+        column_combo = QComboBox()
+        for i, question in enumerate(survey['questions']):
+            row_combo.addItem(f"{i + 1}. {question['text']}", i)
+            column_combo.addItem(f"{i + 1}. {question['text']}", i)
+        column_combo.setCurrentIndex(min(1, column_combo.count() - 1))
+        form.addRow("Строки:", row_combo)
+        form.addRow("Столбцы:", column_combo)
+        layout.addLayout(form)
+        
+        table = QTableWidget()
+        table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        layout.addWidget(table)
+        result = {}
+        
+        def build():
+            question_a = survey['questions'][row_combo.currentData()]
+            question_b = survey['questions'][column_combo.currentData()]
+            self.persistence.flush()
+            QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+            try:
+                result['table'] = crosstab(self.storage, survey, question_a, question_b,
+                                           os.path.join(self.data_dir, COLUMNAR_CACHE_DIRNAME))
+            except Exception as e:
+                QApplication.restoreOverrideCursor()
+                QMessageBox.critical(dialog, "Ошибка", f"Не удалось построить кросс-таблицу: {e}")
+                return
+            QApplication.restoreOverrideCursor()
+            
+            counts = result['table']
+            table.clear()
+            table.setRowCount(len(counts['rows']))
+            table.setColumnCount(len(counts['columns']))
+            table.setHorizontalHeaderLabels(counts['columns'])
+            table.setVerticalHeaderLabels(counts['rows'])
+            for row, values in enumerate(counts['counts']):
+                for column, value in enumerate(values):
+                    table.setItem(row, column, QTableWidgetItem(str(value)))
+            table.resizeColumnsToContents()
+        
+        def export():
+            if 'table' not in result:
+                QMessageBox.warning(dialog, "Предупреждение", "Сначала постройте кросс-таблицу")
+                return
+            filename, _ = QFileDialog.getSaveFileName(
+                dialog, "Экспорт кросс-таблицы в CSV", f"{survey.get('title', 'Анкета')} - кросс-таблица.csv",
+                "CSV files (*.csv);;All files (*.*)"
+            )
+            if not filename:
+                return
+            try:
+                write_crosstab_csv(result['table'], filename,
+                                   f"{row_combo.currentText()} / {column_combo.currentText()}")
+            except Exception as e:
+                QMessageBox.critical(dialog, "Ошибка", f"Не удалось экспортировать кросс-таблицу: {e}")
+                return
+            QMessageBox.information(dialog, "Успех", "Кросс-таблица экспортирована")
+        
+        button_layout = QHBoxLayout()
+        build_button = QPushButton("Построить")
+        build_button.clicked.connect(build)
+        export_button = QPushButton("Экспорт в CSV")
+        export_button.clicked.connect(export)
+        close_button = QPushButton("Закрыть")
+        close_button.clicked.connect(dialog.accept)
+        button_layout.addWidget(build_button)
+        button_layout.addWidget(export_button)
+        button_layout.addStretch()
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+        
+        dialog.exec()
+    
+    def export_responses_csv(self, parent):
+        """Выгружаем ответы выбранной анкеты в CSV"""
+        current_row = self.admin_table.currentIndex().row()
+        if current_row < 0:
+            QMessageBox.warning(parent, "Предупреждение", "Выберите анкету для экспорта ответов")
+            return
+        
+        self.save_responses_csv(parent, self.surveys[current_row])
+    
+    def save_responses_csv(self, parent, survey, ordinals=None):
+        """Выгружаем в CSV ответы анкеты - все или с данными порядковыми номерами"""
+        filename, _ = QFileDialog.getSaveFileName(
+            parent, "Экспорт ответов в CSV", f"{survey.get('title', 'Анкета')}.csv",
+            "CSV files (*.csv);;All files (*.*)"
+        )
+        if not filename:
+            return
+        
+        self.persistence.flush()
+        total = self.storage.count_responses(survey['id']) if ordinals is None else len(ordinals)
+        progress_dialog = QProgressDialog("Экспорт ответов...", "Отмена", 0, total, parent)
+        progress_dialog.setWindowTitle("Экспорт в CSV")
+        progress_dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        progress_dialog.setMinimumDuration(500)
+        
+        def on_progress(written):
+            progress_dialog.setValue(min(written, total))
+            QApplication.processEvents()
+            return not progress_dialog.wasCanceled()
+        
+        try:
+            written = write_responses_csv(self.storage, survey, filename, on_progress, ordinals)
+        except Exception as e:
+            progress_dialog.close()
+            QMessageBox.critical(parent, "Ошибка", f"Не удалось экспортировать ответы: {e}")
+            return
+        
+        canceled = progress_dialog.wasCanceled()
+        progress_dialog.close()
+        if canceled:
+            QMessageBox.warning(parent, "Экспорт прерван", f"Экспорт отменен, выгружено ответов: {written}")
+        else:
+            QMessageBox.information(parent, "Успех", f"Экспортировано ответов: {written}")
+    
+    def export_responses_columnar(self, parent):
+        """Выгружаем ответы выбранной анкеты в колоночный двоичный файл (для NumPy)"""
+        current_row = self.admin_table.currentIndex().row()
+        if current_row < 0:
+            QMessageBox.warning(parent, "Предупреждение", "Выберите анкету для экспорта ответов")
+            return
+        
+        survey = self.surveys[current_row]
+        filename, _ = QFileDialog.getSaveFileName(
+            parent, "Экспорт для анализа", f"{survey.get('title', 'Анкета')}{COLUMNAR_SUFFIX}",
+            f"Колоночный формат (*{COLUMNAR_SUFFIX});;All files (*.*)"
+        )
+        if not filename:
+            return
+        
+        self.persistence.flush()
+        total = self.storage.count_responses(survey['id'])
+        progress_dialog = QProgressDialog("Экспорт ответов...", "Отмена", 0, total, parent)
+        progress_dialog.setWindowTitle("Экспорт для анализа")
+        progress_dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        progress_dialog.setMinimumDuration(500)
+        
+        writer = ColumnarWriter(survey)
+        try:
+            for response in self.storage.iter_responses(survey['id']):
+                writer.append(response)
+                if writer.rows % PROGRESS_STEP == 0:
+                    progress_dialog.setValue(min(writer.rows, total))
+                    QApplication.processEvents()
+                    if progress_dialog.wasCanceled():
+                        break
+            canceled = progress_dialog.wasCanceled()
+            if not canceled:
+                writer.write(filename)
+        except Exception as e:
+            progress_dialog.close()
+            QMessageBox.critical(parent, "Ошибка", f"Не удалось экспортировать ответы: {e}")
+            return
+        
+        progress_dialog.close()
+        if canceled:
+            QMessageBox.warning(parent, "Экспорт прерван", "Экспорт отменен, файл не создан")
+        else:
+            QMessageBox.information(parent, "Успех", f"Экспортировано ответов: {writer.rows}")
     
     def show_survey_editor(self, survey, parent):
         """Показываем редактор анкеты"""
@@ -830,7 +1854,11 @@ class SurveyApp(QMainWindow):
         save_btn = QPushButton("Сохранить")
         save_btn.clicked.connect(lambda: self.save_survey_editor(survey, editor_window))
         
+        reach_btn = QPushButton("Охват вопросов")
+        reach_btn.clicked.connect(lambda: self.show_condition_reach(survey, editor_window))
+        
         title_layout.addWidget(add_question_btn)
+        title_layout.addWidget(reach_btn)
         title_layout.addWidget(save_btn)
         layout.addLayout(title_layout)
         
@@ -869,8 +1897,48 @@ class SurveyApp(QMainWindow):
         # Загружаем вопросы
         self.load_questions_to_editor(survey)
         
+        # Закрытие редактора любым способом записывает накопленные правки
+        editor_window.finished.connect(self.flush_survey_edits)
         editor_window.exec()
     
+    def show_condition_reach(self, survey, parent):
+        """Показываем, сколько прошлых респондентов увидели бы каждый вопрос при текущих условиях"""
+        self.persistence.flush()
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            counts = condition_reach(self.storage, survey, os.path.join(self.data_dir, COLUMNAR_CACHE_DIRNAME))
+        except Exception as e:
+            QApplication.restoreOverrideCursor()
+            QMessageBox.critical(parent, "Ошибка", f"Не удалось пересчитать условия: {e}")
+            return
+        QApplication.restoreOverrideCursor()
+        
+        total = counts[0]['reached'] + counts[0]['skipped'] if counts else 0
+        dialog = QDialog(parent)
+        dialog.setWindowTitle(f"Охват вопросов: {survey['title']}")
+        dialog.setModal(True)
+        dialog.resize(700, 500)
+        
+        layout = QVBoxLayout(dialog)
+        layout.addWidget(QLabel(f"Сохраненных ответов: {total}. Условия проверяются по их ответам."))
+        
+        table = QTableWidget(len(counts), 4)
+        table.setHorizontalHeaderLabels(["Вопрос", "Увидели бы", "Пропустили бы", "Охват"])
+        table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        for row, (question, count) in enumerate(zip(survey['questions'], counts)):
+            share = f"{count['reached'] * 100 / total:.1f}%" if total else "-"
+            for column, text in enumerate((f"{row + 1}. {question['text']}", str(count['reached']),
+                                           str(count['skipped']), share)):
+                table.setItem(row, column, QTableWidgetItem(text))
+        table.resizeColumnsToContents()
+        layout.addWidget(table)
+        
+        close_button = QPushButton("Закрыть")
+        close_button.clicked.connect(dialog.accept)
+        layout.addWidget(close_button)
+        
+        dialog.exec()
+    
     def load_questions_to_editor(self, survey):
         """Загружаем вопросы в редактор"""
         self.questions_list.clear()
@@ -1405,7 +2473,7 @@ class SurveyApp(QMainWindow):
             survey['questions'][question_index] = question
         
         # Сохраняем анкету
-        self.save_surveys()
+        self.mark_survey_dirty(survey)
         
         # Обновляем список вопросов
         self.load_questions_to_editor(survey)
@@ -1424,7 +2492,7 @@ class SurveyApp(QMainWindow):
         if reply == QMessageBox.StandardButton.Yes:
             question_index = current_item.data(Qt.ItemDataRole.UserRole)
             del survey['questions'][question_index]
-            self.save_surveys()
+            self.mark_survey_dirty(survey)
             self.load_questions_to_editor(survey)
     
     def move_question_up(self, survey, parent):
@@ -1433,7 +2501,7 @@ class SurveyApp(QMainWindow):
         if current_row > 0:
             survey['questions'][current_row], survey['questions'][current_row-1] = \
                 survey['questions'][current_row-1], survey['questions'][current_row]
-            self.save_surveys()
+            self.mark_survey_dirty(survey)
             self.load_questions_to_editor(survey)
             self.questions_list.setCurrentRow(current_row - 1)
     
@@ -1443,13 +2511,14 @@ class SurveyApp(QMainWindow):
         if current_row < len(survey['questions']) - 1:
             survey['questions'][current_row], survey['questions'][current_row+1] = \
                 survey['questions'][current_row+1], survey['questions'][current_row]
-            self.save_surveys()
+            self.mark_survey_dirty(survey)
             self.load_questions_to_editor(survey)
             self.questions_list.setCurrentRow(current_row + 1)
     
     def save_survey_editor(self, survey, parent):
         """Сохраняем изменения в анкете"""
-        self.save_surveys()
+        self.dirty_surveys[survey['id']] = survey
+        self.flush_survey_edits()
         if hasattr(self, 'admin_table_ref'):
             self.update_admin_table()
         QMessageBox.information(parent, "Успех", "Анкета сохранена!")
@@ -1457,167 +2526,62 @@ class SurveyApp(QMainWindow):
     
     def delete_survey(self, parent):
         """Удаляем анкету"""
-        current_row = self.admin_table.currentRow()
+        current_row = self.admin_table.currentIndex().row()
         if current_row < 0:
             QMessageBox.warning(parent, "Предупреждение", "Выберите анкету для удаления")
             return
         
-        reply = QMessageBox.question(parent, "Подтверждение", "Вы уверены, что хотите удалить эту анкету?",
+        reply = QMessageBox.question(parent, "Подтверждение", "Вы уверены, что хотите удалить эту анкету?\nВсе ответы на нее тоже будут удалены.",
                                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
-            QMessageBox.information(parent, "Информация", "Функция удаления будет добавлена в следующей версии")
-    
-    def get_visible_questions(self, questions, answers):
-        """Получаем видимые вопросы на основе условий"""
-        visible = []
-        for i, question in enumerate(questions):
-            # Первый вопрос всегда показывается (принудительно убираем условия)
-            if i == 0:
-                question_copy = question.copy()
-                question_copy['conditions'] = []
-                visible.append(question_copy)
-            elif self.should_show_question(question, answers):
-                visible.append(question)
-        return visible
-    
-    def get_potential_visible_questions(self, current_index, answers):
-        """
-        Рассчитывает видимые вопросы, игнорируя условие для текущего вопроса 
-        (предполагаем, что ответ позволит открыть ветки).
-        """
-        potential_visible = []
-
-        for i, question in enumerate(self.current_survey['questions']):
-            if i == current_index:
-                potential_visible.append(i)  # Всегда включаем текущий
-                continue
-
-            # Для других вопросов: проверяем should_show_question
-            temp_answers = answers.copy()
-            if self.should_show_question(question, temp_answers):
-                potential_visible.append(i)
-            else:
-                # Если вопрос не показывается с текущими ответами, 
-                # но может показаться после ответа на текущий вопрос
-                # Для простоты: если вопрос имеет условия, зависящие от текущего вопроса
-                current_question_id = self.current_survey['questions'][current_index]['id']
-                question_conditions = question.get('conditions', [])
-
-                # Проверяем, есть ли условия, зависящие от текущего вопроса
-                depends_on_current = False
-                for condition in question_conditions:
-                    if condition.get('targetId') == current_question_id:
-                        depends_on_current = True
-                        break
-
-                if depends_on_current:
-                    potential_visible.append(i)
-
-        return potential_visible
-
-    def should_show_question(self, question, answers):
-        """Проверяем, должен ли показываться вопрос"""
-        conditions = question.get('conditions', [])
-
-        if not conditions or len(conditions) == 0:
-            return True
-
-        # Если это первый вопрос (индекс 0), всегда показываем его
-        question_index = None
-        for i, q in enumerate(self.current_survey['questions']):
-            if q['id'] == question['id']:
-                question_index = i
-                break
-
-        if question_index == 0:
-            return True
-
-        # Все условия должны выполняться (AND логика)
-        for condition in conditions:
-            condition_result = self.check_condition(condition, answers)
-            if not condition_result:
-                return False
-
-        return True
-    
-    def check_condition(self, condition, answers):
-        """Проверяем условие"""
-        target_id = condition['targetId']
-        operator = condition['operator']
-        value = condition['value']
-        
-        # Получаем ответ на целевой вопрос
-        answer = answers.get(target_id)
-        if answer is None:
-            return False
-        
-        # Проверяем условие
-        if operator == 'equals':
-            return answer == value
-        elif operator == 'not_equals':
-            return answer != value
-        elif operator == 'contains':
-            if isinstance(answer, list):
-                return value in answer
-            else:
-                return str(value) in str(answer)
-        elif operator == 'greater_than':
-            try:
-                return float(answer) > float(value)
-            except (ValueError, TypeError):
-                return False
-        elif operator == 'greater_or_equal':
-            try:
-                return float(answer) >= float(value)
-            except (ValueError, TypeError):
-                return False
-        elif operator == 'less_than':
-            try:
-                return float(answer) < float(value)
-            except (ValueError, TypeError):
-                return False
-        elif operator == 'less_or_equal':
-            try:
-                return float(answer) <= float(value)
-            except (ValueError, TypeError):
-                return False
-        
-        return False
+            # Несохраненные правки не должны вернуть анкету при восстановлении
+            self.flush_survey_edits()
+            survey = self.surveys.pop(current_row)
+            self.drop_survey_window(survey['id'])
+            self.save_surveys()
+            # Ответы анкеты лежат в отдельном шарде - удаляется только он
+            self.persistence.submit("ответы анкеты", "Не удалось удалить ответы анкеты",
+                                    self.storage.delete_responses, survey['id'])
+            self.persistence.submit("сводка ответов", "Не удалось удалить сводку ответов",
+                                    self.aggregates.delete, survey['id'])
+            self.persistence.submit("индекс поиска", "Не удалось удалить индекс поиска",
+                                    self.search_index.delete, survey['id'])
+            
+            self.forget_survey(survey['id'])
+            self.save_settings()
+            
+            self.update_admin_table()
+            self.refresh_default_survey_combo()
+    
+    def drop_survey_window(self, survey_id):
+        """Закрываем окно прохождения удаленной анкеты вместе с его страницами"""
+        window = self.survey_windows.pop(survey_id, None)
+        if window is not None:
+            window.close()
+            window.deleteLater()
+    
+    def forget_survey(self, survey_id):
+        """Помечаем анкету удаленной: выгрузка изменений передаст удаление дальше"""
+        self.settings.setdefault("deleted_surveys", {})[survey_id] = datetime.now().isoformat()
+        if self.settings.get("default_survey_id") == survey_id:
+            self.settings["default_survey_id"] = None
     
     def update_navigation_buttons(self):
         """Обновляем кнопки навигации"""
         # Проверяем, есть ли ответ на текущий вопрос
         current_question_id = self.current_survey['questions'][self.current_question]['id']
         has_answer = current_question_id in self.current_answers
+        has_next = self.visibility.next_visible(self.current_question) is not None
 
         if not has_answer:
-            # Без ответа: используем потенциальные видимые вопросы
-            potential_visible = self.get_potential_visible_questions(self.current_question, self.current_answers)
-            current_pos = potential_visible.index(self.current_question) if self.current_question in potential_visible else -1
-            has_next = current_pos < len(potential_visible) - 1
-        else:
-            # С ответом: пересчитываем актуальные видимые вопросы
-            visible_questions = []
-            for i, question in enumerate(self.current_survey['questions']):
-                if self.should_show_question(question, self.current_answers):
-                    visible_questions.append(i)
-
-            # Находим индекс текущего вопроса в списке видимых
-            current_visible_index = -1
-            for i, question_index in enumerate(visible_questions):
-                if question_index == self.current_question:
-                    current_visible_index = i
-                    break
-
-            has_next = current_visible_index < len(visible_questions) - 1
+            # Без ответа: учитываем вопросы, которые может открыть ответ на текущий
+            has_next = has_next or self.visibility.may_open_after(self.current_question)
+        elif not self.visibility.visible[self.current_question]:
+            # Текущий вопрос скрыт: кнопка ведет дальше, если есть хоть один видимый
+            has_next = self.visibility.visible_count > 0
 
         # Обновляем кнопки с учетом условной логики
-        has_prev = False
-        for i in range(self.current_question - 1, -1, -1):
-            question = self.current_survey['questions'][i]
-            if self.should_show_question(question, self.current_answers):
-                has_prev = True
-                break
+        has_prev = self.visibility.prev_visible(self.current_question) is not None
         
         self.prev_button.setEnabled(has_prev)
 
@@ -1637,46 +2601,191 @@ class SurveyApp(QMainWindow):
         )
         
         if filename:
-            export_data = {
-                'surveys': self.surveys,
-                'responses': self.responses,
-                'exportDate': datetime.now().isoformat(),
-                'version': '1.0.0'
-            }
-            
             try:
-                with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump(export_data, f, ensure_ascii=False, indent=2)
+                self.persistence.flush()
+                write_backup(filename, self.surveys, self.storage.iter_responses(), {
+                    'exportDate': datetime.now().isoformat(),
+                    'version': '1.0.0'
+                })
                 QMessageBox.information(self, "Успех", "Данные успешно экспортированы")
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка", f"Не удалось экспортировать данные: {e}")
     
+    def export_changes(self):
+        """Экспортируем только изменения с прошлой выгрузки в то же назначение
+        
+        Для каждого назначения (например, сервера сбора данных) в настройках
+        хранится метка времени прошлой выгрузки; в файл попадают анкеты,
+        измененные после нее, ответы, завершенные после нее, и id анкет,
+        удаленных после нее (deletedSurveys) - импорт удаляет их вместе с ответами.
+        """
+        watermarks = self.settings.setdefault("sync_watermarks", {})
+        destination, ok = QInputDialog.getItem(
+            self, "Экспорт изменений", "Назначение выгрузки:",
+            sorted(watermarks) or ["Сервер"], 0, True
+        )
+        destination = destination.strip()
+        if not ok or not destination:
+            return
+        
+        filename, _ = QFileDialog.getSaveFileName(
+            self, "Экспорт изменений", f"{destination}_{datetime.now().strftime('%Y%m%d_%H%M')}.json",
+            "JSON files (*.json);;All files (*.*)"
+        )
+        if not filename:
+            return
+        
+        since = watermarks.get(destination)
+        # Метку фиксируем до выборки: все, что появится позже, уйдет в следующую выгрузку
+        export_date = datetime.now().isoformat()
+        surveys = [s for s in self.surveys if since is None or survey_changed_at(s) > since]
+        deleted = sorted(survey_id for survey_id, deleted_at in self.settings.get("deleted_surveys", {}).items()
+                         if since is None or deleted_at > since)
+        
+        try:
+            self.persistence.flush()
+            written = write_backup(filename, surveys, self.storage.iter_responses_since(since), {
+                'exportDate': export_date,
+                'since': since,
+                'deletedSurveys': deleted,
+                'version': '1.0.0'
+            })
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось экспортировать изменения: {e}")
+            return
+        
+        watermarks[destination] = export_date
+        self.save_settings()
+        QMessageBox.information(self, "Успех",
+                              f"Изменения экспортированы\nАнкет: {len(surveys)}, ответов: {written}, "
+                              f"удаленных анкет: {len(deleted)}")
+    
     def import_data(self):
-        """Импортируем данные"""
+        """Импортируем данные (в фоновом потоке, с возможностью отмены)"""
         filename, _ = QFileDialog.getOpenFileName(
             self, "Импорт данных", "", "JSON files (*.json);;All files (*.*)"
         )
         
         if filename:
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                if 'surveys' in data and 'responses' in data:
-                    self.surveys = data['surveys']
-                    self.responses = data['responses']
-                    self.save_surveys()
-                    self.save_responses()
-                    QMessageBox.information(self, "Успех", "Данные успешно импортированы")
-                else:
-                    QMessageBox.critical(self, "Ошибка", "Неверный формат файла")
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Не удалось импортировать данные: {e}")
+            self.start_import([filename], merge=False)
+    
+    def merge_data(self):
+        """Объединяем данные из выгрузок нескольких компьютеров с локальными"""
+        filenames, _ = QFileDialog.getOpenFileNames(
+            self, "Объединение данных", "", "JSON files (*.json);;All files (*.*)"
+        )
+        
+        if filenames:
+            self.start_import(filenames, merge=True)
+    
+    def start_import(self, filenames, merge):
+        """Запускаем импорт или слияние в фоновом потоке"""
+        title = "Объединение данных" if merge else "Импорт данных"
+        progress_dialog = QProgressDialog(f"{title}...", "Отмена", 0, 1000, self)
+        progress_dialog.setWindowTitle(title)
+        progress_dialog.setWindowModality(Qt.WindowModality.ApplicationModal)
+        progress_dialog.setAutoClose(False)
+        progress_dialog.setAutoReset(False)
+        progress_dialog.setMinimumDuration(0)
+        
+        # Импорт пишет в хранилище из своего потока - сначала дописываем очередь
+        self.persistence.flush()
+        worker = BackupImportWorker(self.storage, filenames, merge, self)
+        worker.progress.connect(progress_dialog.setValue)
+        progress_dialog.canceled.connect(worker.cancel)
+        worker.completed.connect(lambda surveys, stats: self.on_import_completed(progress_dialog, worker, surveys, stats))
+        worker.failed.connect(lambda error: self.on_import_failed(progress_dialog, worker, error))
+        worker.cancelled.connect(lambda: self.on_import_cancelled(progress_dialog, worker))
+        worker.finished.connect(worker.deleteLater)
+        
+        self.import_worker = worker
+        worker.start()
+        progress_dialog.show()
+    
+    def close_import_progress(self, progress_dialog, worker):
+        """Закрываем окно прогресса импорта"""
+        progress_dialog.canceled.disconnect(worker.cancel)
+        progress_dialog.close()
+        self.import_worker = None
+    
+    def on_import_completed(self, progress_dialog, worker, surveys, stats):
+        """Импорт завершен: подменяем или объединяем анкеты и обновляем интерфейс"""
+        self.close_import_progress(progress_dialog, worker)
+        
+        # Анкеты, удаленные в выгрузках изменений, убираем и у себя вместе с ответами
+        deleted = set(stats.get('deletedSurveys', ()))
+        if deleted:
+            surveys = [s for s in surveys if s.get('id') not in deleted]
+            self.surveys = [s for s in self.surveys if s.get('id') not in deleted]
+            for survey_id in deleted:
+                self.persistence.submit("ответы анкеты", "Не удалось удалить ответы анкеты",
+                                        self.storage.delete_responses, survey_id)
+                self.drop_survey_window(survey_id)
+                self.forget_survey(survey_id)
+            self.save_settings()
+        
+        if worker.merge:
+            survey_stats = self.merge_surveys(surveys)
+            message = (f"Данные объединены\n"
+                       f"Анкеты: новых {survey_stats['new']}, дубликатов {survey_stats['duplicates']}, "
+                       f"конфликтов {survey_stats['conflicts']}\n"
+                       f"Ответы: новых {stats['new']}, дубликатов {stats['duplicates']}, "
+                       f"конфликтов {stats['conflicts']}")
+            if deleted:
+                message += f"\nУдалено анкет: {len(deleted)}"
+            if survey_stats['conflicts'] or stats['conflicts']:
+                message += "\n\nПри конфликтах сохранены локальные версии."
+        else:
+            self.surveys = surveys
+            message = (f"Данные успешно импортированы\n"
+                       f"Анкет: {len(surveys)}, ответов: {stats['responses']}")
+        self.save_surveys()
+        # Ответы заменены или дополнены - сводки пересчитаются при просмотре
+        try:
+            self.aggregates.reset()
+            self.search_index.reset()
+            self.response_filter.reset()
+        except Exception as e:
+            print(f"Ошибка сброса сводок ответов: {e}")
+        
+        if hasattr(self, 'admin_table_ref'):
+            self.update_admin_table()
+        if hasattr(self, 'default_survey_combo'):
+            self.refresh_default_survey_combo()
+        
+        QMessageBox.information(self, "Успех", message)
+    
+    def merge_surveys(self, incoming):
+        """Объединяем анкеты по id; при расхождении оставляем локальную версию"""
+        by_id = {survey['id']: survey for survey in self.surveys}
+        stats = {'new': 0, 'duplicates': 0, 'conflicts': 0}
+        
+        for survey in incoming:
+            existing = by_id.get(survey.get('id'))
+            if existing is None:
+                self.surveys.append(survey)
+                by_id[survey['id']] = survey
+                stats['new'] += 1
+            elif existing == survey:
+                stats['duplicates'] += 1
+            else:
+                stats['conflicts'] += 1
+        return stats
+    
+    def on_import_failed(self, progress_dialog, worker, error):
+        """Ошибка импорта: данные остались прежними"""
+        self.close_import_progress(progress_dialog, worker)
+        QMessageBox.critical(self, "Ошибка", f"Не удалось импортировать данные: {error}")
+    
+    def on_import_cancelled(self, progress_dialog, worker):
+        """Импорт отменен: данные остались прежними"""
+        self.close_import_progress(progress_dialog, worker)
+        QMessageBox.information(self, "Информация", "Импорт отменен, данные не изменены")
     
     def export_single_survey(self):
         """Экспорт отдельной анкеты"""
         # Получаем выбранную анкету из таблицы
-        current_row = self.admin_table.currentRow()
+        current_row = self.admin_table.currentIndex().row()
         if current_row < 0:
             QMessageBox.warning(self, "Ошибка", "Выберите анкету для экспорта")
             return
@@ -1729,6 +2838,7 @@ class SurveyApp(QMainWindow):
                         # Генерируем новый ID
                         survey['id'] = str(uuid.uuid4())
                         survey['title'] = f"{survey.get('title', 'Анкета')} (импорт)"
+                    self.mark_survey_changed(survey)
                     
                     # Добавляем анкету
                     self.surveys.append(survey)
@@ -1775,7 +2885,12 @@ def main():
     window = SurveyApp()
     window.show()
     
-    sys.exit(app.exec())
+    exit_code = app.exec()
+    # Дописываем правки редактора и все, что осталось в очереди сохранения
+    window.flush_survey_edits()
+    window.persistence.stop()
+    window.storage.close()
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Колоночный двоичный формат ответов для анализа - файл на анкету, читается через mmap
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from survey_responses import NO_TIMESTAMP, decode_timestamp, encode_timestamp, value_key
+from survey_storage import replace_file, shard_name
+
+try:
+    import numpy
+except ImportError:  # без NumPy столбцы читаются в array.array - медленнее, но работает
+    numpy = None
+
+# Расширение колоночных файлов
+COLUMNAR_SUFFIX = ".col"
+
+# Каталог кэша колоночных файлов (для анализа) в директории данных
+COLUMNAR_CACHE_DIRNAME = "columnar"
+
+MAGIC = b"SURVCOL1"
+# Заголовок: сигнатура, длина JSON-описания (uint64), описание; данные выровнены по 8 байт
+PREFIX = struct.Struct("<8sQ")
+ALIGNMENT = 8
+
+# Код отсутствующего ответа в столбце кодов
+MISSING = -1
+
+# Признак в столбце present числового вопроса
+NUMBER_MISSING, NUMBER_INT, NUMBER_FLOAT = 0, 1, 2
+
+# Больше вариантов в одну битовую маску uint64 не помещается
+MAX_MASK_OPTIONS = 64
+
+# Типы элементов: код array.array и dtype NumPy (порядок байт - little-endian)
+DTYPES = {
+    'int8': ('b', '<i1'),
+    'uint8': ('B', '<u1'),
+    'int32': ('i', '<i4'),
+    'int64': ('q', '<i8'),
+    'uint64': ('Q', '<u8'),
+    'float64': ('d', '<f8'),
+}
+
+# Поля ответа, хранящиеся в своих столбцах
+RESPONSE_FIELDS = ('id', 'surveyId', 'answers', 'completedAt')
+
+
+def _is_integer(value) -> bool:
+    """Целое, точно представимое в float64 (bool в JSON - не число)"""
+    return isinstance(value, int) and not isinstance(value, bool) and abs(value) <= 1 << 53
+
+
+class TextColumnWriter:
+    """Строки: смещения (int64, n + 1) и общий блок UTF-8"""
+
+    def __init__(self):
+        self.offsets = array('q', [0])
+        self.present = array('B')
+        self.blob = bytearray()
+
+    def append(self, value: Optional[str]):
+        if value is not None:
+            self.blob += value.encode('utf-8')
+        self.offsets.append(len(self.blob))
+        self.present.append(value is not None)
+
+    def sections(self):
+        return {'offsets': ('int64', self.offsets), 'present': ('uint8', self.present), 'blob': ('bytes', self.blob)}
+
+
+class ColumnarWriter:
+    """Собираем колоночный файл анкеты из ответов (словарей)
+
+    Радио-вопросы - коды int32 в таблицу значений (сначала варианты
+    ответа), чекбоксы - битовые маски uint64 по вариантам, числа -
+    float64 с признаком целого, текст - смещения и блок UTF-8. Все, что
+    не укладывается в тип вопроса (ответ вне вариантов в другом порядке,
+    строка вместо числа, лишние поля), попадает в JSON-блок исключений,
+    поэтому обратное преобразование восстанавливает ответы без потерь.
+    """
+
+    def __init__(self, survey: Dict):
+        self.survey = survey
+        self.survey_id = survey['id']
+        self.rows = 0
+        self.ids = TextColumnWriter()
+        self.timestamps = array('q')
+        self.columns: Dict[str, Dict[str, Any]] = {}
+        self.extras: Dict[int, Dict] = {}
+
+        for question in survey['questions']:
+            question_id = question['id']
+            if question_id in self.columns:
+                continue
+            options = list(question.get('options', []))
+            kind = question.get('type')
+            if kind == 'checkbox' and len(options) <= MAX_MASK_OPTIONS:
+                column = {'kind': 'checkbox', 'options': options,
+                          'mask': array('Q'), 'present': array('B')}
+            elif kind == 'number':
+                column = {'kind': 'number', 'values': array('d'), 'present': array('B')}
+            elif kind == 'text':
+                column = {'kind': 'text', 'text': TextColumnWriter()}
+            else:
+                # Радио и прочие вопросы с повторяющимися ответами - коды значений
+                column = {'kind': 'codes', 'codes': array('i'), 'values': options,
+                          'index': {value_key(v): i for i, v in enumerate(options)}}
+            self.columns[question_id] = column
+
+    def _extra(self, row: int) -> Dict:
+        return self.extras.setdefault(row, {})
+
+    def append(self, response: Dict):
+        row = self.rows
+        self.rows += 1
+
+        response_id = response.get('id')
+        if response_id is None or isinstance(response_id, str):
+            self.ids.append(response_id)
+        else:
+            self.ids.append(None)
+            self._extra(row).setdefault('fields', {})['id'] = response_id
+
+        completed_at = response.get('completedAt')
+        timestamp = encode_timestamp(completed_at)
+        self.timestamps.append(timestamp)
+        if timestamp == NO_TIMESTAMP and completed_at is not None:
+            self._extra(row).setdefault('fields', {})['completedAt'] = completed_at
+
+        fields = {k: v for k, v in response.items() if k not in RESPONSE_FIELDS}
+        if response.get('surveyId') != self.survey_id:
+            fields['surveyId'] = response.get('surveyId')
+        answers = response.get('answers', {})
+        if not isinstance(answers, dict):
+            fields['answers'] = answers
+            answers = {}
+        if fields:
+            self._extra(row).setdefault('fields', {}).update(fields)
+        missing = [k for k in RESPONSE_FIELDS if k not in response]
+        if missing:
+            self._extra(row)['missing'] = missing
+
+        for question_id, column in self.columns.items():
+            self._append_answer(row, question_id, column, answers.get(question_id), question_id in answers)
+
+        unknown = {k: v for k, v in answers.items() if k not in self.columns}
+        if unknown:
+            self._extra(row).setdefault('answers', {}).update(unknown)
+
+    def _append_answer(self, row: int, question_id: str, column: Dict, value, present: bool):
+        kind = column['kind']
+        stored = present
+        if kind == 'codes':
+            code = MISSING
+            if present:
+                key = value_key(value)
+                code = column['index'].get(key)
+                if code is None:
+                    code = column['index'][key] = len(column['values'])
+                    column['values'].append(value)
+            column['codes'].append(code)
+        elif kind == 'checkbox':
+            mask = 0
+            options = column['options']
+            if present:
+                if isinstance(value, list) and all(isinstance(v, str) for v in value):
+                    positions = [options.index(v) if v in options else -1 for v in value]
+                    # Маска хранит набор, поэтому порядок должен совпадать с порядком вариантов
+                    if -1 not in positions and positions == sorted(set(positions)):
+                        for position in positions:
+                            mask |= 1 << position
+                    else:
+                        stored = False
+                else:
+                    stored = False
+            column['mask'].append(mask)
+            column['present'].append(stored)
+        elif kind == 'number':
+            flag = NUMBER_MISSING
+            number = 0.0
+            if present:
+                if _is_integer(value):
+                    flag, number = NUMBER_INT, float(value)
+                elif isinstance(value, float) and value == value:
+                    flag, number = NUMBER_FLOAT, value
+                else:
+                    stored = False
+            column['values'].append(number)
+            column['present'].append(flag)
+        else:
+            if present and not isinstance(value, str):
+                stored = False
+            column['text'].append(value if stored else None)
+
+        if present and not stored:
+            self._extra(row).setdefault('answers', {})[question_id] = value
+
+    def write(self, filename: str, source_version: Optional[str] = None):
+        """Записываем файл атомарно (временный файл, fsync, переименование)
+
+        source_version - версия данных хранилища, из которых собран файл.
+        """
+        sections: List[Tuple[str, str, Any]] = []
+        columns_meta = {}
+
+        def add(name, dtype, data):
+            sections.append((name, dtype, data))
+            return name
+
+        id_sections = {key: add(f"id.{key}", dtype, data) for key, (dtype, data) in self.ids.sections().items()}
+        add("completedAt", 'int64', self.timestamps)
+        for i, (question_id, column) in enumerate(self.columns.items()):
+            prefix = f"q{i}"
+            meta = {'kind': column['kind']}
+            if column['kind'] == 'codes':
+                meta['values'] = column['values']
+                meta['codes'] = add(f"{prefix}.codes", 'int32', column['codes'])
+            elif column['kind'] == 'checkbox':
+                meta['options'] = column['options']
+                meta['mask'] = add(f"{prefix}.mask", 'uint64', column['mask'])
+                meta['present'] = add(f"{prefix}.present", 'uint8', column['present'])
+            elif column['kind'] == 'number':
+                meta['values'] = add(f"{prefix}.values", 'float64', column['values'])
+                meta['present'] = add(f"{prefix}.present", 'uint8', column['present'])
+            else:
+                for key, (dtype, data) in column['text'].sections().items():
+                    meta[key] = add(f"{prefix}.{key}", dtype, data)
+            columns_meta[question_id] = meta
+        extras = json.dumps({str(row): extra for row, extra in self.extras.items()},
+                            ensure_ascii=False).encode('utf-8')
+        add("extras", 'bytes', extras)
+
+        # Смещения секций зависят от длины заголовка, а он - от смещений: считаем от конца заголовка
+        layout = {}
+        position = 0
+        for name, dtype, data in sections:
+            size = len(data) if dtype == 'bytes' else len(data) * data.itemsize
+            layout[name] = [position, size, dtype]
+            position += size + (-size % ALIGNMENT)
+        header = {
+            'version': 1,
+            'surveyId': self.survey_id,
+            'rows': self.rows,
+            'questionsHash': questions_hash(self.survey),
+            'sourceVersion': source_version,
+            'id': id_sections,
+            'columns': columns_meta,
+            'sections': layout,
+        }
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        header_bytes += b" " * (-(PREFIX.size + len(header_bytes)) % ALIGNMENT)
+
+        temp_file = filename + ".tmp"
+        with open(temp_file, 'wb') as f:
+            f.write(PREFIX.pack(MAGIC, len(header_bytes)))
+            f.write(header_bytes)
+            for name, dtype, data in sections:
+                if dtype != 'bytes' and sys.byteorder != 'little':
+                    data = array(data.typecode, data)
+                    data.byteswap()
+                raw = bytes(data) if dtype == 'bytes' else data.tobytes()
+                f.write(raw)
+                f.write(b"\0" * (-len(raw) % ALIGNMENT))
+            f.flush()
+            os.fsync(f.fileno())
+        replace_file(temp_file, filename)
+
+
+def write_columnar(survey: Dict, responses: Iterable[Dict], filename: str) -> int:
+    """Записываем ответы анкеты в колоночный файл; возвращаем число ответов"""
+    writer = ColumnarWriter(survey)
+    for response in responses:
+        writer.append(response)
+    writer.write(filename)
+    return writer.rows
+
+
+class ColumnarResponses:
+    """Чтение колоночного файла через mmap без разбора JSON
+
+    column(...) отдает массив NumPy прямо поверх отображенного файла
+    (или array.array, если NumPy не установлен). Итерация восстанавливает
+    исходные ответы-словари.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_size = PREFIX.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Неверный формат файла {os.path.basename(filename)}")
+        self.header = json.loads(bytes(self.buffer[PREFIX.size:PREFIX.size + header_size]))
+        self.data_start = PREFIX.size + header_size
+        self.survey_id = self.header['surveyId']
+        self.rows = self.header['rows']
+        self.columns: Dict[str, Dict] = self.header['columns']
+        self.extras = {int(row): extra for row, extra in json.loads(self.section_bytes("extras")).items()}
+        self._cache = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            self.close()
+        except BufferError:
+            # Кадры исключения еще держат массивы поверх отображения - не
+            # подменяем им исходную ошибку
+            if exc_type is None:
+                raise
+
+    def close(self):
+        """Закрываем отображение файла
+
+        Массивы секций из кэша отпускаются первыми. Если снаружи еще
+        остались массивы поверх отображения, mmap выдает BufferError: файл
+        остался бы открытым, и в Windows его нельзя было бы пересобрать.
+        """
+        self._cache = {}
+        self.buffer.close()
+
+    def section_bytes(self, name: str) -> bytes:
+        offset, size, _ = self.header['sections'][name]
+        start = self.data_start + offset
+        return bytes(self.buffer[start:start + size])
+
+    def section(self, name: str):
+        """Секция как массив: NumPy поверх mmap или array.array"""
+        cached = self._cache.get(name)
+        if cached is not None:
+            return cached
+        offset, size, dtype = self.header['sections'][name]
+        typecode, numpy_dtype = DTYPES[dtype]
+        if numpy is not None:
+            data = numpy.frombuffer(self.buffer, dtype=numpy_dtype, count=size // numpy.dtype(numpy_dtype).itemsize,
+                                    offset=self.data_start + offset)
+        else:
+            data = array(typecode)
+            data.frombytes(self.section_bytes(name))
+            if sys.byteorder != 'little':
+                data.byteswap()
+        self._cache[name] = data
+        return data
+
+    def column(self, question_id: str, part: Optional[str] = None):
+        """Массив столбца вопроса: codes / mask / values / present / offsets"""
+        meta = self.columns[question_id]
+        if part is None:
+            part = {'codes': 'codes', 'checkbox': 'mask', 'number': 'values', 'text': 'offsets'}[meta['kind']]
+        return self.section(meta[part])
+
+    def completed_at(self):
+        """Время завершения в микросекундах от эпохи (NO_TIMESTAMP - см. исключения)"""
+        return self.section("completedAt")
+
+    def _text(self, sections: Dict[str, str], row: int) -> Optional[str]:
+        if not self.section(sections['present'])[row]:
+            return None
+        offsets = self.section(sections['offsets'])
+        blob_offset = self.header['sections'][sections['blob']][0] + self.data_start
+        start, end = int(offsets[row]), int(offsets[row + 1])
+        return bytes(self.buffer[blob_offset + start:blob_offset + end]).decode('utf-8')
+
+    def answer(self, question_id: str, row: int) -> Tuple[bool, Any]:
+        """(есть ли ответ в столбце, значение)"""
+        meta = self.columns[question_id]
+        kind = meta['kind']
+        if kind == 'codes':
+            code = int(self.section(meta['codes'])[row])
+            return (False, None) if code == MISSING else (True, meta['values'][code])
+        if kind == 'checkbox':
+            if not self.section(meta['present'])[row]:
+                return False, None
+            mask = int(self.section(meta['mask'])[row])
+            return True, [option for i, option in enumerate(meta['options']) if mask >> i & 1]
+        if kind == 'number':
+            flag = int(self.section(meta['present'])[row])
+            if flag == NUMBER_MISSING:
+                return False, None
+            value = float(self.section(meta['values'])[row])
+            return True, int(value) if flag == NUMBER_INT else value
+        value = self._text(meta, row)
+        return value is not None, value
+
+    def row(self, row: int) -> Dict:
+        """Ответ в исходном виде (словарь)"""
+        extra = self.extras.get(row, {})
+        answers = {}
+        for question_id in self.columns:
+            present, value = self.answer(question_id, row)
+            if present:
+                answers[question_id] = value
+        answers.update(extra.get('answers', {}))
+
+        timestamp = int(self.completed_at()[row])
+        response = {
+            'id': self._text(self.header['id'], row),
+            'surveyId': self.survey_id,
+            'answers': answers,
+            'completedAt': None if timestamp == NO_TIMESTAMP else decode_timestamp(timestamp),
+        }
+        response.update(extra.get('fields', {}))
+        for field in extra.get('missing', ()):
+            response.pop(field, None)
+        return response
+
+    def __iter__(self) -> Iterator[Dict]:
+        for row in range(self.rows):
+            yield self.row(row)
+
+
+def columnar_to_json(columnar_file: str, json_file: str) -> int:
+    """Обратное преобразование: колоночный файл -> JSON-массив ответов"""
+    with ColumnarResponses(columnar_file) as source:
+        temp_file = json_file + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write("[")
+            for i, response in enumerate(source):
+                f.write(",\n" if i else "\n")
+                f.write(json.dumps(response, ensure_ascii=False))
+            f.write("\n]\n")
+            f.flush()
+            os.fsync(f.fileno())
+        replace_file(temp_file, json_file)
+        return source.rows
+
+
+def questions_hash(survey: Dict) -> str:
+    """Отпечаток вопросов анкеты: при их изменении колоночный файл собирается заново
+
+    Учитываются только поля, от которых зависит раскладка столбцов (id,
+    тип, варианты) - правка текста или условий файл не устаревает.
+    """
+    layout = [(q['id'], q.get('type'), q.get('options', [])) for q in survey['questions']]
+    text = json.dumps(layout, ensure_ascii=False)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def open_columnar(storage, survey: Dict, cache_dir: str) -> ColumnarResponses:
+    """Колоночный файл анкеты из кэша; собирается заново, если ответы или вопросы изменились"""
+    os.makedirs(cache_dir, exist_ok=True)
+    filename = os.path.join(cache_dir, shard_name(survey['id']) + COLUMNAR_SUFFIX)
+    version = storage.responses_version(survey['id'])
+    if os.path.exists(filename):
+        try:
+            columnar = ColumnarResponses(filename)
+            if columnar.header.get('sourceVersion') == version and \
+                    columnar.header.get('questionsHash') == questions_hash(survey):
+                return columnar
+            columnar.close()
+        except Exception as e:
+            print(f"Ошибка чтения колоночного файла: {e}")
+
+    writer = ColumnarWriter(survey)
+    for response in storage.iter_responses(survey['id']):
+        writer.append(response)
+    writer.write(filename, version)
+    return ColumnarResponses(filename)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Условная логика анкет - условия показа вопросов, скомпилированные в предикаты
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+
+Predicate = Callable[[Any], bool]
+
+
+def _never(answer) -> bool:
+    return False
+
+
+def _equals(value) -> Predicate:
+    return lambda answer: answer == value
+
+
+def _not_equals(value) -> Predicate:
+    return lambda answer: answer != value
+
+
+def _contains(value) -> Predicate:
+    text = str(value)
+
+    def predicate(answer):
+        if isinstance(answer, list):
+            return value in answer
+        return text in str(answer)
+    return predicate
+
+
+def _numeric(compare: Callable[[float, float], bool]):
+    """Числовое сравнение; значение условия переводится в число один раз"""
+    def factory(value) -> Predicate:
+        try:
+            number = float(value)
+        except (ValueError, TypeError):
+            return _never
+
+        def predicate(answer):
+            try:
+                return compare(float(answer), number)
+            except (ValueError, TypeError):
+                return False
+        return predicate
+    return factory
+
+
+# Операторы условий: имя -> фабрика предиката по значению условия
+OPERATORS: Dict[str, Callable[[Any], Predicate]] = {
+    'equals': _equals,
+    'not_equals': _not_equals,
+    'contains': _contains,
+    'greater_than': _numeric(lambda a, b: a > b),
+    'greater_or_equal': _numeric(lambda a, b: a >= b),
+    'less_than': _numeric(lambda a, b: a < b),
+    'less_or_equal': _numeric(lambda a, b: a <= b),
+}
+
+
+def compile_condition(condition: Dict) -> Callable[[Dict], bool]:
+    """Превращаем условие в функцию от словаря ответов"""
+    target_id = condition['targetId']
+    factory = OPERATORS.get(condition['operator'])
+    if factory is None:
+        return lambda answers: False
+    predicate = factory(condition['value'])
+
+    def check(answers):
+        answer = answers.get(target_id)
+        if answer is None:
+            return False
+        return predicate(answer)
+    return check
+
+
+class CompiledSurvey:
+    """Анкета с заранее разобранными условиями показа вопросов
+
+    Строится один раз на прохождение анкеты: индекс вопросов по id и
+    список проверок для каждого вопроса, так что видимость вопроса
+    вычисляется без поиска и повторного разбора условий.
+    """
+
+    def __init__(self, survey: Dict):
+        self.questions: List[Dict] = survey['questions']
+        self.index_by_id: Dict[str, int] = {}
+        for i, question in enumerate(self.questions):
+            self.index_by_id.setdefault(question['id'], i)
+
+        self.checks: List[List[Callable[[Dict], bool]]] = []
+        self.always_visible: List[bool] = []
+        # Граф зависимостей: id вопроса -> индексы вопросов, чьи условия на него ссылаются
+        self.dependents: Dict[str, List[int]] = {}
+        for i, question in enumerate(self.questions):
+            conditions = question.get('conditions', [])
+            # Вопрос на первом месте (по id) показывается всегда
+            always = not conditions or self.index_by_id[question['id']] == 0
+            self.always_visible.append(always)
+            self.checks.append([] if always else [compile_condition(c) for c in conditions])
+            if not always:
+                for target_id in {c['targetId'] for c in conditions}:
+                    self.dependents.setdefault(target_id, []).append(i)
+
+    def __len__(self):
+        return len(self.questions)
+
+    def is_visible(self, index: int, answers: Dict) -> bool:
+        """Должен ли показываться вопрос (все условия - логическое И)"""
+        if self.always_visible[index]:
+            return True
+        for check in self.checks[index]:
+            if not check(answers):
+                return False
+        return True
+
+    def visible_indices(self, answers: Dict) -> List[int]:
+        """Индексы видимых вопросов; первый вопрос виден всегда"""
+        return [i for i in range(len(self.questions)) if i == 0 or self.is_visible(i, answers)]
+
+
+class VisibilityTracker:
+    """Видимость вопросов, поддерживаемая инкрементально
+
+    При изменении ответа пересчитываются только вопросы, чьи условия
+    ссылаются на этот вопрос. Видимость зависит лишь от сохраненных
+    ответов (а не от видимости целевого вопроса), поэтому прямых
+    зависимостей достаточно - цепочки не требуют повторного обхода.
+    """
+
+    def __init__(self, compiled: CompiledSurvey, answers: Dict):
+        self.compiled = compiled
+        self.answers = answers
+        self.visible: List[bool] = [i == 0 or compiled.is_visible(i, answers) for i in range(len(compiled))]
+        self.visible_count = sum(self.visible)
+
+    def set_answer(self, question_id: str, answer) -> List[int]:
+        """Сохраняем ответ и возвращаем индексы вопросов, сменивших видимость"""
+        if question_id in self.answers and self.answers[question_id] == answer:
+            return []
+        self.answers[question_id] = answer
+
+        changed = []
+        for i in self.compiled.dependents.get(question_id, ()):
+            visible = i == 0 or self.compiled.is_visible(i, self.answers)
+            if visible != self.visible[i]:
+                self.visible[i] = visible
+                self.visible_count += 1 if visible else -1
+                changed.append(i)
+        return changed
+
+    def next_visible(self, index: int) -> Optional[int]:
+        """Ближайший видимый вопрос после index"""
+        for i in range(index + 1, len(self.visible)):
+            if self.visible[i]:
+                return i
+        return None
+
+    def prev_visible(self, index: int) -> Optional[int]:
+        """Ближайший видимый вопрос перед index"""
+        for i in range(index - 1, -1, -1):
+            if self.visible[i]:
+                return i
+        return None
+
+    def may_open_after(self, index: int) -> bool:
+        """Может ли ответ на вопрос открыть скрытый вопрос после него"""
+        question_id = self.compiled.questions[index]['id']
+        return any(i > index for i in self.compiled.dependents.get(question_id, ()))
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Экспорт и импорт данных - потоковая выгрузка в CSV и чтение больших резервных копий
+"""
+
+import codecs
+import csv
+import json
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Через сколько строк сообщаем о прогрессе
+PROGRESS_STEP = 1000
+
+# Разделитель CSV: Excel с русской локалью ожидает точку с запятой
+CSV_DELIMITER = ';'
+
+
+def format_answer(answer) -> str:
+    """Ответ в виде текста ячейки (варианты чекбоксов - через запятую)"""
+    if answer is None:
+        return ""
+    if isinstance(answer, list):
+        return ", ".join(str(a) for a in answer)
+    return str(answer)
+
+
+def iter_responses_at(storage, survey_id: str, ordinals: List[int]) -> Iterator[Dict]:
+    """Ответы анкеты с данными порядковыми номерами, читаемые порциями по PROGRESS_STEP"""
+    for start in range(0, len(ordinals), PROGRESS_STEP):
+        yield from storage.responses_at(survey_id, ordinals[start:start + PROGRESS_STEP])
+
+
+def write_responses_csv(storage, survey: Dict, filename: str,
+                        progress: Optional[Callable[[int], bool]] = None,
+                        ordinals: Optional[List[int]] = None) -> int:
+    """Выгружаем ответы анкеты в CSV, читая их из хранилища по одному
+
+    Одна строка - один ответ, один столбец - один вопрос. Если задан
+    список порядковых номеров (результат фильтра), выгружаются только
+    эти ответы. progress вызывается с числом выгруженных строк; если он
+    вернет False, выгрузка прерывается. Возвращаем число записанных строк.
+    """
+    question_ids = [q['id'] for q in survey['questions']]
+    written = 0
+
+    with open(filename, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, delimiter=CSV_DELIMITER)
+        writer.writerow(["id", "completedAt"] + [f"{q['id']}: {q['text']}" for q in survey['questions']])
+
+        responses = storage.iter_responses(survey['id']) if ordinals is None else \
+            iter_responses_at(storage, survey['id'], ordinals)
+        for response in responses:
+            answers = response.get('answers', {})
+            writer.writerow([response.get('id', ''), response.get('completedAt', '')] +
+                            [format_answer(answers.get(qid)) for qid in question_ids])
+            written += 1
+            if progress is not None and written % PROGRESS_STEP == 0:
+                if progress(written) is False:
+                    break
+
+    return written
+
+
+def write_crosstab_csv(table: Dict, filename: str, corner: str = ""):
+    """Выгружаем кросс-таблицу {'rows', 'columns', 'counts'} в CSV с итогами по строкам и столбцам"""
+    with open(filename, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, delimiter=CSV_DELIMITER)
+        writer.writerow([corner] + list(table['columns']) + ["Всего"])
+        for label, counts in zip(table['rows'], table['counts']):
+            writer.writerow([label] + list(counts) + [sum(counts)])
+        totals = [sum(column) for column in zip(*table['counts'])]
+        writer.writerow(["Всего"] + totals + [sum(totals)])
+
+
+def survey_changed_at(survey: Dict) -> str:
+    """Время последнего изменения анкеты (у старых анкет - время создания)"""
+    return survey.get('updatedAt') or survey.get('createdAt') or ''
+
+
+def write_backup(filename: str, surveys: Iterable[Dict], responses: Iterable[Dict],
+                 meta: Optional[Dict] = None) -> int:
+    """Записываем резервную копию {"surveys": [...], "responses": [...], ...}
+
+    Ответы пишутся по одному, не собираясь в список, поэтому выгрузка
+    не требует памяти под всю историю. Формат совпадает с тем, что
+    читает BackupReader. Возвращаем число записанных ответов.
+    """
+    written = 0
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('{\n"surveys": ')
+        json.dump(list(surveys), f, ensure_ascii=False, indent=2)
+        f.write(',\n"responses": [')
+        for response in responses:
+            f.write(',\n' if written else '\n')
+            json.dump(response, f, ensure_ascii=False)
+            written += 1
+        f.write('\n]')
+        for key, value in (meta or {}).items():
+            f.write(f',\n{json.dumps(key)}: ')
+            json.dump(value, f, ensure_ascii=False)
+        f.write('\n}\n')
+    return written
+
+
+class BackupReader:
+    """Потоковое чтение резервной копии {"surveys": [...], "responses": [...], ...}
+
+    Файл читается блоками, элементы массивов stream_keys выдаются по
+    одному как (ключ, запись), остальные ключи верхнего уровня - как
+    (ключ, значение). В памяти держится только текущий блок и запись.
+    """
+
+    CHUNK_SIZE = 1 << 20
+    # Запись больше этого размера считаем признаком испорченного файла
+    MAX_RECORD_SIZE = 64 << 20
+
+    def __init__(self, f: BinaryIO, stream_keys: Iterable[str] = ('surveys', 'responses')):
+        self.f = f
+        self.stream_keys = set(stream_keys)
+        self.keys = set()
+        self.bytes_read = 0
+        self._json_decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """Дочитываем следующий блок; False - файл закончился"""
+        if self._eof:
+            return False
+        chunk = self.f.read(self.CHUNK_SIZE)
+        self.bytes_read += len(chunk)
+        # Разобранную часть буфера отбрасываем
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        if not chunk:
+            self._eof = True
+            self._buffer += self._text_decoder.decode(b'', final=True)
+            return False
+        self._buffer += self._text_decoder.decode(chunk)
+        return True
+
+    def _peek(self) -> str:
+        """Первый непробельный символ (без сдвига позиции); '' - конец файла"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char: str):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Неверный формат файла: ожидался '{char}', найден '{found or 'конец файла'}'")
+        self._pos += 1
+
+    def _value(self) -> Any:
+        """Разбираем одно JSON-значение, дочитывая файл при необходимости"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if len(self._buffer) - self._pos < self.MAX_RECORD_SIZE and self._fill():
+                    continue
+                raise
+            # Значение, упершееся в конец буфера (например, число), могло оборваться
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+
+        while True:
+            key = self._value()
+            if not isinstance(key, str):
+                raise ValueError("Неверный формат файла: ожидался ключ")
+            self._expect(':')
+            self.keys.add(key)
+
+            if key in self.stream_keys:
+                self._expect('[')
+                if self._peek() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield key, self._value()
+                        separator = self._peek()
+                        self._pos += 1
+                        if separator == ']':
+                            break
+                        if separator != ',':
+                            raise ValueError(f"Неверный формат файла в массиве '{key}'")
+            else:
+                yield key, self._value()
+
+            separator = self._peek()
+            self._pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError("Неверный формат файла")
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Фильтрация ответов - условия на ответы и время заполнения по индексу битовых карт
+
+Фильтр - словарь одного из видов:
+    {'targetId': id вопроса, 'operator': ..., 'value': ...} - условие на ответ,
+        операторы и их смысл - как у условий показа (survey_conditions)
+    {'completedAt': {'from': ISO-время, 'to': ISO-время}} - заполнен в [from, to),
+        любая граница может отсутствовать
+    {'all': [фильтры]} - все условия (И), {'any': [фильтры]} - любое (ИЛИ)
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from survey_analysis import answer_codes, condition_table
+from survey_columnar import NUMBER_MISSING, ColumnarResponses, numpy, open_columnar
+from survey_conditions import compile_condition
+from survey_responses import EPOCH, MICROSECOND, NO_TIMESTAMP
+
+# Больше различных значений у вопроса - карты на каждое не строим, условие
+# проверяется по таблице значений (как в ConditionEvaluator)
+MAX_BITMAP_VALUES = 256
+
+NUMERIC_OPERATORS = ('greater_than', 'greater_or_equal', 'less_than', 'less_or_equal')
+
+
+def _moment(value) -> Optional[datetime]:
+    """ISO-время как datetime без часового пояса (время с поясом - в UTC)"""
+    if isinstance(value, datetime):
+        moment = value
+    elif isinstance(value, str):
+        try:
+            moment = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    else:
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def _time_bounds(period: Dict) -> Tuple[Optional[datetime], Optional[datetime]]:
+    bounds = []
+    for key in ('from', 'to'):
+        value = period.get(key)
+        moment = _moment(value)
+        if value is not None and moment is None:
+            raise ValueError(f"Неверное время в фильтре: {value}")
+        bounds.append(moment)
+    return bounds[0], bounds[1]
+
+
+def _answers(response: Dict) -> Dict:
+    answers = response.get('answers')
+    return answers if isinstance(answers, dict) else {}
+
+
+def compile_filter(spec: Dict) -> Callable[[Dict], bool]:
+    """Превращаем фильтр в функцию от ответа-словаря (проверка по одному ответу)"""
+    if 'all' in spec:
+        checks = [compile_filter(item) for item in spec['all']]
+        return lambda response: all(check(response) for check in checks)
+    if 'any' in spec:
+        checks = [compile_filter(item) for item in spec['any']]
+        return lambda response: any(check(response) for check in checks)
+    if 'completedAt' in spec:
+        start, end = _time_bounds(spec['completedAt'])
+
+        def check_time(response):
+            moment = _moment(response.get('completedAt'))
+            return moment is not None and (start is None or moment >= start) and (end is None or moment < end)
+        return check_time
+    if 'targetId' in spec:
+        check = compile_condition(spec)
+        return lambda response: check(_answers(response))
+    raise ValueError(f"Неизвестный фильтр: {spec}")
+
+
+class RowSet:
+    """Множество порядковых номеров ответов в сжатом виде
+
+    Редкое множество хранится возрастающим массивом номеров uint32,
+    плотное - битовой картой (бит на ответ, numpy.packbits); из двух
+    выбирается меньшее, так что карта варианта занимает не больше
+    rows / 8 байт.
+    """
+
+    __slots__ = ('rows', 'count', 'sparse', 'data')
+
+    def __init__(self, ordinals, rows: int):
+        self.rows = rows
+        self.count = len(ordinals)
+        self.sparse = self.count * 4 < (rows + 7) // 8
+        if self.sparse:
+            self.data = ordinals.astype(numpy.uint32)
+        else:
+            mask = numpy.zeros(rows, dtype=bool)
+            mask[ordinals] = True
+            self.data = numpy.packbits(mask)
+
+    def add_to(self, mask):
+        """Отмечаем номера множества в булевом массиве"""
+        if self.sparse:
+            mask[self.data] = True
+        else:
+            mask |= numpy.unpackbits(self.data, count=self.rows).view(bool)
+
+
+class SortedColumn:
+    """Значения, отсортированные вместе с номерами ответов: диапазон - два бинарных поиска"""
+
+    __slots__ = ('values', 'ordinals')
+
+    def __init__(self, values, ordinals):
+        order = numpy.argsort(values, kind='stable')
+        self.values = values[order]
+        self.ordinals = ordinals[order]
+
+    def mask(self, rows: int, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        """Ответы со значением между low и high (граница None - без ограничения)"""
+        start = 0 if low is None else numpy.searchsorted(self.values, low, 'left' if low_inclusive else 'right')
+        stop = len(self.values) if high is None else \
+            numpy.searchsorted(self.values, high, 'right' if high_inclusive else 'left')
+        mask = numpy.zeros(rows, dtype=bool)
+        mask[self.ordinals[start:stop]] = True
+        return mask
+
+
+class FilterIndex:
+    """Индекс ответов анкеты для фильтров, построенный по колоночному файлу
+
+    Радио-вопросы: битовая карта (RowSet) на каждое значение, условие
+    вычисляется по таблице значений и объединяет карты подходящих.
+    Чекбоксы: карта на каждый вариант для оператора 'содержит'. Числа и
+    время заполнения: отсортированные массивы, сравнения - бинарным
+    поиском. Остальное (текст, прочие операторы) - коды значений, как в
+    ConditionEvaluator. Ответы из блока исключений проверяются по одному.
+
+    Все структуры строятся при первом обращении к вопросу и хранятся в
+    памяти как собственные массивы, поэтому колоночный файл можно
+    закрыть - при следующем фильтре он передается снова.
+    """
+
+    def __init__(self, columnar: ColumnarResponses):
+        self.survey_id = columnar.survey_id
+        self.source = (columnar.header.get('sourceVersion'), columnar.header.get('questionsHash'))
+        self.rows = len(columnar)
+        self._value_sets: Dict[str, List[RowSet]] = {}
+        self._option_sets: Dict[str, Dict[str, RowSet]] = {}
+        self._numbers: Dict[str, SortedColumn] = {}
+        self._codes: Dict[str, Tuple[Any, List]] = {}
+        self._times: Optional[SortedColumn] = None
+        # Ответы и времена, не уложенные в столбцы: id вопроса -> [(номер, значение)]
+        self._extra_answers: Dict[str, List[Tuple[int, Any]]] = {}
+        self._extra_times: List[Tuple[int, Any]] = []
+        for row, extra in columnar.extras.items():
+            for question_id, value in extra.get('answers', {}).items():
+                self._extra_answers.setdefault(question_id, []).append((row, value))
+            if 'completedAt' in extra.get('fields', {}):
+                self._extra_times.append((row, extra['fields']['completedAt']))
+
+    def matches(self, columnar: ColumnarResponses, spec: Dict):
+        """Булев массив: подходит ли каждый ответ под фильтр"""
+        if 'all' in spec:
+            mask = numpy.ones(self.rows, dtype=bool)
+            for item in spec['all']:
+                mask &= self.matches(columnar, item)
+            return mask
+        if 'any' in spec:
+            mask = numpy.zeros(self.rows, dtype=bool)
+            for item in spec['any']:
+                mask |= self.matches(columnar, item)
+            return mask
+        if 'completedAt' in spec:
+            return self._time_mask(columnar, spec['completedAt'])
+        if 'targetId' in spec:
+            mask = self._answer_mask(columnar, spec)
+            # Ответы вне столбца (другой тип, порядок вариантов) - как при прохождении
+            extras = self._extra_answers.get(spec['targetId'])
+            if extras:
+                check = compile_condition(spec)
+                for row, value in extras:
+                    mask[row] = check({spec['targetId']: value})
+            return mask
+        raise ValueError(f"Неизвестный фильтр: {spec}")
+
+    def ordinals(self, columnar: ColumnarResponses, spec: Dict) -> List[int]:
+        """Порядковые номера подходящих ответов по возрастанию"""
+        return numpy.flatnonzero(self.matches(columnar, spec)).tolist()
+
+    def _time_mask(self, columnar: ColumnarResponses, period: Dict):
+        start, end = _time_bounds(period)
+        if self._times is None:
+            timestamps = columnar.completed_at()
+            known = numpy.flatnonzero(timestamps != NO_TIMESTAMP)
+            self._times = SortedColumn(timestamps[known], known)
+        mask = self._times.mask(self.rows,
+                                None if start is None else (start - EPOCH) // MICROSECOND,
+                                None if end is None else (end - EPOCH) // MICROSECOND,
+                                high_inclusive=False)
+        for row, value in self._extra_times:
+            moment = _moment(value)
+            mask[row] = moment is not None and (start is None or moment >= start) and (end is None or moment < end)
+        return mask
+
+    def _answer_mask(self, columnar: ColumnarResponses, condition: Dict):
+        question_id = condition['targetId']
+        meta = columnar.columns.get(question_id)
+        kind = meta['kind'] if meta else None
+        operator = condition['operator']
+
+        if kind == 'codes' and len(meta['values']) <= MAX_BITMAP_VALUES:
+            value_sets = self._value_sets.get(question_id)
+            if value_sets is None:
+                value_sets = self._value_sets[question_id] = self._group_rows(columnar.section(meta['codes']),
+                                                                              len(meta['values']))
+            mask = numpy.zeros(self.rows, dtype=bool)
+            for code in numpy.flatnonzero(condition_table(condition, meta['values'])[:-1]).tolist():
+                value_sets[code].add_to(mask)
+            return mask
+
+        if kind == 'checkbox' and operator == 'contains':
+            option_sets = self._option_sets.get(question_id)
+            if option_sets is None:
+                option_sets = self._option_sets[question_id] = self._checkbox_sets(columnar, meta)
+            mask = numpy.zeros(self.rows, dtype=bool)
+            # 'содержит' для списка - значение условия среди отмеченных вариантов
+            if isinstance(condition['value'], str) and condition['value'] in option_sets:
+                option_sets[condition['value']].add_to(mask)
+            return mask
+
+        if kind == 'number' and (operator in NUMERIC_OPERATORS or
+                                 operator in ('equals', 'not_equals') and _is_plain_number(condition['value'])):
+            return self._number_mask(columnar, meta, question_id, operator, condition['value'])
+
+        codes, values = self._codes_of(columnar, question_id)
+        return condition_table(condition, values)[codes]
+
+    def _group_rows(self, codes, count: int) -> List[RowSet]:
+        """Карта номеров ответов для каждого кода 0..count-1"""
+        order = numpy.argsort(codes, kind='stable')
+        bounds = numpy.searchsorted(codes[order], numpy.arange(count + 1))
+        return [RowSet(order[bounds[code]:bounds[code + 1]], self.rows) for code in range(count)]
+
+    def _checkbox_sets(self, columnar: ColumnarResponses, meta: Dict) -> Dict[str, RowSet]:
+        present = columnar.section(meta['present']).astype(bool)
+        masks = columnar.section(meta['mask'])
+        option_sets = {}
+        for i, option in enumerate(meta['options']):
+            if option not in option_sets:
+                selected = present & ((masks >> numpy.uint64(i)) & numpy.uint64(1)).astype(bool)
+                option_sets[option] = RowSet(numpy.flatnonzero(selected), self.rows)
+        return option_sets
+
+    def _number_mask(self, columnar: ColumnarResponses, meta: Dict, question_id: str, operator: str, value):
+        column = self._numbers.get(question_id)
+        if column is None:
+            present = numpy.flatnonzero(columnar.section(meta['present']) != NUMBER_MISSING)
+            column = self._numbers[question_id] = SortedColumn(columnar.section(meta['values'])[present], present)
+        try:
+            number = float(value)
+        except (ValueError, TypeError):
+            number = None
+        if number is None or number != number:
+            # Как _numeric: значение условия не число - условие не выполняется
+            mask = numpy.zeros(self.rows, dtype=bool)
+        elif operator == 'greater_than':
+            mask = column.mask(self.rows, low=number, low_inclusive=False)
+        elif operator == 'greater_or_equal':
+            mask = column.mask(self.rows, low=number)
+        elif operator == 'less_than':
+            mask = column.mask(self.rows, high=number, high_inclusive=False)
+        elif operator == 'less_or_equal':
+            mask = column.mask(self.rows, high=number)
+        else:
+            mask = column.mask(self.rows, low=number, high=number)
+        if operator == 'not_equals':
+            # Отвечавшие на вопрос, но не этим числом
+            mask = ~mask
+            mask[columnar.section(meta['present']) == NUMBER_MISSING] = False
+        return mask
+
+    def _codes_of(self, columnar: ColumnarResponses, question_id: str) -> Tuple[Any, List]:
+        encoded = self._codes.get(question_id)
+        if encoded is None:
+            encoded = self._codes[question_id] = answer_codes(columnar, question_id)
+        return encoded
+
+
+def _is_plain_number(value) -> bool:
+    """Число, равенство с которым совпадает со сравнением float (1 == 1.0, но не строка "1")"""
+    return isinstance(value, (int, float))
+
+
+class ResponseFilter:
+    """Фильтрация ответов анкет с индексом в памяти
+
+    Индекс держится только для последней отфильтрованной анкеты и
+    строится заново, когда ее ответы или вопросы изменились (колоночный
+    кэш в cache_dir пересобирается по тем же признакам). Без NumPy
+    фильтр проверяется по каждому ответу.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._index: Optional[FilterIndex] = None
+
+    def ordinals(self, storage, survey: Dict, spec: Dict) -> List[int]:
+        """Порядковые номера подходящих ответов (как в storage.responses_page)"""
+        if numpy is None:
+            check = compile_filter(spec)
+            return [ordinal for ordinal, response in enumerate(storage.iter_responses(survey['id']))
+                    if check(response)]
+        with open_columnar(storage, survey, self.cache_dir) as columnar:
+            index = self._index
+            if index is None or index.survey_id != survey['id'] or \
+                    index.source != (columnar.header.get('sourceVersion'), columnar.header.get('questionsHash')):
+                index = self._index = FilterIndex(columnar)
+            return index.ordinals(columnar, spec)
+
+    def reset(self):
+        """Отбрасываем индекс (после импорта)"""
+        self._index = None
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Чтение шардов ответов через mmap - индекс смещений записей вместо разбора всего файла
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import List, Optional, Set
+
+# Файл индекса смещений лежит рядом со снимком шарда: <снимок>.idx
+INDEX_SUFFIX = ".idx"
+
+INDEX_MAGIC = b"SURVIDX1"
+# Заголовок индекса: сигнатура, размер и время изменения снимка, число записей;
+# дальше int64 (little-endian) смещения начала каждой записи и строки с ']'
+INDEX_HEADER = struct.Struct("<8sQqQ")
+OFFSET_SIZE = 8
+
+# Хвост снимка после последней записи - только "]" и перевод строки
+MAX_TAIL_SIZE = 64
+
+
+def build_offsets(buffer) -> array:
+    """Смещения записей снимка, найденные по переводам строк без разбора JSON
+
+    Снимок пишется по записи на строку ("[", записи через ",", "]"), как
+    это делают write_records_atomic и импорт. Файл другого вида - ValueError.
+    """
+    size = len(buffer)
+    newline = buffer.find(b"\n")
+    position = size if newline == -1 else newline + 1
+    opening = buffer[:position].strip()
+    if opening == b"[]" and position == size:
+        return array('q', [position])
+    if opening != b"[":
+        raise ValueError("снимок записан не по записи на строку")
+
+    offsets = array('q')
+    while buffer[position:position + 1] == b"{":
+        offsets.append(position)
+        newline = buffer.find(b"\n", position)
+        if newline == -1:
+            raise ValueError("снимок оборван")
+        position = newline + 1
+    if size - position > MAX_TAIL_SIZE or buffer[position:].strip() != b"]":
+        raise ValueError("снимок записан не по записи на строку")
+    offsets.append(position)
+    return offsets
+
+
+def write_index(index_file: str, offsets: array, snapshot_size: int, snapshot_mtime_ns: int):
+    """Записываем индекс смещений снимка (временный файл, fsync, переименование)"""
+    data = array('q', offsets)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    temp_file = index_file + ".tmp"
+    with open(temp_file, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, snapshot_size, snapshot_mtime_ns, len(offsets) - 1))
+        f.write(data.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, index_file)
+
+
+class MappedResponses(Sequence):
+    """Ответы шарда, читаемые с диска по требованию
+
+    Снимок шарда и его индекс (номер записи -> смещение) отображаются
+    через mmap, поэтому k-й ответ или страница ответов читает только свои
+    байты, а память не растет с историей. Индекс строится один раз и
+    пересобирается, если снимок изменился. Записи журнала (их немного -
+    журнал регулярно сворачивается) держатся строками в памяти и
+    дочитываются refresh(). Элементы - обычные словари-ответы.
+
+    Пока файл отображен, Windows не даст его заменить или удалить,
+    поэтому перед перезаписью снимка объект нужно закрыть (close).
+    """
+
+    def __init__(self, snapshot_file: str, journal_file: str):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.index_file = snapshot_file + INDEX_SUFFIX
+        self.buffer = None
+        self.index = None
+        self.snapshot_rows = 0
+        self.snapshot_stat = None
+        self.journal: List[bytes] = []
+        self._journal_position = 0
+        self._tail_ids: Optional[Set] = None
+        try:
+            self._open_snapshot()
+            self.refresh()
+        except Exception:
+            self.close()
+            raise
+
+    def _open_snapshot(self):
+        try:
+            f = open(self.snapshot_file, 'rb')
+        except FileNotFoundError:
+            return  # ответы пока только в журнале
+        with f:
+            stat = os.fstat(f.fileno())
+            self.snapshot_stat = (stat.st_size, stat.st_mtime_ns)
+            if stat.st_size == 0:
+                raise ValueError("пустой файл снимка")
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if not self._open_index():
+            write_index(self.index_file, build_offsets(self.buffer), *self.snapshot_stat)
+            if not self._open_index():
+                raise ValueError("не удалось открыть индекс снимка")
+
+    def _open_index(self) -> bool:
+        """Отображаем индекс, если он есть и построен по текущему снимку"""
+        try:
+            f = open(self.index_file, 'rb')
+        except FileNotFoundError:
+            return False
+        with f:
+            header = f.read(INDEX_HEADER.size)
+            if len(header) < INDEX_HEADER.size:
+                return False
+            magic, size, mtime_ns, rows = INDEX_HEADER.unpack(header)
+            if magic != INDEX_MAGIC or (size, mtime_ns) != self.snapshot_stat or \
+                    os.fstat(f.fileno()).st_size != INDEX_HEADER.size + (rows + 1) * OFFSET_SIZE:
+                return False
+            self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.snapshot_rows = rows
+        return True
+
+    def is_current(self) -> bool:
+        """Не заменен ли снимок после открытия (журнал дочитывает refresh)"""
+        try:
+            stat = os.stat(self.snapshot_file)
+        except FileNotFoundError:
+            return self.snapshot_stat is None
+        return (stat.st_size, stat.st_mtime_ns) == self.snapshot_stat
+
+    def refresh(self):
+        """Дочитываем строки, дописанные в журнал после открытия"""
+        try:
+            with open(self.journal_file, 'rb') as f:
+                if f.seek(0, os.SEEK_END) < self._journal_position:
+                    self.journal = []
+                    self._journal_position = 0
+                f.seek(self._journal_position)
+                data = f.read()
+        except FileNotFoundError:
+            self.journal = []
+            self._journal_position = 0
+            return
+
+        # Строку без перевода строки (оборванную или недописанную) оставляем до следующего раза
+        end = data.rfind(b"\n") + 1
+        self._journal_position += end
+        lines = [line for line in data[:end].splitlines() if line.strip()]
+        if lines and self._tail_ids is None:
+            # Сбой между записью снимка и очисткой журнала оставляет записи
+            # журнала в конце снимка - их отбрасываем по id, как load()
+            start = max(0, self.snapshot_rows - len(lines))
+            self._tail_ids = {json.loads(self.raw(row)).get('id') for row in range(start, self.snapshot_rows)}
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print("Пропущена поврежденная запись журнала ответов")
+                continue
+            if record.get('id') not in self._tail_ids:
+                self.journal.append(line.strip())
+
+    def __len__(self):
+        return self.snapshot_rows + len(self.journal)
+
+    def raw(self, row: int) -> bytes:
+        """JSON-текст записи (без разделителя)"""
+        if row < self.snapshot_rows:
+            start, end = struct.unpack_from("<2q", self.index, INDEX_HEADER.size + row * OFFSET_SIZE)
+            return self.buffer[start:end].rstrip(b" \t\r\n,")
+        return self.journal[row - self.snapshot_rows]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [json.loads(self.raw(i)) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("индекс ответа вне диапазона")
+        return json.loads(self.raw(index))
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield json.loads(self.raw(row))
+
+    def write_snapshot(self, filename: str) -> array:
+        """Пишем все записи одним снимком и сбрасываем на диск; возвращаем смещения для индекса
+
+        Записи копируются байтами, без разбора и повторной сериализации.
+        """
+        offsets = array('q')
+        with open(filename, 'wb') as f:
+            f.write(b"[\n")
+            position = 2
+            for row in range(len(self)):
+                if row:
+                    f.write(b",\n")
+                    position += 2
+                offsets.append(position)
+                record = self.raw(row)
+                f.write(record)
+                position += len(record)
+            if offsets:
+                f.write(b"\n")
+                position += 1
+            offsets.append(position)
+            f.write(b"]\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return offsets
+
+    def close(self):
+        for mapping in (self.buffer, self.index):
+            if mapping is not None:
+                mapping.close()
+        self.buffer = None
+        self.index = None
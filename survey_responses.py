@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Компактное хранение ответов в памяти - столбцы кодов вместо словаря на каждый ответ
+"""
+
+import json
+from array import array
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+# Код отсутствующего ответа в столбце вопроса
+MISSING = -1
+
+# Метка времени, которую нельзя точно восстановить из числа (хранится строкой)
+NO_TIMESTAMP = -(1 << 63)
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# Поля ответа, разложенные по столбцам; остальные хранятся как есть
+RESPONSE_FIELDS = ('id', 'surveyId', 'answers', 'completedAt')
+
+
+def value_key(value) -> Any:
+    """Ключ значения ответа в словаре кодов (тип различает 1, 1.0 и True)"""
+    key = (type(value), tuple(value) if isinstance(value, list) else value)
+    try:
+        hash(key)
+    except TypeError:
+        key = (type(value), json.dumps(value, ensure_ascii=False, sort_keys=True))
+    return key
+
+
+def encode_timestamp(completed_at) -> int:
+    """ISO-время в микросекунды от эпохи; NO_TIMESTAMP, если без потерь не получится"""
+    if not isinstance(completed_at, str):
+        return NO_TIMESTAMP
+    try:
+        moment = datetime.fromisoformat(completed_at)
+    except ValueError:
+        return NO_TIMESTAMP
+    if moment.tzinfo is not None or moment.isoformat() != completed_at:
+        return NO_TIMESTAMP
+    return (moment - EPOCH) // MICROSECOND
+
+
+def decode_timestamp(value: int) -> str:
+    return (EPOCH + value * MICROSECOND).isoformat()
+
+
+class AnswerColumn:
+    """Ответы на один вопрос: код на каждый ответ и таблица различных значений
+
+    Варианты ответов и повторяющиеся значения хранятся один раз, в
+    столбце - только их номера (4 байта на ответ).
+    """
+
+    __slots__ = ('codes', 'values', '_index')
+
+    def __init__(self, size: int = 0):
+        self.codes = array('i', [MISSING]) * size
+        self.values: List[Any] = []
+        self._index: Dict[Any, int] = {}
+
+    def encode(self, value) -> int:
+        key = value_key(value)
+        code = self._index.get(key)
+        if code is None:
+            code = self._index[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def value(self, row: int):
+        code = self.codes[row]
+        if code == MISSING:
+            return None
+        value = self.values[code]
+        # Общий список варианта не отдаем наружу - его могут изменить
+        return list(value) if isinstance(value, list) else value
+
+
+class CompactResponses(Sequence):
+    """Ответы одной анкеты в столбцах
+
+    Id анкеты хранится один раз, время завершения - числом, ответ на
+    каждый вопрос - кодом в столбце вопроса (AnswerColumn). Снаружи это
+    последовательность обычных словарей-ответов: элемент собирается при
+    обращении, поэтому код, работающий со списком ответов, не меняется.
+    Изменение полученного словаря на хранимые данные не влияет.
+    """
+
+    def __init__(self, survey_id: Optional[str], responses: Iterable[Dict] = ()):
+        self.survey_id = survey_id
+        self.ids: List[str] = []
+        self.timestamps = array('q')
+        self.columns: Dict[str, AnswerColumn] = {}
+        # Редкие случаи храним как есть: нестандартное время, лишние и отсутствующие поля
+        self.raw_completed: Dict[int, Any] = {}
+        self.extra: Dict[int, Dict] = {}
+        self.missing: Dict[int, List[str]] = {}
+        for response in responses:
+            self.append(response)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(i) for i in range(*index.indices(len(self.ids)))]
+        if index < 0:
+            index += len(self.ids)
+        if not 0 <= index < len(self.ids):
+            raise IndexError("индекс ответа вне диапазона")
+        return self.row(index)
+
+    def __iter__(self):
+        for i in range(len(self.ids)):
+            yield self.row(i)
+
+    def append(self, response: Dict):
+        row = len(self.ids)
+        self.ids.append(response.get('id'))
+
+        completed_at = response.get('completedAt')
+        timestamp = encode_timestamp(completed_at)
+        self.timestamps.append(timestamp)
+        if timestamp == NO_TIMESTAMP and 'completedAt' in response:
+            self.raw_completed[row] = completed_at
+
+        answers = response.get('answers', {})
+        extra = {k: v for k, v in response.items() if k not in RESPONSE_FIELDS}
+        if response.get('surveyId') != self.survey_id:
+            extra['surveyId'] = response.get('surveyId')
+        if not isinstance(answers, dict):
+            extra['answers'] = answers
+            answers = {}
+        if extra:
+            self.extra[row] = extra
+        missing = [k for k in RESPONSE_FIELDS if k not in response]
+        if missing:
+            self.missing[row] = missing
+
+        for question_id, column in self.columns.items():
+            column.codes.append(column.encode(answers[question_id]) if question_id in answers else MISSING)
+        for question_id, value in answers.items():
+            if question_id not in self.columns:
+                column = self.columns[question_id] = AnswerColumn(row)
+                column.codes.append(column.encode(value))
+
+    def answers(self, row: int) -> Dict:
+        """Ответы респондента в виде словаря id вопроса -> ответ"""
+        answers = {}
+        for question_id, column in self.columns.items():
+            code = column.codes[row]
+            if code != MISSING:
+                answers[question_id] = column.value(row)
+        return answers
+
+    def row(self, row: int) -> Dict:
+        """Ответ в исходном виде (словарь)"""
+        timestamp = self.timestamps[row]
+        response = {
+            'id': self.ids[row],
+            'surveyId': self.survey_id,
+            'answers': self.answers(row),
+            'completedAt': self.raw_completed.get(row) if timestamp == NO_TIMESTAMP else decode_timestamp(timestamp),
+        }
+        if row in self.extra:
+            response.update(self.extra[row])
+        for field in self.missing.get(row, ()):
+            response.pop(field, None)
+        return response
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Полнотекстовый поиск по текстовым ответам - инвертированный индекс по каждой анкете
+"""
+
+import json
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+from functools import lru_cache
+from typing import Dict, List, Optional, Set
+
+from survey_columnar import questions_hash
+from survey_storage import JOURNAL_COMPACT_THRESHOLD, replace_file, shard_name
+
+# Каталог индексов (снимок .idx и журнал .jsonl на анкету) в директории данных
+SEARCH_DIRNAME = "search"
+
+INDEX_MAGIC = b"SURVTXT1"
+# Начало снимка: сигнатура, число учтенных ответов, длина JSON-заголовка;
+# дальше заголовок (слово -> смещение и длина списка) и номера ответов int32
+PREFIX = struct.Struct("<8sQQ")
+
+WORD_RE = re.compile(r"\w+")
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+# Окончания для простого стемминга русских слов (сначала длинные)
+RUSSIAN_ENDINGS = sorted((
+    "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ешь", "ете", "ите", "ость",
+    "ах", "ях", "ов", "ев", "ей", "ой", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие", "ую", "юю",
+    "ом", "ем", "ам", "ям", "их", "ых", "ть", "ет", "ит", "ут", "ют", "ат", "ят", "ла", "ло", "ли",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+), key=len, reverse=True)
+# Основа не короче этого - иначе слово оставляем как есть
+MIN_STEM = 3
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр с учетом кириллицы; ё и е не различаем"""
+    return text.casefold().replace("ё", "е")
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Основа слова: отбрасываем типичное окончание (русское или английское -s)"""
+    if CYRILLIC_RE.search(word):
+        for ending in RUSSIAN_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+                return word[:-len(ending)]
+    elif len(word) > MIN_STEM and word.endswith("s") and not word.endswith("ss") and word.isalpha():
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Основы слов текста по порядку"""
+    return [stem(word) for word in WORD_RE.findall(normalize(text))]
+
+
+class TextIndex:
+    """Инвертированный индекс текстовых ответов одной анкеты
+
+    Для каждого текстового вопроса - основа слова -> возрастающий
+    массив порядковых номеров ответов (как в storage.responses_page),
+    поэтому найденные ответы читаются из хранилища по номерам.
+    """
+
+    def __init__(self, survey: Dict):
+        self.survey_id = survey['id']
+        self.layout = questions_hash(survey)
+        self.rows = 0
+        self.postings: Dict[str, Dict[str, array]] = {}
+        for question in survey['questions']:
+            if question.get('type') == 'text':
+                self.postings.setdefault(question['id'], {})
+
+    def response_terms(self, answers: Dict) -> Dict[str, List[str]]:
+        """Различные основы слов в текстовых ответах респондента"""
+        terms = {}
+        for question_id in self.postings:
+            answer = answers.get(question_id)
+            if isinstance(answer, str):
+                words = list(dict.fromkeys(tokenize(answer)))
+                if words:
+                    terms[question_id] = words
+        return terms
+
+    def add_terms(self, terms: Dict[str, List[str]]):
+        """Добавляем следующий ответ по его основам слов"""
+        row = self.rows
+        for question_id, words in terms.items():
+            postings = self.postings.get(question_id)
+            if postings is None:
+                continue
+            for word in words:
+                rows = postings.get(word)
+                if rows is None:
+                    rows = postings[word] = array('i')
+                rows.append(row)
+        self.rows += 1
+
+    def add(self, answers: Dict):
+        self.add_terms(self.response_terms(answers))
+
+    @staticmethod
+    def _matches(postings: Dict[str, array], word: str, prefix: bool, within: Optional[Set[int]]) -> Set[int]:
+        """Ответы со словом (или словом, начинающимся с word); within - уже отобранные"""
+        lists = [postings.get(word, ())] if not prefix else \
+            [rows for key, rows in postings.items() if key.startswith(word)]
+        found = set()
+        for rows in lists:
+            # Пересекаем с отобранными, не собирая множество из длинного списка
+            found.update(rows if within is None else within.intersection(rows))
+        return found
+
+    def search(self, query: str, question_id: Optional[str] = None) -> List[int]:
+        """Номера ответов, где в одном вопросе встречаются все слова запроса
+
+        Последнее слово ищется как начало слова, пока запрос набирается
+        (нет пробела в конце). Без question_id - по всем текстовым вопросам.
+        """
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return []
+        prefix_word = words[-1] if not query[-1:].isspace() else None
+        found: Set[int] = set()
+        question_ids = [question_id] if question_id is not None else list(self.postings)
+        for qid in question_ids:
+            postings = self.postings.get(qid)
+            if not postings:
+                continue
+            matched = None
+            # Сначала редкие слова, начало слова - последним: пересечение быстро сужается
+            for word in sorted(words, key=lambda w: (w == prefix_word, len(postings.get(w, ())))):
+                matched = self._matches(postings, word, word == prefix_word, matched)
+                if not matched:
+                    break
+            found |= matched or set()
+        return sorted(found)
+
+    def write(self, filename: str):
+        """Записываем снимок индекса (временный файл, fsync, переименование)"""
+        blob = array('i')
+        questions = {}
+        for question_id, postings in self.postings.items():
+            terms = questions[question_id] = {}
+            for word, rows in postings.items():
+                terms[word] = [len(blob), len(rows)]
+                blob.extend(rows)
+        header = json.dumps({'surveyId': self.survey_id, 'layout': self.layout, 'questions': questions},
+                            ensure_ascii=False).encode('utf-8')
+        if sys.byteorder != 'little':
+            blob.byteswap()
+
+        temp_file = filename + ".tmp"
+        with open(temp_file, 'wb') as f:
+            f.write(PREFIX.pack(INDEX_MAGIC, self.rows, len(header)))
+            f.write(header)
+            f.write(blob.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        replace_file(temp_file, filename)
+
+    @classmethod
+    def read(cls, filename: str) -> "TextIndex":
+        with open(filename, 'rb') as f:
+            magic, rows, header_size = PREFIX.unpack(f.read(PREFIX.size))
+            if magic != INDEX_MAGIC:
+                raise ValueError(f"Неверный формат файла {os.path.basename(filename)}")
+            header = json.loads(f.read(header_size))
+            blob = array('i')
+            blob.frombytes(f.read())
+        if sys.byteorder != 'little':
+            blob.byteswap()
+
+        index = cls({'id': header['surveyId'], 'questions': []})
+        index.layout = header['layout']
+        index.rows = rows
+        for question_id, terms in header['questions'].items():
+            index.postings[question_id] = {word: blob[offset:offset + count]
+                                           for word, (offset, count) in terms.items()}
+        return index
+
+
+def read_rows(filename: str) -> int:
+    """Число учтенных ответов из начала снимка (без чтения индекса)"""
+    with open(filename, 'rb') as f:
+        magic, rows, _ = PREFIX.unpack(f.read(PREFIX.size))
+    if magic != INDEX_MAGIC:
+        raise ValueError(f"Неверный формат файла {os.path.basename(filename)}")
+    return rows
+
+
+class TextIndexStore:
+    """Индексы поиска анкет: снимок search/<id>.idx и журнал search/<id>.jsonl
+
+    Новый ответ - одна строка журнала с основами его слов; журнал
+    сворачивается в снимок после JOURNAL_COMPACT_THRESHOLD строк. Индекс
+    хранит число учтенных ответов и отпечаток вопросов; если они не
+    совпадают с хранилищем (сбой, импорт, смена типа вопроса), индекс
+    строится заново за один проход по ответам анкеты.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._cache: Dict[str, TextIndex] = {}
+        # Индексы дополняет поток сохранения, а ищет GUI-поток
+        self._lock = threading.Lock()
+
+    def snapshot_path(self, survey_id: str) -> str:
+        return os.path.join(self.directory, shard_name(survey_id) + ".idx")
+
+    def journal_path(self, survey_id: str) -> str:
+        return os.path.join(self.directory, shard_name(survey_id) + ".jsonl")
+
+    def _read_journal(self, survey_id: str) -> List[Dict]:
+        records = []
+        if not os.path.exists(self.journal_path(survey_id)):
+            return records
+        with open(self.journal_path(survey_id), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass  # оборванная строка: число ответов не сойдется, и индекс пересоберется
+        return records
+
+    def _journal_lines(self, survey_id: str) -> int:
+        """Число полных строк журнала - без разбора JSON (оборванная строка не считается)"""
+        if not os.path.exists(self.journal_path(survey_id)):
+            return 0
+        with open(self.journal_path(survey_id), 'rb') as f:
+            return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 16), b""))
+
+    def _load(self, survey_id: str) -> Optional[TextIndex]:
+        """Снимок с дописанным журналом (журнал при необходимости сворачивается)"""
+        if not os.path.exists(self.snapshot_path(survey_id)):
+            return None
+        try:
+            index = TextIndex.read(self.snapshot_path(survey_id))
+            journal = self._read_journal(survey_id)
+        except Exception as e:
+            print(f"Ошибка загрузки индекса поиска: {e}")
+            return None
+        for record in journal:
+            if record.get('row') == index.rows:
+                index.add_terms(record['terms'])
+        if len(journal) >= JOURNAL_COMPACT_THRESHOLD:
+            self._save(index)
+        return index
+
+    def _save(self, index: TextIndex):
+        index.write(self.snapshot_path(index.survey_id))
+        if os.path.exists(self.journal_path(index.survey_id)):
+            os.remove(self.journal_path(index.survey_id))
+
+    def rebuild(self, storage, survey: Dict) -> TextIndex:
+        """Строим индекс анкеты заново по всем ее ответам"""
+        with self._lock:
+            return self._rebuild(storage, survey)
+
+    def _rebuild(self, storage, survey: Dict) -> TextIndex:
+        index = TextIndex(survey)
+        for response in storage.iter_responses(survey['id']):
+            answers = response.get('answers')
+            index.add(answers if isinstance(answers, dict) else {})
+        self._save(index)
+        self._cache[survey['id']] = index
+        return index
+
+    def get(self, storage, survey: Dict) -> TextIndex:
+        """Индекс анкеты; строится заново, только если устарел"""
+        with self._lock:
+            index = self._cache.get(survey['id'])
+            if index is None:
+                index = self._load(survey['id'])
+            if index is not None and index.layout == questions_hash(survey) and \
+                    index.rows == storage.count_responses(survey['id']):
+                self._cache[survey['id']] = index
+                return index
+        return self.rebuild(storage, survey)
+
+    def add(self, storage, survey: Dict, response: Dict):
+        """Дописываем в индекс новый ответ, уже записанный в хранилище
+
+        Если индекса анкеты еще нет (первый ответ, сброс после импорта)
+        или он отстал, он строится здесь же, в потоке сохранения, - один
+        раз. Загружать снимок ради новой строки не нужно: число учтенных
+        ответов берется из его начала и журнала.
+        """
+        survey_id = survey['id']
+        with self._lock:
+            index = self._cache.get(survey_id)
+            journal_lines = 0
+            try:
+                if index is not None:
+                    rows = index.rows
+                elif os.path.exists(self.snapshot_path(survey_id)):
+                    # Испорченная строка журнала здесь тоже считается - тогда
+                    # _load не сойдется по числу ответов, и индекс пересоберется
+                    journal_lines = self._journal_lines(survey_id)
+                    rows = read_rows(self.snapshot_path(survey_id)) + journal_lines
+                else:
+                    rows = None
+            except Exception as e:
+                print(f"Ошибка чтения индекса поиска: {e}")
+                rows = None
+            if rows != storage.count_responses(survey_id) - 1 or \
+                    (index is not None and index.layout != questions_hash(survey)):
+                # Индекса нет или он отстал - новый ответ уже в хранилище
+                self._rebuild(storage, survey)
+                return
+
+            terms = TextIndex(survey).response_terms(response.get('answers', {}))
+            # Индекс восстанавливается пересчетом, поэтому журнал пишется без fsync
+            with open(self.journal_path(survey_id), 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'row': rows, 'terms': terms}, ensure_ascii=False) + "\n")
+            if index is not None:
+                index.add_terms(terms)
+                if rows % JOURNAL_COMPACT_THRESHOLD == 0:
+                    self._save(index)
+            elif journal_lines + 1 >= JOURNAL_COMPACT_THRESHOLD:
+                self._load(survey_id)
+
+    def delete(self, survey_id: str):
+        """Удаляем индекс анкеты"""
+        with self._lock:
+            self._delete(survey_id)
+
+    def _delete(self, survey_id: str):
+        self._cache.pop(survey_id, None)
+        for path in (self.snapshot_path(survey_id), self.journal_path(survey_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def reset(self):
+        """Отбрасываем все индексы (после импорта) - они будут построены при поиске"""
+        with self._lock:
+            self._cache = {}
+            for filename in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, filename))
@@ -0,0 +1,1282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Хранилище данных анкет - JSON-файлы с журналом ответов или встроенная SQLite
+"""
+
+import itertools
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+from urllib.parse import quote, unquote
+
+from survey_mapped import INDEX_SUFFIX, MappedResponses, write_index
+from survey_responses import CompactResponses
+
+# После скольких записей в журнале сворачиваем его в снимок при загрузке ответов
+JOURNAL_COMPACT_THRESHOLD = 1000
+
+# Каталог шардов ответов (по файлу на анкету) в директории данных
+RESPONSES_DIRNAME = "responses"
+
+# Имя файла базы данных SQLite в директории данных
+SQLITE_FILENAME = "surveys.db"
+
+# Размер пачки при переносе ответов в SQLite
+MIGRATION_BATCH_SIZE = 5000
+
+# Суффикс последней хорошей копии файла (предыдущая версия перед перезаписью)
+BACKUP_SUFFIX = ".bak"
+
+
+def fsync_directory(path: str):
+    """Сбрасываем на диск запись каталога, чтобы переименование пережило сбой питания"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return  # Windows: каталоги так не открываются, переименование и так журналируется NTFS
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def replace_file(temp_file: str, target_file: str, keep_backup: bool = False):
+    """Атомарно подменяем файл готовым временным (уже сброшенным на диск)
+
+    С keep_backup прежняя версия сохраняется как target_file + ".bak".
+    Если сбой случится между двумя переименованиями, read_json_file
+    возьмет эту копию.
+    """
+    if keep_backup and os.path.exists(target_file):
+        os.replace(target_file, target_file + BACKUP_SUFFIX)
+    os.replace(temp_file, target_file)
+    fsync_directory(os.path.dirname(os.path.abspath(target_file)))
+
+
+def write_json_atomic(filename: str, data, keep_backup: bool = False, **dump_options):
+    """Пишем JSON во временный файл, сбрасываем на диск и переименовываем
+
+    Файл на диске всегда либо старый, либо новый целиком - обрыв записи
+    не оставляет его усеченным.
+    """
+    temp_file = filename + ".tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, **dump_options)
+        f.flush()
+        os.fsync(f.fileno())
+    replace_file(temp_file, filename, keep_backup)
+
+
+def write_records_atomic(filename: str, records: Iterable[Dict], keep_backup: bool = False):
+    """Пишем JSON-массив записей по одной (строка на запись) с атомарной подменой файла"""
+    temp_file = filename + ".tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        separator = "[\n"
+        for record in records:
+            f.write(separator)
+            f.write(json.dumps(record, ensure_ascii=False))
+            separator = ",\n"
+        f.write("[]\n" if separator == "[\n" else "\n]\n")
+        f.flush()
+        os.fsync(f.fileno())
+    replace_file(temp_file, filename, keep_backup)
+
+
+def read_json_file(filename: str, default=None):
+    """Читаем JSON-файл, при повреждении - последнюю хорошую копию (.bak)
+
+    Отсутствующий файл без копии - это первый запуск, возвращаем default.
+    Поврежденный файл без исправной копии - ошибка (а не пустые данные,
+    которые затем перезаписали бы файл).
+    """
+    backup_file = filename + BACKUP_SUFFIX
+    error = None
+    if os.path.exists(filename):
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ошибка загрузки {os.path.basename(filename)}: {e}")
+            error = e
+
+    if os.path.exists(backup_file):
+        with open(backup_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if error is not None:
+            # Поврежденный файл откладываем, чтобы следующая запись не вытеснила им хорошую копию
+            os.replace(filename, filename + ".corrupt")
+        print(f"Данные восстановлены из резервной копии {os.path.basename(backup_file)}")
+        return data
+
+    if error is not None:
+        raise error
+    return default
+
+
+class ResponseJournal:
+    """Ответы в виде снимка (responses.json) и журнала дозаписи (responses.jsonl)
+
+    Каждый новый ответ - одна строка JSON в журнале, записанная с fsync,
+    поэтому сохранение не зависит от количества уже собранных ответов.
+    Сворачивание (compact) переносит журнал в снимок и очищает журнал.
+    """
+
+    def __init__(self, snapshot_file: str, journal_file: str):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.pending_count = 0
+
+    def load(self) -> List[Dict]:
+        """Загружаем снимок и дописываем к нему записи журнала"""
+        responses = read_json_file(self.snapshot_file, [])
+
+        journal = self.read_journal()
+        self.pending_count = len(journal)
+        if journal:
+            # Если сбой случился между записью снимка и очисткой журнала,
+            # часть записей журнала уже есть в снимке
+            known_ids = {r.get('id') for r in responses}
+            responses.extend(r for r in journal if r.get('id') not in known_ids)
+        return responses
+
+    def read_journal(self) -> List[Dict]:
+        """Читаем записи журнала, пропуская оборванную последнюю строку"""
+        records = []
+        if not os.path.exists(self.journal_file):
+            return records
+        with open(self.journal_file, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"Пропущена поврежденная запись журнала ответов (строка {line_number})")
+        return records
+
+    @staticmethod
+    def _separate_torn_line(f):
+        """Оборванную при сбое строку отделяем, чтобы не испортить новую запись"""
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    def append(self, response: Dict):
+        """Дописываем один ответ в журнал и сбрасываем его на диск"""
+        line = (json.dumps(response, ensure_ascii=False) + "\n").encode('utf-8')
+        with open(self.journal_file, 'a+b') as f:
+            self._separate_torn_line(f)
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending_count += 1
+
+    def compact(self, responses: Iterable[Dict]):
+        """Сворачиваем журнал: пишем полный снимок и очищаем журнал"""
+        write_records_atomic(self.snapshot_file, responses, keep_backup=True)
+
+        # Журнал очищаем только после того, как снимок надежно записан
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self.pending_count = 0
+
+    def append_file(self, records_file: str, count: int):
+        """Дописываем в журнал готовые строки JSON из файла одной записью с fsync"""
+        with open(self.journal_file, 'a+b') as f:
+            self._separate_torn_line(f)
+            with open(records_file, 'rb') as source:
+                shutil.copyfileobj(source, f)
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending_count += count
+
+    def replace_snapshot(self, new_snapshot_file: str):
+        """Подменяем снимок готовым файлом и очищаем журнал"""
+        replace_file(new_snapshot_file, self.snapshot_file, keep_backup=True)
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self.pending_count = 0
+
+    def needs_compaction(self) -> bool:
+        """Пора ли сворачивать журнал"""
+        return self.pending_count >= JOURNAL_COMPACT_THRESHOLD
+
+
+class SessionJournal:
+    """Журнал прохождения анкеты: ответы респондента до завершения
+
+    Первая строка - заголовок сессии (id сессии и анкеты), дальше по
+    строке на каждый сохраненный ответ. Строки дописываются с fsync в
+    открытый файл, поэтому запись на каждый клик дешевая, а после сбоя
+    по журналу можно восстановить прохождение.
+    """
+
+    def __init__(self, journal_file: str):
+        self.journal_file = journal_file
+        self.session_id = None
+        self._file = None
+        # Сессию завершает и поток сохранения (после записи ответа)
+        self._lock = threading.Lock()
+
+    def _write(self, record: Dict):
+        self._file.write((json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8'))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def start(self, session_id: str, survey_id: str):
+        """Начинаем новую сессию, затирая журнал предыдущей"""
+        with self._lock:
+            self._close()
+            self._file = open(self.journal_file, 'wb')
+            self.session_id = session_id
+            self._write({'sessionId': session_id, 'surveyId': survey_id,
+                         'startedAt': datetime.now().isoformat()})
+
+    def resume(self, session_id: str):
+        """Продолжаем запись в журнал восстановленной сессии"""
+        with self._lock:
+            self._close()
+            self._file = open(self.journal_file, 'a+b')
+            ResponseJournal._separate_torn_line(self._file)
+            self.session_id = session_id
+
+    def record(self, question_id: str, answer):
+        """Записываем ответ на вопрос"""
+        with self._lock:
+            if self._file is not None:
+                self._write({'questionId': question_id, 'answer': answer})
+
+    def finish(self, session_id: str):
+        """Завершаем сессию и удаляем журнал (если она еще текущая)"""
+        with self._lock:
+            if self.session_id != session_id:
+                return
+            self._close()
+            self.session_id = None
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+
+    def discard(self):
+        """Удаляем журнал сессии, от продолжения которой отказались"""
+        with self._lock:
+            self._close()
+            self.session_id = None
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def load(self) -> Optional[Dict]:
+        """Незавершенная сессия из журнала: заголовок, ответы и последний вопрос"""
+        if not os.path.exists(self.journal_file):
+            return None
+        session = None
+        with open(self.journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # оборванная при сбое строка
+                if session is None:
+                    if 'sessionId' not in record:
+                        return None
+                    session = dict(record, answers={}, lastQuestionId=None)
+                else:
+                    session['answers'][record['questionId']] = record['answer']
+                    session['lastQuestionId'] = record['questionId']
+        return session
+
+
+def count_by_survey(responses) -> Dict[str, int]:
+    """Подсчитываем ответы по анкетам за один проход"""
+    counts = {}
+    for response in responses:
+        survey_id = response.get('surveyId')
+        counts[survey_id] = counts.get(survey_id, 0) + 1
+    return counts
+
+
+class SurveyStorage:
+    """Базовый интерфейс хранилища анкет и ответов"""
+
+    name = ""
+
+    def load_surveys(self) -> List[Dict]:
+        raise NotImplementedError
+
+    def save_surveys(self, surveys: List[Dict]):
+        raise NotImplementedError
+
+    def load_responses(self) -> List[Dict]:
+        raise NotImplementedError
+
+    def save_responses(self, responses: List[Dict]):
+        raise NotImplementedError
+
+    def append_response(self, response: Dict):
+        """Сохраняем один новый ответ"""
+        raise NotImplementedError
+
+    def iter_responses(self, survey_id: Optional[str] = None) -> Iterator[Dict]:
+        """Перебираем ответы (все или одной анкеты)"""
+        for response in self.load_responses():
+            if survey_id is None or response.get('surveyId') == survey_id:
+                yield response
+
+    def iter_responses_since(self, since: Optional[str]) -> Iterator[Dict]:
+        """Перебираем ответы, завершенные позже метки since (ISO-время; None - все)"""
+        for response in self.iter_responses():
+            if since is None or (response.get('completedAt') or '') > since:
+                yield response
+
+    def responses_page(self, survey_id: str, offset: int, limit: int) -> List[Dict]:
+        """Страница ответов анкеты: limit ответов начиная с порядкового номера offset"""
+        return list(itertools.islice(self.iter_responses(survey_id), offset, offset + limit))
+
+    def responses_at(self, survey_id: str, ordinals: List[int]) -> List[Dict]:
+        """Ответы анкеты с данными порядковыми номерами (в порядке ordinals)"""
+        wanted = set(ordinals)
+        found = {}
+        if wanted:
+            last = max(wanted)
+            for ordinal, response in enumerate(self.iter_responses(survey_id)):
+                if ordinal in wanted:
+                    found[ordinal] = response
+                if ordinal >= last:
+                    break
+        return [found[ordinal] for ordinal in ordinals if ordinal in found]
+
+    def response_counts(self) -> Dict[str, int]:
+        """Количество ответов по каждой анкете"""
+        return count_by_survey(self.iter_responses())
+
+    def count_responses(self, survey_id: str) -> int:
+        return self.response_counts().get(survey_id, 0)
+
+    def delete_responses(self, survey_id: str):
+        """Удаляем все ответы анкеты"""
+        raise NotImplementedError
+
+    def responses_version(self, survey_id: str) -> str:
+        """Метка состояния ответов анкеты: меняется при любом их изменении"""
+        return str(self.count_responses(survey_id))
+
+    def begin_response_import(self) -> "ResponseImport":
+        """Начинаем пакетную замену всех ответов (можно вызывать из другого потока)"""
+        raise NotImplementedError
+
+    def begin_response_merge(self) -> "ResponseMerge":
+        """Начинаем пакетное слияние ответов по id (можно вызывать из другого потока)"""
+        raise NotImplementedError
+
+    def close(self):
+        """Закрываем хранилище"""
+
+
+class ResponseImport:
+    """Пакетная запись ответов при импорте: add() пачками, затем commit() или abort()
+
+    До commit() существующие ответы не затрагиваются.
+    """
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.total = 0
+
+    def add(self, responses: List[Dict]):
+        for response in responses:
+            survey_id = response.get('surveyId')
+            self.counts[survey_id] = self.counts.get(survey_id, 0) + 1
+        self.total += len(responses)
+
+    def stats(self) -> Dict[str, int]:
+        """Итоги импорта для отчета"""
+        return {'responses': self.total}
+
+    def commit(self):
+        raise NotImplementedError
+
+    def abort(self):
+        raise NotImplementedError
+
+
+def same_response(a: Dict, b: Dict) -> bool:
+    """Совпадают ли два ответа по содержимому"""
+    return (a.get('surveyId') == b.get('surveyId') and
+            a.get('completedAt') == b.get('completedAt') and
+            a.get('answers') == b.get('answers'))
+
+
+class ResponseMerge(ResponseImport):
+    """Слияние ответов с уже сохраненными по id (uuid4) без замены существующих
+
+    Новые id добавляются, совпадающие по содержимому считаются дубликатами,
+    а отличающиеся - конфликтами (сохраняется локальная версия).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.duplicates = 0
+        self.conflicts = 0
+
+    def add(self, responses: List[Dict]):
+        found = self._find_existing([r['id'] for r in responses])
+        new_responses = []
+        for response in responses:
+            existing = found.get(response['id'])
+            if existing is None:
+                new_responses.append(response)
+                # Повтор внутри той же пачки тоже должен считаться дубликатом
+                found[response['id']] = response
+            elif same_response(existing, response):
+                self.duplicates += 1
+            else:
+                self.conflicts += 1
+        if new_responses:
+            self._insert(new_responses)
+            super().add(new_responses)
+
+    def stats(self) -> Dict[str, int]:
+        return {'new': self.total, 'duplicates': self.duplicates, 'conflicts': self.conflicts}
+
+    def _find_existing(self, ids: List[str]) -> Dict[str, Dict]:
+        """Уже сохраненные ответы с данными id"""
+        raise NotImplementedError
+
+    def _insert(self, responses: List[Dict]):
+        raise NotImplementedError
+
+
+class JsonResponseImport(ResponseImport):
+    """Импорт в JSON: новые шарды пишутся во временный каталог по одной записи
+
+    При commit() каталог шардов подменяется целиком.
+    """
+
+    def __init__(self, storage: "JsonStorage"):
+        super().__init__()
+        self.storage = storage
+        self.temp_dir = storage.responses_dir + ".import"
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        os.makedirs(self.temp_dir)
+        self.files = {}
+
+    def add(self, responses: List[Dict]):
+        for response in responses:
+            survey_id = response.get('surveyId')
+            f = self.files.get(survey_id)
+            if f is None:
+                f = open(os.path.join(self.temp_dir, shard_name(survey_id) + ".json"), 'w', encoding='utf-8')
+                f.write("[\n")
+                self.files[survey_id] = f
+            else:
+                f.write(",\n")
+            f.write(json.dumps(response, ensure_ascii=False))
+        super().add(responses)
+
+    def commit(self):
+        for f in self.files.values():
+            f.write("\n]\n")
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        fsync_directory(self.temp_dir)
+        self.storage.replace_shards(self.temp_dir)
+        self.storage._write_counts(self.counts)
+
+    def abort(self):
+        for f in self.files.values():
+            f.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+class JsonResponseMerge(ResponseMerge):
+    """Слияние в JSON: хеш-индекс id по истории, новые ответы - в журналы шардов при commit()"""
+
+    def __init__(self, storage: "JsonStorage"):
+        super().__init__()
+        self.storage = storage
+        # Шарды читаются своими объектами, а не кэшем хранилища: слияние
+        # идет в фоновом потоке и не должно загружать историю в его память
+        self.shards: Dict[str, Sequence[Dict]] = {}
+        # id -> (анкета, номер в шарде): сами ответы не копируются
+        self.index = {}
+        try:
+            for survey_id in storage.survey_ids():
+                shard = self.shards[survey_id] = self._open_shard(survey_id)
+                for row in range(len(shard)):
+                    self.index[self._record_id(shard, row)] = (survey_id, row)
+        except Exception:
+            self._close_shards()
+            raise
+        self.added = {}
+        self.files = {}
+
+    def _open_shard(self, survey_id: str) -> Sequence[Dict]:
+        """Ответы шарда через mmap; снимок другого вида или только .bak - списком"""
+        journal = self.storage.shard(survey_id)
+        if os.path.exists(journal.snapshot_file) or not os.path.exists(journal.snapshot_file + BACKUP_SUFFIX):
+            try:
+                return MappedResponses(journal.snapshot_file, journal.journal_file)
+            except (OSError, ValueError) as e:
+                print(f"Ошибка чтения шарда {os.path.basename(journal.snapshot_file)} через mmap: {e}")
+        return ResponseJournal(journal.snapshot_file, journal.journal_file).load()
+
+    @staticmethod
+    def _record_id(shard: Sequence[Dict], row: int):
+        if isinstance(shard, MappedResponses):
+            return json.loads(shard.raw(row)).get('id')
+        return shard[row].get('id')
+
+    def _close_shards(self):
+        # Отображения закрываем до записи в шарды (Windows не даст заменить файл)
+        for shard in self.shards.values():
+            if isinstance(shard, MappedResponses):
+                shard.close()
+        self.shards = {}
+
+    def _temp_file(self, survey_id) -> str:
+        return self.storage.shard_path(survey_id) + "l.merge"
+
+    def _find_existing(self, ids: List[str]) -> Dict[str, Dict]:
+        found = {}
+        for response_id in ids:
+            if response_id in self.added:
+                found[response_id] = self.added[response_id]
+            elif response_id in self.index:
+                survey_id, row = self.index[response_id]
+                found[response_id] = self.shards[survey_id][row]
+        return found
+
+    def _insert(self, responses: List[Dict]):
+        for response in responses:
+            survey_id = response['surveyId']
+            f = self.files.get(survey_id)
+            if f is None:
+                f = self.files[survey_id] = open(self._temp_file(survey_id), 'w', encoding='utf-8')
+            f.write(json.dumps(response, ensure_ascii=False) + "\n")
+            self.added[response['id']] = response
+
+    def commit(self):
+        self._close_shards()
+        for f in self.files.values():
+            f.close()
+        counts = self.storage._read_counts()
+        for survey_id in self.files:
+            temp_file = self._temp_file(survey_id)
+            self.storage.shard(survey_id).append_file(temp_file, self.counts[survey_id])
+            os.remove(temp_file)
+        self.storage.reset_cache()
+
+        # Без файла счетчиков они будут пересчитаны при следующем обращении
+        if counts is not None:
+            counts = dict(counts)
+            for survey_id, count in self.counts.items():
+                counts[survey_id] = counts.get(survey_id, 0) + count
+            self.storage._write_counts(counts)
+
+    def abort(self):
+        self._close_shards()
+        for survey_id, f in self.files.items():
+            f.close()
+            os.remove(self._temp_file(survey_id))
+
+
+def shard_name(survey_id: str) -> str:
+    """Имя файла шарда по id анкеты (обратимо, без недопустимых в путях символов)"""
+    return quote(survey_id, safe='-_')
+
+
+class JsonStorage(SurveyStorage):
+    """Хранилище в JSON-файлах: surveys.json и по шарду ответов на каждую анкету
+
+    Ответы анкеты лежат отдельно: responses/<id анкеты>.json (снимок) и
+    .jsonl (журнал), поэтому новый ответ, просмотр и экспорт затрагивают
+    только файлы своей анкеты, а удаление анкеты - это удаление двух файлов.
+    Просмотр и экспорт читают снимок через mmap по индексу смещений
+    (.json.idx), не загружая историю в память.
+    """
+
+    name = "json"
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.surveys_file = os.path.join(data_dir, "surveys.json")
+        self.responses_dir = os.path.join(data_dir, RESPONSES_DIRNAME)
+        # Счетчики ответов по анкетам, обновляемые при каждом сохранении
+        self.counts_file = os.path.join(data_dir, "response_counts.json")
+        self._shards = {}
+        self._responses = {}
+        self._mapped = {}
+        self._counts = None
+        self._recover_shards()
+        self._split_legacy_responses()
+        os.makedirs(self.responses_dir, exist_ok=True)
+
+    def _recover_shards(self):
+        """Доводим до конца подмену каталога шардов, прерванную сбоем"""
+        old_dir = self.responses_dir + ".old"
+        if os.path.isdir(old_dir):
+            if os.path.isdir(self.responses_dir):
+                shutil.rmtree(old_dir)
+            else:
+                os.replace(old_dir, self.responses_dir)
+
+    def _split_legacy_responses(self):
+        """Однократно раскладываем общий responses.json(l) по шардам анкет
+
+        Старые файлы остаются рядом с суффиксом .unsharded как резервная копия.
+        """
+        legacy = ResponseJournal(os.path.join(self.data_dir, "responses.json"),
+                                 os.path.join(self.data_dir, "responses.jsonl"))
+        legacy_files = [path for path in (legacy.snapshot_file, legacy.journal_file) if os.path.exists(path)]
+        if not legacy_files:
+            return
+
+        if not os.path.isdir(self.responses_dir):
+            try:
+                responses = legacy.load()
+            except Exception as e:
+                print(f"Ошибка загрузки ответов: {e}")
+                return
+            temp_dir = self.responses_dir + ".sharding"
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            os.makedirs(temp_dir)
+            groups = {}
+            for response in responses:
+                groups.setdefault(response.get('surveyId'), []).append(response)
+            for survey_id, survey_responses in groups.items():
+                write_records_atomic(os.path.join(temp_dir, shard_name(survey_id) + ".json"), survey_responses)
+            replace_file(temp_dir, self.responses_dir)
+
+        for path in legacy_files:
+            os.replace(path, path + ".unsharded")
+
+    def shard_path(self, survey_id: str) -> str:
+        """Путь к снимку шарда анкеты (журнал - тот же путь с суффиксом l)"""
+        return os.path.join(self.responses_dir, shard_name(survey_id) + ".json")
+
+    def shard(self, survey_id: str) -> ResponseJournal:
+        journal = self._shards.get(survey_id)
+        if journal is None:
+            snapshot_file = self.shard_path(survey_id)
+            journal = self._shards[survey_id] = ResponseJournal(snapshot_file, snapshot_file + "l")
+        return journal
+
+    def survey_ids(self) -> List[str]:
+        """Анкеты, у которых есть шард ответов"""
+        ids = set()
+        for filename in os.listdir(self.responses_dir):
+            base, ext = os.path.splitext(filename)
+            if ext in (".json", ".jsonl"):
+                ids.add(unquote(base))
+        return sorted(ids)
+
+    def load_surveys(self) -> List[Dict]:
+        return read_json_file(self.surveys_file, [])
+
+    def save_surveys(self, surveys: List[Dict]):
+        write_json_atomic(self.surveys_file, surveys, keep_backup=True, indent=2)
+
+    def load_survey_responses(self, survey_id: str) -> CompactResponses:
+        """Ответы одной анкеты - читается только ее шард
+
+        В памяти ответы держатся в компактном виде (CompactResponses).
+        """
+        responses = self._responses.get(survey_id)
+        if responses is None:
+            self._close_mapped(survey_id)
+            journal = self.shard(survey_id)
+            responses = self._responses[survey_id] = CompactResponses(survey_id, journal.load())
+            # История уже разобрана - удобный момент свернуть журнал
+            if journal.needs_compaction():
+                journal.compact(responses)
+        return responses
+
+    def open_survey_responses(self, survey_id: str) -> Sequence[Dict]:
+        """Ответы анкеты для чтения: уже загруженные в память или с диска через mmap
+
+        Снимок, который нельзя прочитать по индексу (другой формат,
+        повреждение, восстановление из .bak), загружается обычным образом.
+        """
+        if survey_id in self._responses:
+            return self._responses[survey_id]
+        journal = self.shard(survey_id)
+        mapped = self._mapped.get(survey_id)
+        if mapped is not None and mapped.is_current():
+            mapped.refresh()
+        else:
+            self._close_mapped(survey_id)
+            if not os.path.exists(journal.snapshot_file) and os.path.exists(journal.snapshot_file + BACKUP_SUFFIX):
+                return self.load_survey_responses(survey_id)
+            try:
+                mapped = self._mapped[survey_id] = MappedResponses(journal.snapshot_file, journal.journal_file)
+            except (OSError, ValueError) as e:
+                print(f"Ошибка чтения шарда {os.path.basename(journal.snapshot_file)} через mmap: {e}")
+                return self.load_survey_responses(survey_id)
+
+        journal.pending_count = len(mapped.journal)
+        if journal.needs_compaction():
+            mapped = self._compact_mapped(survey_id, mapped)
+        return mapped
+
+    def _compact_mapped(self, survey_id: str, mapped: MappedResponses) -> MappedResponses:
+        """Сворачиваем журнал шарда, копируя записи байтами из отображенного снимка"""
+        journal = self.shard(survey_id)
+        temp_file = journal.snapshot_file + ".compact"
+        offsets = mapped.write_snapshot(temp_file)
+        # Отображенный файл на Windows нельзя заменить
+        self._close_mapped(survey_id)
+        journal.replace_snapshot(temp_file)
+        stat = os.stat(journal.snapshot_file)
+        write_index(journal.snapshot_file + INDEX_SUFFIX, offsets, stat.st_size, stat.st_mtime_ns)
+        mapped = self._mapped[survey_id] = MappedResponses(journal.snapshot_file, journal.journal_file)
+        return mapped
+
+    def _close_mapped(self, survey_id: Optional[str] = None):
+        """Закрываем отображения шардов (все или одной анкеты) перед заменой файлов"""
+        survey_ids = list(self._mapped) if survey_id is None else [survey_id]
+        for mapped_survey_id in survey_ids:
+            mapped = self._mapped.pop(mapped_survey_id, None)
+            if mapped is not None:
+                mapped.close()
+
+    def load_responses(self) -> List[Dict]:
+        return list(self.iter_responses())
+
+    def iter_responses(self, survey_id: Optional[str] = None) -> Iterator[Dict]:
+        if survey_id is not None:
+            yield from self.open_survey_responses(survey_id)
+            return
+        for shard_survey_id in self.survey_ids():
+            yield from self.open_survey_responses(shard_survey_id)
+
+    def save_responses(self, responses: List[Dict]):
+        self._close_mapped()
+        groups = {}
+        for response in responses:
+            groups.setdefault(response.get('surveyId'), []).append(response)
+        for survey_id in self.survey_ids():
+            if survey_id not in groups:
+                self.delete_responses(survey_id)
+        for survey_id, survey_responses in groups.items():
+            self.shard(survey_id).compact(survey_responses)
+            self._responses[survey_id] = CompactResponses(survey_id, survey_responses)
+        self._write_counts({survey_id: len(survey_responses) for survey_id, survey_responses in groups.items()})
+
+    def append_response(self, response: Dict):
+        # История ответов при этом не читается
+        survey_id = response['surveyId']
+        self.shard(survey_id).append(response)
+        if survey_id in self._responses:
+            self._responses[survey_id].append(response)
+
+        # Без файла счетчиков не увеличиваем их - он будет пересчитан целиком
+        counts = self._read_counts()
+        if counts is not None:
+            counts[survey_id] = counts.get(survey_id, 0) + 1
+            self._write_counts(counts)
+
+    def delete_responses(self, survey_id: str):
+        self._close_mapped(survey_id)
+        journal = self.shard(survey_id)
+        for path in (journal.snapshot_file, journal.journal_file, journal.snapshot_file + BACKUP_SUFFIX,
+                     journal.snapshot_file + INDEX_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+        self._shards.pop(survey_id, None)
+        self._responses.pop(survey_id, None)
+
+        counts = self._read_counts()
+        if counts is not None and survey_id in counts:
+            counts = dict(counts)
+            del counts[survey_id]
+            self._write_counts(counts)
+
+    def responses_page(self, survey_id: str, offset: int, limit: int) -> List[Dict]:
+        return self.open_survey_responses(survey_id)[offset:offset + limit]
+
+    def responses_at(self, survey_id: str, ordinals: List[int]) -> List[Dict]:
+        responses = self.open_survey_responses(survey_id)
+        return [responses[ordinal] for ordinal in ordinals if 0 <= ordinal < len(responses)]
+
+    def responses_version(self, survey_id: str) -> str:
+        journal = self.shard(survey_id)
+        parts = []
+        for path in (journal.snapshot_file, journal.journal_file):
+            try:
+                stat = os.stat(path)
+                parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+            except FileNotFoundError:
+                parts.append("-")
+        return "/".join(parts)
+
+    def begin_response_import(self) -> ResponseImport:
+        return JsonResponseImport(self)
+
+    def begin_response_merge(self) -> ResponseMerge:
+        return JsonResponseMerge(self)
+
+    def replace_shards(self, new_dir: str):
+        """Подменяем каталог шардов готовым (после импорта)"""
+        self.reset_cache()
+        old_dir = self.responses_dir + ".old"
+        os.replace(self.responses_dir, old_dir)
+        replace_file(new_dir, self.responses_dir)
+        shutil.rmtree(old_dir)
+
+    def reset_cache(self):
+        """Забываем загруженные ответы (после замены файлов)"""
+        self._close_mapped()
+        self._shards = {}
+        self._responses = {}
+
+    def response_counts(self) -> Dict[str, int]:
+        counts = self._read_counts()
+        if counts is None:
+            counts = {survey_id: len(self.open_survey_responses(survey_id)) for survey_id in self.survey_ids()}
+            self._write_counts(counts)
+        return dict(counts)
+
+    def _read_counts(self) -> Optional[Dict[str, int]]:
+        if self._counts is None and os.path.exists(self.counts_file):
+            try:
+                with open(self.counts_file, 'r', encoding='utf-8') as f:
+                    self._counts = json.load(f)
+            except Exception as e:
+                print(f"Ошибка загрузки счетчиков ответов: {e}")
+        return self._counts
+
+    def _write_counts(self, counts: Dict[str, int]):
+        # Счетчики восстанавливаются пересчетом, резервная копия не нужна
+        write_json_atomic(self.counts_file, counts)
+        self._counts = counts
+
+    def close(self):
+        self._close_mapped()
+
+
+class SqliteStorage(SurveyStorage):
+    """Хранилище во встроенной базе SQLite (режим WAL)
+
+    Анкеты разложены по таблицам surveys/questions/conditions, ответы -
+    по одной строке в responses с индексом по анкете, поэтому новый ответ -
+    это одна вставка, а подсчет ответов - запрос по индексу.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS surveys (
+            id TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            created_at TEXT,
+            is_active INTEGER NOT NULL DEFAULT 1,
+            extra TEXT
+        );
+        CREATE TABLE IF NOT EXISTS questions (
+            survey_id TEXT NOT NULL REFERENCES surveys(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            type TEXT NOT NULL,
+            required INTEGER NOT NULL DEFAULT 0,
+            options TEXT,
+            extra TEXT,
+            PRIMARY KEY (survey_id, position)
+        );
+        CREATE TABLE IF NOT EXISTS conditions (
+            survey_id TEXT NOT NULL REFERENCES surveys(id) ON DELETE CASCADE,
+            question_position INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            id TEXT,
+            target_id TEXT NOT NULL,
+            operator TEXT NOT NULL,
+            value TEXT,
+            PRIMARY KEY (survey_id, question_position, position)
+        );
+        CREATE INDEX IF NOT EXISTS idx_conditions_target ON conditions(survey_id, target_id);
+        CREATE TABLE IF NOT EXISTS responses (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT NOT NULL UNIQUE,
+            survey_id TEXT NOT NULL,
+            completed_at TEXT,
+            answers TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_responses_survey ON responses(survey_id, seq);
+        CREATE INDEX IF NOT EXISTS idx_responses_completed ON responses(completed_at);
+        CREATE TABLE IF NOT EXISTS response_counts (
+            survey_id TEXT PRIMARY KEY,
+            total INTEGER NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS trg_responses_count_insert AFTER INSERT ON responses
+        BEGIN
+            INSERT INTO response_counts (survey_id, total) VALUES (NEW.survey_id, 1)
+            ON CONFLICT(survey_id) DO UPDATE SET total = total + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_responses_count_delete AFTER DELETE ON responses
+        BEGIN
+            UPDATE response_counts SET total = total - 1 WHERE survey_id = OLD.survey_id;
+        END;
+    """
+
+    SURVEY_KEYS = ('id', 'title', 'questions', 'createdAt', 'isActive')
+    QUESTION_KEYS = ('id', 'text', 'type', 'required', 'options', 'conditions')
+    CONDITION_KEYS = ('id', 'targetId', 'operator', 'value')
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.connection = self.connect(db_file)
+        self.connection.executescript(self.SCHEMA)
+        self._init_counts()
+        # (анкета, номер строки) -> seq предыдущей строки, для постраничного чтения
+        self._page_keys = {}
+        # Анкета -> seq ответов по порядку, для чтения ответов по номерам
+        self._seqs = {}
+
+    @staticmethod
+    def connect(db_file: str) -> sqlite3.Connection:
+        # Соединение используется и потоком сохранения приложения; обращения
+        # из разных потоков не пересекаются (GUI ждет очередь записи)
+        connection = sqlite3.connect(db_file, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # FULL: каждый записанный ответ переживает и сбой питания (как fsync журнала JSON)
+        connection.execute("PRAGMA synchronous=FULL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    def _init_counts(self):
+        """Заполняем счетчики для базы, созданной до их появления"""
+        db = self.connection
+        if db.execute("SELECT 1 FROM response_counts LIMIT 1").fetchone() is None and \
+                db.execute("SELECT 1 FROM responses LIMIT 1").fetchone() is not None:
+            with db:
+                db.execute("INSERT INTO response_counts (survey_id, total) "
+                           "SELECT survey_id, COUNT(*) FROM responses GROUP BY survey_id")
+
+    def load_surveys(self) -> List[Dict]:
+        db = self.connection
+        questions = {}
+        for survey_id, position, qid, text, qtype, required, options, extra in db.execute(
+                "SELECT survey_id, position, id, text, type, required, options, extra "
+                "FROM questions ORDER BY survey_id, position"):
+            question = {
+                'id': qid,
+                'text': text,
+                'type': qtype,
+                'required': bool(required),
+                'options': json.loads(options) if options else [],
+                'conditions': [],
+            }
+            if extra:
+                question.update(json.loads(extra))
+            questions.setdefault(survey_id, {})[position] = question
+
+        for survey_id, question_position, cid, target_id, operator, value in db.execute(
+                "SELECT survey_id, question_position, id, target_id, operator, value "
+                "FROM conditions ORDER BY survey_id, question_position, position"):
+            condition = {'id': cid, 'targetId': target_id, 'operator': operator, 'value': value}
+            if cid is None:
+                del condition['id']
+            questions[survey_id][question_position]['conditions'].append(condition)
+
+        surveys = []
+        for survey_id, title, created_at, is_active, extra in db.execute(
+                "SELECT id, title, created_at, is_active, extra FROM surveys ORDER BY position"):
+            survey_questions = questions.get(survey_id, {})
+            survey = {
+                'id': survey_id,
+                'title': title,
+                'questions': [survey_questions[p] for p in sorted(survey_questions)],
+                'createdAt': created_at,
+                'isActive': bool(is_active),
+            }
+            if extra:
+                survey.update(json.loads(extra))
+            surveys.append(survey)
+        return surveys
+
+    def save_surveys(self, surveys: List[Dict]):
+        with self.connection as db:
+            db.execute("DELETE FROM conditions")
+            db.execute("DELETE FROM questions")
+            db.execute("DELETE FROM surveys")
+            for position, survey in enumerate(surveys):
+                self._insert_survey(db, position, survey)
+
+    def _insert_survey(self, db, position: int, survey: Dict):
+        """Раскладываем анкету по таблицам"""
+        survey_id = survey['id']
+        db.execute(
+            "INSERT INTO surveys (id, position, title, created_at, is_active, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (survey_id, position, survey.get('title', ''), survey.get('createdAt'),
+             int(survey.get('isActive', True)), self._extra(survey, self.SURVEY_KEYS)))
+        for question_position, question in enumerate(survey.get('questions', [])):
+            db.execute(
+                "INSERT INTO questions (survey_id, position, id, text, type, required, options, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (survey_id, question_position, question['id'], question.get('text', ''),
+                 question.get('type', 'text'), int(question.get('required', False)),
+                 json.dumps(question.get('options', []), ensure_ascii=False),
+                 self._extra(question, self.QUESTION_KEYS)))
+            db.executemany(
+                "INSERT INTO conditions (survey_id, question_position, position, id, target_id, operator, value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(survey_id, question_position, i, c.get('id'), c['targetId'], c['operator'], c.get('value'))
+                 for i, c in enumerate(question.get('conditions', []))])
+
+    @staticmethod
+    def _extra(record: Dict, known_keys) -> Optional[str]:
+        """Поля, для которых нет отдельных столбцов, храним как JSON"""
+        extra = {k: v for k, v in record.items() if k not in known_keys}
+        return json.dumps(extra, ensure_ascii=False) if extra else None
+
+    @staticmethod
+    def _response_row(response: Dict):
+        return (response['id'], response['surveyId'], response.get('completedAt'),
+                json.dumps(response.get('answers', {}), ensure_ascii=False))
+
+    @staticmethod
+    def _response_from_row(row) -> Dict:
+        response_id, survey_id, completed_at, answers = row
+        return {
+            'id': response_id,
+            'surveyId': survey_id,
+            'answers': json.loads(answers),
+            'completedAt': completed_at,
+        }
+
+    def load_responses(self) -> List[Dict]:
+        return list(self.iter_responses())
+
+    def iter_responses(self, survey_id: Optional[str] = None) -> Iterator[Dict]:
+        if survey_id is None:
+            cursor = self.connection.execute(
+                "SELECT id, survey_id, completed_at, answers FROM responses ORDER BY seq")
+        else:
+            cursor = self.connection.execute(
+                "SELECT id, survey_id, completed_at, answers FROM responses "
+                "WHERE survey_id = ? ORDER BY seq", (survey_id,))
+        for row in cursor:
+            yield self._response_from_row(row)
+
+    def iter_responses_since(self, since: Optional[str]) -> Iterator[Dict]:
+        if since is None:
+            yield from self.iter_responses()
+            return
+        cursor = self.connection.execute(
+            "SELECT id, survey_id, completed_at, answers FROM responses "
+            "WHERE completed_at > ? ORDER BY completed_at", (since,))
+        for row in cursor:
+            yield self._response_from_row(row)
+
+    def responses_page(self, survey_id: str, offset: int, limit: int) -> List[Dict]:
+        # Последовательное чтение страниц продолжается от seq последней строки
+        # предыдущей страницы (по индексу), а не пропуском offset строк
+        last_seq = self._page_keys.get((survey_id, offset))
+        if last_seq is not None:
+            cursor = self.connection.execute(
+                "SELECT seq, id, survey_id, completed_at, answers FROM responses "
+                "WHERE survey_id = ? AND seq > ? ORDER BY seq LIMIT ?", (survey_id, last_seq, limit))
+        else:
+            cursor = self.connection.execute(
+                "SELECT seq, id, survey_id, completed_at, answers FROM responses "
+                "WHERE survey_id = ? ORDER BY seq LIMIT ? OFFSET ?", (survey_id, limit, offset))
+        rows = cursor.fetchall()
+        if rows:
+            self._page_keys[(survey_id, offset + len(rows))] = rows[-1][0]
+        return [self._response_from_row(row[1:]) for row in rows]
+
+    def _survey_seqs(self, survey_id: str) -> array:
+        """seq ответов анкеты по порядку (из индекса, без чтения самих ответов)"""
+        seqs = self._seqs.get(survey_id)
+        count = self.count_responses(survey_id)
+        if seqs and len(seqs) < count:
+            # Новые ответы дописываются в конец - дочитываем только их
+            seqs.extend(row[0] for row in self.connection.execute(
+                "SELECT seq FROM responses WHERE survey_id = ? AND seq > ? ORDER BY seq", (survey_id, seqs[-1])))
+        if seqs is None or len(seqs) != count:
+            seqs = self._seqs[survey_id] = array('q', (row[0] for row in self.connection.execute(
+                "SELECT seq FROM responses WHERE survey_id = ? ORDER BY seq", (survey_id,))))
+        return seqs
+
+    def responses_at(self, survey_id: str, ordinals: List[int]) -> List[Dict]:
+        seqs = self._survey_seqs(survey_id)
+        wanted = [seqs[ordinal] for ordinal in ordinals if 0 <= ordinal < len(seqs)]
+        found = {}
+        for start in range(0, len(wanted), SqliteResponseMerge.LOOKUP_CHUNK):
+            chunk = wanted[start:start + SqliteResponseMerge.LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            for row in self.connection.execute(
+                    f"SELECT seq, id, survey_id, completed_at, answers FROM responses WHERE seq IN ({placeholders})",
+                    chunk):
+                found[row[0]] = self._response_from_row(row[1:])
+        return [found[seq] for seq in wanted if seq in found]
+
+    def save_responses(self, responses: List[Dict]):
+        self._page_keys = {}
+        self._seqs = {}
+        with self.connection as db:
+            db.execute("DELETE FROM responses")
+            self.insert_responses(responses, db)
+
+    def insert_responses(self, responses, db=None):
+        """Пакетная вставка ответов (повторы по id пропускаются)"""
+        self.insert_responses_into(db or self.connection, responses)
+
+    @classmethod
+    def insert_responses_into(cls, db: sqlite3.Connection, responses):
+        db.executemany(
+            "INSERT OR IGNORE INTO responses (id, survey_id, completed_at, answers) VALUES (?, ?, ?, ?)",
+            (cls._response_row(r) for r in responses))
+
+    def append_response(self, response: Dict):
+        with self.connection as db:
+            self.insert_responses([response], db)
+
+    def begin_response_import(self) -> ResponseImport:
+        self._page_keys = {}
+        self._seqs = {}
+        return SqliteResponseImport(self.db_file)
+
+    def begin_response_merge(self) -> ResponseMerge:
+        return SqliteResponseMerge(self.db_file)
+
+    def response_counts(self) -> Dict[str, int]:
+        # Счетчики поддерживаются триггерами - одна строка на анкету
+        return dict(self.connection.execute(
+            "SELECT survey_id, total FROM response_counts WHERE total > 0"))
+
+    def count_responses(self, survey_id: str) -> int:
+        row = self.connection.execute(
+            "SELECT total FROM response_counts WHERE survey_id = ?", (survey_id,)).fetchone()
+        return row[0] if row else 0
+
+    def responses_version(self, survey_id: str) -> str:
+        count, last_seq = self.connection.execute(
+            "SELECT COUNT(*), MAX(seq) FROM responses WHERE survey_id = ?", (survey_id,)).fetchone()
+        return f"{self.db_file}:{count}:{last_seq}"
+
+    def delete_responses(self, survey_id: str):
+        with self.connection as db:
+            db.execute("DELETE FROM responses WHERE survey_id = ?", (survey_id,))
+            db.execute("DELETE FROM response_counts WHERE survey_id = ?", (survey_id,))
+        self._page_keys = {}
+        self._seqs.pop(survey_id, None)
+
+    def close(self):
+        self.connection.close()
+
+
+class SqliteResponseImport(ResponseImport):
+    """Импорт в SQLite: одна транзакция в собственном соединении потока импорта"""
+
+    def __init__(self, db_file: str):
+        super().__init__()
+        self.connection = SqliteStorage.connect(db_file)
+        self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.execute("DELETE FROM responses")
+
+    def add(self, responses: List[Dict]):
+        super().add(responses)
+        SqliteStorage.insert_responses_into(self.connection, responses)
+
+    def commit(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def abort(self):
+        self.connection.rollback()
+        self.connection.close()
+
+
+class SqliteResponseMerge(ResponseMerge):
+    """Слияние в SQLite: поиск по уникальному индексу id, одна транзакция"""
+
+    # Ограничение SQLite на число параметров запроса
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, db_file: str):
+        super().__init__()
+        self.connection = SqliteStorage.connect(db_file)
+        self.connection.execute("BEGIN IMMEDIATE")
+
+    def _find_existing(self, ids: List[str]) -> Dict[str, Dict]:
+        found = {}
+        for start in range(0, len(ids), self.LOOKUP_CHUNK):
+            chunk = ids[start:start + self.LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            for row in self.connection.execute(
+                    f"SELECT id, survey_id, completed_at, answers FROM responses WHERE id IN ({placeholders})",
+                    chunk):
+                found[row[0]] = SqliteStorage._response_from_row(row)
+        return found
+
+    def _insert(self, responses: List[Dict]):
+        SqliteStorage.insert_responses_into(self.connection, responses)
+
+    def commit(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def abort(self):
+        self.connection.rollback()
+        self.connection.close()
+
+
+def migrate_json_to_sqlite(data_dir: str, db_file: Optional[str] = None) -> Dict[str, int]:
+    """Однократно переносим surveys.json/responses.json в базу SQLite
+
+    Ответы в JSON не удаляются и остаются резервной копией, но чтение
+    идет через JsonStorage: старые responses.json и журнал, если они
+    еще не разбиты по анкетам, раскладываются по файлам responses/ и
+    переименовываются с суффиксом .unsharded.
+    """
+    db_file = db_file or os.path.join(data_dir, SQLITE_FILENAME)
+    source = JsonStorage(data_dir)
+    surveys = source.load_surveys()
+    responses = source.iter_responses()
+    count = 0
+
+    temp_file = db_file + ".migrating"
+    for path in (temp_file, temp_file + "-wal", temp_file + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+    target = SqliteStorage(temp_file)
+    try:
+        target.save_surveys(surveys)
+        with target.connection as db:
+            while True:
+                batch = list(itertools.islice(responses, MIGRATION_BATCH_SIZE))
+                if not batch:
+                    break
+                target.insert_responses(batch, db)
+                count += len(batch)
+        target.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        target.close()
+    replace_file(temp_file, db_file)
+    return {'surveys': len(surveys), 'responses': count}
+
+
+def open_storage(data_dir: str, backend: str = "json") -> SurveyStorage:
+    """Открываем хранилище выбранного типа"""
+    if backend == SqliteStorage.name:
+        db_file = os.path.join(data_dir, SQLITE_FILENAME)
+        if not os.path.exists(db_file):
+            migrate_json_to_sqlite(data_dir, db_file)
+        return SqliteStorage(db_file)
+    return JsonStorage(data_dir)